@@ -0,0 +1,136 @@
+'''
+Compact binary framing of detection messages
+
+One frame is sent per video frame and carries all the targets of that
+frame (little endian):
+
+    header  sync (0xA5 0x5A), kind (u8), count (u8), frame counter (u32), timestamp in ms (u32)
+    targets count records of id (u8), flags (u8), x, y, w, h (i16, in 1/10 units)
+    crc     CRC-16/CCITT (u16) of kind to the last record
+
+The kind tells how to read the records (see KIND_* below), e.g. for
+KIND_MAILBOX the id is the mark, the flags the rank of the detection for
+this mark, x, y in mm in image frame and w, h in pixels like the N2 text
+message. Values are clamped to the i16 range.
+
+The Decoder class parses a byte stream (with resynchronization on errors)
+and is used on the host side by Offline/decode_serial.py.
+'''
+
+import binascii
+import os
+import struct
+
+SYNC = b'\xa5\x5a'
+HEADER = struct.Struct('<2sBBII')
+RECORD = struct.Struct('<BBhhhh')
+CRC = struct.Struct('<H')
+MAX_TARGETS = 255
+SCALE = 10. # fixed point scale of x, y, w, h
+
+KIND_POS = 1 # UavLedDetector blobs (id: rank)
+KIND_TRK = 2 # UavLedDetector tracks (id: track id, flags: frames since last detection, 0 if measured)
+KIND_MAILBOX = 3 # ImavMailbox markers (id: mark)
+KIND_FACE = 4 # FaceDetect face (x, y in T2 units, flags 1 if tracked)
+
+KIND_NAMES = { KIND_POS: 'POS', KIND_TRK: 'TRK', KIND_MAILBOX: 'N2', KIND_FACE: 'T2' }
+
+def fixed(v):
+    return max(-32768, min(32767, int(round(v * SCALE))))
+
+def encode_frame(kind, frame, timestamp, targets):
+    '''
+    return the binary frame of a list of targets (id, flags, x, y, w, h)
+    frame: frame counter
+    timestamp: capture time in ms (wraps at 2^32)
+    '''
+    targets = targets[:MAX_TARGETS]
+    body = [HEADER.pack(SYNC, kind, len(targets), frame & 0xffffffff, int(timestamp) & 0xffffffff)]
+    for (i, flags, x, y, w, h) in targets:
+        body.append(RECORD.pack(i & 0xff, flags & 0xff, fixed(x), fixed(y), fixed(w), fixed(h)))
+    data = b''.join(body)
+    return data + CRC.pack(binascii.crc_hqx(data[2:], 0xffff))
+
+def frame_size(count):
+    return HEADER.size + count * RECORD.size + CRC.size
+
+class Decoder:
+    '''
+    incremental decoder of a binary byte stream
+    '''
+
+    def __init__(self):
+        self.buf = b''
+        self.frames = 0
+        self.crc_errors = 0
+        self.skipped = 0 # bytes skipped to find the next frame
+
+    def feed(self, data):
+        '''
+        add received bytes, return the list of decoded frames
+        (kind, frame counter, timestamp, [(id, flags, x, y, w, h)])
+        '''
+        self.buf += data
+        frames = []
+        while True:
+            start = self.buf.find(SYNC)
+            if start < 0:
+                # keep last byte in case it is the first sync byte
+                self.skipped += max(0, len(self.buf) - 1)
+                self.buf = self.buf[-1:]
+                break
+            if start > 0:
+                self.skipped += start
+                self.buf = self.buf[start:]
+            if len(self.buf) < HEADER.size:
+                break
+            _, kind, count, frame, timestamp = HEADER.unpack_from(self.buf)
+            size = frame_size(count)
+            if len(self.buf) < size:
+                break
+            crc = CRC.unpack_from(self.buf, size - CRC.size)[0]
+            if crc != binascii.crc_hqx(self.buf[2:size - CRC.size], 0xffff):
+                # not a valid frame, search next sync
+                self.crc_errors += 1
+                self.skipped += 1
+                self.buf = self.buf[1:]
+                continue
+            targets = []
+            for n in range(count):
+                (i, flags, x, y, w, h) = RECORD.unpack_from(self.buf, HEADER.size + n * RECORD.size)
+                targets.append((i, flags, x / SCALE, y / SCALE, w / SCALE, h / SCALE))
+            frames.append((kind, frame, timestamp, targets))
+            self.frames += 1
+            self.buf = self.buf[size:]
+        return frames
+
+def format_frame(frame):
+    '''
+    return a text line of a decoded frame
+    '''
+    (kind, counter, timestamp, targets) = frame
+    name = KIND_NAMES.get(kind, str(kind))
+    return "{} {} {} {}".format(counter, timestamp, name, " ".join(
+        "[{} {:.1f} {:.1f} {:.1f} {:.1f}]".format(i, x, y, w, h) for (i, _, x, y, w, h) in targets))
+
+class BinaryPort:
+    '''
+    raw output to a serial device (or pseudo-terminal)
+    the JeVois engine should not send its own messages to the same port (e.g. 'setpar serout None')
+    '''
+
+    def __init__(self, device):
+        self.device = device
+        self.fd = os.open(device, os.O_WRONLY | os.O_NOCTTY)
+
+    def write(self, data):
+        view = memoryview(data)
+        while len(view) > 0:
+            n = os.write(self.fd, view)
+            view = view[n:]
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
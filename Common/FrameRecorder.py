@@ -0,0 +1,255 @@
+'''
+Asynchronous frame recorder for JeVois Python modules
+
+Frames given by the module are copied into a fixed pool of buffers and
+written by a background thread, so encoding and storage never block the
+frame thread. When the writer falls behind and all buffers are waiting,
+the oldest waiting frame is dropped.
+
+Usage in a module:
+
+    self.recorder = FrameRecorder()
+    ...
+    # in process, after detection
+    self.recorder.add(img, self.frame, stamp, results, {"alt": self.alt})
+
+A recording session ('record start [jpg|raw]') keeps one frame every N
+('record every N') in DIR/rec_DATE_TIME (with a _N suffix if a session
+of the same second exists):
+- jpg: one JPEG file per frame (DIR/rec_DATE_TIME_FRAME.jpg)
+- raw: all frames appended without encoding to DIR/rec_DATE_TIME.raw
+and an index DIR/rec_DATE_TIME.jsonl with one JSON line per frame: frame
+counter, timestamp (ms), shape, file name or byte offset, detection results
+(list of tuples of numbers) and the extra values given by the module.
+
+'record snapshot [NAME]' saves the next frame to DIR/NAME.png, whether a
+session is running or not. When a frame holding snapshots is dropped,
+its snapshots are taken from the frame replacing it. 'record' reports the
+number of waiting frames and the written, dropped and error counters.
+'''
+
+import collections
+import json
+import os
+import threading
+import time
+import cv2
+import numpy as np
+
+class FrameRecorder:
+    '''
+    pool of frame buffers written to storage by a writer thread
+    '''
+
+    def __init__(self, directory="/jevois/data/images", slots=8, every=1, quality=85):
+        self.directory = directory
+        self.slots = slots # number of frame buffers
+        self.every = every # keep one frame every N in a session
+        self.quality = quality # JPEG quality
+        self.fmt = "jpg" # format of the current session
+        self.buffers = [None] * slots # frame copies, allocated on first use and reused
+        self.free = list(range(slots)) # indexes of the free buffers
+        self.queue = collections.deque() # (buffer index, info) waiting for the writer
+        self.cond = threading.Condition()
+        self.thread = None
+        self.running = False
+        self.session = None # name of the current session, None if not recording
+        self.sessions = set() # names of the sessions started
+        self.count = 0 # frames seen in the current session
+        self.snapshots = [] # names of the requested snapshots
+        self.files = None # (session, raw file, index file) opened by the writer
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0 # discarded because all buffers were waiting
+        self.errors = 0
+        self.last_error = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="recorder")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def start_session(self, fmt="jpg"):
+        '''
+        start a recording session, return its path without extension
+        '''
+        self.start()
+        with self.cond:
+            self.fmt = fmt
+            self.count = 0
+            name = time.strftime("rec_%Y%m%d_%H%M%S")
+            session, n = name, 1
+            # never reopen the files of a session started in the same second
+            while session in self.sessions or os.path.exists(os.path.join(self.directory, session + ".jsonl")):
+                n += 1
+                session = "{}_{}".format(name, n)
+            self.sessions.add(session)
+            self.session = session
+            self.cond.notify()
+            return os.path.join(self.directory, self.session)
+
+    def stop_session(self):
+        '''
+        stop recording, the waiting frames are still written
+        '''
+        with self.cond:
+            self.session = None
+            self.cond.notify()
+
+    def snapshot(self, name):
+        '''
+        save the next frame to name.png, return its path
+        '''
+        self.start()
+        with self.cond:
+            self.snapshots.append(name)
+        return os.path.join(self.directory, name + ".png")
+
+    def add(self, img, frame, timestamp, results=(), meta=None):
+        '''
+        copy a frame for recording if a session or a snapshot needs it
+        frame: frame counter of the module
+        timestamp: capture time in ms
+        results: detection results of the frame, list of tuples of numbers
+        meta: dict of extra values stored in the index (e.g. altitude)
+        return True if the frame was queued
+        '''
+        if self.session is None and len(self.snapshots) == 0:
+            return False
+        with self.cond:
+            session = None
+            if self.session is not None:
+                if self.count % self.every == 0:
+                    session = self.session
+                self.count += 1
+            names, self.snapshots = self.snapshots, []
+            if session is None and len(names) == 0:
+                return False
+            if len(self.free) == 0:
+                # writer is behind, drop the oldest waiting frame but keep its snapshots
+                index, dropped = self.queue.popleft()
+                names = dropped["snapshots"] + names
+                self.free.append(index)
+                self.dropped += 1
+            index = self.free.pop()
+        buf = self.buffers[index]
+        if buf is None or buf.shape != img.shape or buf.dtype != img.dtype:
+            buf = self.buffers[index] = np.empty_like(img)
+        np.copyto(buf, img)
+        info = { "session": session, "fmt": self.fmt, "snapshots": names, "frame": frame,
+                "timestamp": timestamp, "results": results, "meta": meta }
+        with self.cond:
+            self.queue.append((index, info))
+            self.queued += 1
+            self.cond.notify()
+        return True
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.running and len(self.queue) == 0 and (self.files is None or self.session is not None):
+                    self.cond.wait()
+                if not self.running:
+                    break
+                item = self.queue.popleft() if len(self.queue) > 0 else None
+            if item is None:
+                # session stopped and all its frames written
+                self.close_files()
+                continue
+            index, info = item
+            try:
+                self.write(self.buffers[index], info)
+                error = None
+            except Exception as e:
+                error = e
+            with self.cond:
+                self.free.append(index)
+                if error is None:
+                    self.written += 1
+                else:
+                    self.errors += 1
+                    self.last_error = error
+        self.close_files()
+
+    def write(self, buf, info):
+        if info["session"] is not None:
+            self.write_frame(buf, info)
+        for name in info["snapshots"]:
+            path = os.path.join(self.directory, name + ".png")
+            if not cv2.imwrite(path, buf):
+                raise IOError("cannot write " + path)
+
+    def write_frame(self, buf, info):
+        session = info["session"]
+        if self.files is None or self.files[0] != session:
+            self.close_files()
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            base = os.path.join(self.directory, session)
+            raw = open(base + ".raw", "wb") if info["fmt"] == "raw" else None
+            self.files = (session, raw, open(base + ".jsonl", "w"))
+        _, raw, index = self.files
+        entry = { "frame": info["frame"], "timestamp": round(info["timestamp"], 1), "shape": list(buf.shape) }
+        if raw is not None:
+            entry["offset"] = raw.tell()
+            raw.write(buf.data)
+        else:
+            name = "{}_{:06d}.jpg".format(session, info["frame"])
+            if not cv2.imwrite(os.path.join(self.directory, name), buf, [cv2.IMWRITE_JPEG_QUALITY, self.quality]):
+                raise IOError("cannot write " + name)
+            entry["file"] = name
+        entry["results"] = [[round(float(v), 2) for v in r] for r in info["results"]]
+        if info["meta"] is not None:
+            entry.update(info["meta"])
+        index.write(json.dumps(entry) + "\n")
+        index.flush()
+
+    def close_files(self):
+        if self.files is None:
+            return
+        _, raw, index = self.files
+        if raw is not None:
+            raw.close()
+        index.close()
+        self.files = None
+
+    def report(self):
+        with self.cond:
+            return "{} {} every {} waiting {}/{} queued {} written {} dropped {} errors {}".format(
+                    self.session or "off", self.fmt, self.every, len(self.queue), self.slots,
+                    self.queued, self.written, self.dropped, self.errors)
+
+    def parse_command(self, str_list):
+        '''
+        handle 'record start [jpg|raw]', 'record stop', 'record snapshot [NAME]',
+        'record every N', 'record reset' and 'record' commands
+        return the answer or None if not a record command
+        '''
+        if len(str_list) == 0 or str_list[0] != "record":
+            return None
+        if len(str_list) == 1:
+            return self.report()
+        elif len(str_list) == 2 and str_list[1] == "reset":
+            self.reset_stats()
+            return "OK"
+        elif len(str_list) in [2, 3] and str_list[1] == "start":
+            fmt = str_list[2] if len(str_list) == 3 else "jpg"
+            if fmt not in ["jpg", "raw"]:
+                return "ERR: format should be jpg or raw"
+            return self.start_session(fmt)
+        elif len(str_list) == 2 and str_list[1] == "stop":
+            self.stop_session()
+            return "OK"
+        elif len(str_list) in [2, 3] and str_list[1] == "snapshot":
+            name = str_list[2] if len(str_list) == 3 else time.strftime("snap_%Y%m%d_%H%M%S")
+            return self.snapshot(name)
+        elif len(str_list) == 3 and str_list[1] == "every" and str_list[2].isdigit():
+            self.every = max(1, int(str_list[2]))
+            return "OK"
+        return None
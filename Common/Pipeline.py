@@ -0,0 +1,161 @@
+'''
+Pipelined execution of the detection stage of JeVois Python modules
+
+The detection function runs in a worker thread, while the process function
+of the module keeps capturing, rendering and sending frames. Most OpenCV
+calls release the GIL, so the detection can use another core.
+
+Usage in a module:
+
+    self.pipeline = Pipeline(self.detect)
+    self.pipeline.start()
+    ...
+    # in process
+    self.pipeline.submit(gray)
+    res = self.pipeline.poll() # new result or None
+    if res is not None:
+        (seq, result, latency) = res
+
+The queue has a depth of 1: a frame submitted while the previous one is
+still waiting replaces it (and is counted as dropped), so the worker always
+processes the most recent frame. The latency of each result (from submit to
+completion) is stored in a histogram like the stage timings.
+
+Settings used by the detection function should not be changed from another
+thread while the worker runs: call() queues a function that the worker runs
+between two frames (or runs it directly when the worker is stopped).
+'''
+
+import threading
+import time
+from StageTimer import StageStats
+
+class Pipeline:
+    '''
+    detection worker thread with a single slot queue dropping stale frames
+    '''
+
+    def __init__(self, func):
+        self.func = func # detection function called with the submitted item
+        self.cond = threading.Condition()
+        self.thread = None
+        self.running = False
+        self.pending = None # (seq, item, submit time) waiting for the worker
+        self.calls = [] # functions to run in the worker before the next item
+        self.latest = None # (seq, result, latency) of last completed item
+        self.polled = -1 # seq of the last result returned by poll
+        self.seq = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.submitted = 0
+        self.dropped = 0
+        self.completed = 0
+        self.errors = 0
+        self.last_error = None
+        self.latency = StageStats()
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="pipeline")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        '''
+        stop the worker after its current item, pending item is discarded
+        '''
+        if not self.running:
+            return
+        with self.cond:
+            self.running = False
+            self.pending = None
+            self.cond.notify()
+        self.thread.join()
+        self.thread = None
+        self.run_calls()
+
+    def submit(self, item):
+        '''
+        give a new item to the worker, replacing the pending one if any
+        return the sequence number of the item
+        '''
+        with self.cond:
+            if self.pending is not None:
+                self.dropped += 1
+            self.seq += 1
+            self.pending = (self.seq, item, time.time())
+            self.submitted += 1
+            self.cond.notify()
+        return self.seq
+
+    def poll(self):
+        '''
+        return the last completed result (seq, result, latency in seconds)
+        if it was not returned before, None otherwise
+        '''
+        with self.cond:
+            latest = self.latest
+        if latest is None or latest[0] == self.polled:
+            return None
+        self.polled = latest[0]
+        return latest
+
+    def call(self, func):
+        '''
+        run func in the worker between two items, or directly if the worker is stopped
+        '''
+        with self.cond:
+            if self.running:
+                self.calls.append(func)
+                self.cond.notify()
+                return
+        func()
+
+    def run_calls(self):
+        with self.cond:
+            calls, self.calls = self.calls, []
+        for func in calls:
+            func()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.running and self.pending is None and len(self.calls) == 0:
+                    self.cond.wait()
+                if not self.running:
+                    return
+            self.run_calls()
+            with self.cond:
+                if self.pending is None:
+                    continue
+                (seq, item, t_submit) = self.pending
+                self.pending = None
+            try:
+                result = self.func(item)
+            except Exception as e:
+                with self.cond:
+                    self.errors += 1
+                    self.last_error = repr(e)
+                continue
+            latency = time.time() - t_submit
+            with self.cond:
+                self.latest = (seq, result, latency)
+                self.completed += 1
+                self.latency.add(latency)
+
+    def report(self):
+        '''
+        return a line with frame counters and result latency (ms)
+        '''
+        with self.cond:
+            s = self.latency
+            line = "{} submitted {} dropped {} completed {} latency mean {:.2f} p50 {:.2f} p95 {:.2f} max {:.2f}".format(
+                    "running" if self.running else "stopped", self.submitted, self.dropped, self.completed,
+                    1000. * s.mean(), 1000. * s.percentile(50), 1000. * s.percentile(95), 1000. * s.max)
+            if self.errors > 0:
+                line += " errors {} ({})".format(self.errors, self.last_error)
+        return line
+
@@ -0,0 +1,232 @@
+'''
+Non-blocking serial output for JeVois Python modules
+
+Messages are given to a background writer thread instead of being sent
+from the frame thread, so a slow or backed up serial link cannot lower the
+vision frame rate. Messages with the same key replace each other while
+waiting (e.g. only the latest 'N2' per mark is sent), the number of waiting
+messages is bounded (oldest dropped first) and the output rate can be
+limited.
+
+Usage in a module:
+
+    self.serial = SerialQueue(jevois.sendSerial)
+    ...
+    self.serial.send("N2 {} ...".format(mark, ...), key=("N2", mark))
+
+Messages without identity between frames (e.g. 'POS' of unordered blobs)
+are sent together with send_group(), which replaces all the waiting
+messages of the same group.
+
+When the queue is disabled (default), send() calls the send function
+directly, like before. Commands are handled by parse_command:
+'serial queue on|off', 'serial rate R' (messages/s, 0 for no limit),
+'serial reset' and 'serial' for the counters.
+
+With 'serial proto bin [device]', binary frames (see BinaryProtocol.py) are
+expected instead of text messages: modules check binary() and send bytes,
+which are written to the device (/dev/ttyS0 by default).
+'''
+
+import collections
+import threading
+import time
+from BinaryProtocol import BinaryPort
+
+class SerialQueue:
+    '''
+    coalescing and rate limited serial output with a writer thread
+    '''
+
+    def __init__(self, send, rate=0., max_pending=32):
+        self.send_func = send # function sending a message (e.g. jevois.sendSerial)
+        self.rate = rate # max messages per second (0 for no limit)
+        self.max_pending = max_pending # max number of waiting messages
+        self.cond = threading.Condition()
+        self.thread = None
+        self.running = False
+        self.pending = collections.OrderedDict() # key -> message
+        self.next_key = 0 # unique keys of messages without key
+        self.port = None # binary output port
+        self.writing = False # writer thread is using a port outside of the lock
+        self.closing = [] # ports to close by the writer when its write is done
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.queued = 0
+        self.sent = 0
+        self.coalesced = 0 # replaced by a newer message with the same key
+        self.dropped = 0 # discarded because of the max number of waiting messages
+        self.errors = 0
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="serial")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        '''
+        stop the writer thread, waiting messages are discarded
+        '''
+        if not self.running:
+            return
+        with self.cond:
+            self.running = False
+            self.pending.clear()
+            self.cond.notify()
+        self.thread.join()
+        self.thread = None
+
+    def send(self, msg, key=None):
+        '''
+        send a message, or queue it if the writer is running
+        a waiting message with the same key is replaced
+        '''
+        if not self.running:
+            try:
+                self.write(msg, self.port)
+            except OSError:
+                self.errors += 1
+                return
+            self.sent += 1
+            return
+        with self.cond:
+            if key is None:
+                key = self.next_key
+                self.next_key += 1
+            if key in self.pending:
+                self.coalesced += 1
+            elif len(self.pending) >= self.max_pending:
+                self.pending.popitem(last=False)
+                self.dropped += 1
+            self.pending[key] = msg
+            self.queued += 1
+            self.cond.notify()
+
+    def send_group(self, msgs, group):
+        '''
+        send a list of messages, or queue them if the writer is running
+        all the waiting messages of the group are replaced (even by an empty list)
+        '''
+        if not self.running:
+            for msg in msgs:
+                self.send(msg)
+            return
+        with self.cond:
+            old = [k for k in self.pending if isinstance(k, tuple) and k[0] == group]
+            for k in old:
+                del self.pending[k]
+            self.coalesced += len(old)
+            for i, msg in enumerate(msgs):
+                self.send(msg, (group, i))
+
+    def run(self):
+        next_time = 0.
+        while True:
+            with self.cond:
+                while self.running and len(self.pending) == 0:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                delay = next_time - time.time()
+                if delay > 0.:
+                    # wait for the rate limit (newer messages can still replace waiting ones)
+                    self.cond.wait(delay)
+                    continue
+                _, msg = self.pending.popitem(last=False)
+                port = self.port
+                self.writing = True
+            try:
+                self.write(msg, port)
+                error = False
+            except Exception:
+                error = True
+            with self.cond:
+                self.writing = False
+                closing, self.closing = self.closing, []
+                if error:
+                    self.errors += 1
+                else:
+                    self.sent += 1
+            for p in closing:
+                p.close()
+            if error:
+                continue
+            if self.rate > 0.:
+                next_time = time.time() + 1. / self.rate
+
+    def write(self, msg, port):
+        if isinstance(msg, bytes):
+            if port is not None:
+                port.write(msg)
+        else:
+            self.send_func(msg)
+
+    def binary(self):
+        '''
+        return True if binary frames should be sent
+        '''
+        return self.port is not None
+
+    def set_binary(self, device=None):
+        '''
+        send binary frames to device, or text messages if None
+        '''
+        with self.cond:
+            port, self.port = self.port, None
+            self.pending.clear()
+            if port is not None and self.writing:
+                # the writer may still use it, closed when its write is done
+                self.closing.append(port)
+                port = None
+        if port is not None:
+            port.close()
+        if device is not None:
+            self.port = BinaryPort(device)
+
+    def report(self):
+        with self.cond:
+            return "{} {} rate {} sent {} queued {} waiting {} coalesced {} dropped {} errors {}".format(
+                    "bin " + self.port.device if self.port is not None else "text",
+                    "queue" if self.running else "direct", self.rate, self.sent, self.queued,
+                    len(self.pending), self.coalesced, self.dropped, self.errors)
+
+    def parse_command(self, str_list):
+        '''
+        handle 'serial', 'serial queue on|off', 'serial rate R', 'serial proto text|bin [device]'
+        and 'serial reset' commands
+        return the answer or None if not a serial command
+        '''
+        if len(str_list) == 0 or str_list[0] != "serial":
+            return None
+        if len(str_list) == 1:
+            return self.report()
+        elif len(str_list) == 2 and str_list[1] == "reset":
+            self.reset_stats()
+            return "OK"
+        elif len(str_list) == 3 and str_list[1] == "queue" and str_list[2] in ["on", "off"]:
+            if str_list[2] == "on":
+                self.start()
+            else:
+                self.stop()
+            return "OK"
+        elif len(str_list) == 3 and str_list[1] == "proto" and str_list[2] == "text":
+            self.set_binary(None)
+            return "OK"
+        elif len(str_list) in [3, 4] and str_list[1] == "proto" and str_list[2] == "bin":
+            try:
+                self.set_binary(str_list[3] if len(str_list) == 4 else "/dev/ttyS0")
+            except OSError as e:
+                return "ERR: {}".format(e)
+            return "OK"
+        elif len(str_list) == 3 and str_list[1] == "rate":
+            try:
+                self.rate = max(0., float(str_list[2]))
+            except ValueError:
+                return "ERR"
+            return "OK"
+        return None
+
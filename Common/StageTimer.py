@@ -0,0 +1,158 @@
+'''
+Lightweight per-stage timing for JeVois Python modules
+
+Usage in a process function:
+
+    self.stages.begin()
+    img = inframe.getCvBGR()
+    self.stages.mark("convert")
+    ...
+    self.stages.mark("detect")
+    self.stages.end()
+
+The time between two marks is added to the named stage, and the stage
+totals of each frame are stored in fixed-size histograms with logarithmic
+bins (from 10 us to about 10 s), so the memory and cost per frame do not
+depend on the run length. When disabled, each call only tests a flag.
+'''
+
+import math
+import time
+
+STATS_MIN_TIME = 1e-5 # lower bound of the first bin, in seconds
+STATS_BINS_PER_OCTAVE = 4
+STATS_NB_BINS = 80 # up to STATS_MIN_TIME * 2^(80/4), about 10 s
+
+class StageStats:
+    '''
+    fixed-size histogram of durations for a single stage
+    '''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.hist = [0] * STATS_NB_BINS
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, dt):
+        if dt > STATS_MIN_TIME:
+            idx = min(STATS_NB_BINS - 1, int(math.log(dt / STATS_MIN_TIME, 2) * STATS_BINS_PER_OCTAVE))
+        else:
+            idx = 0
+        self.hist[idx] += 1
+        self.count += 1
+        self.total += dt
+        if dt > self.max:
+            self.max = dt
+
+    def percentile(self, p):
+        '''
+        return the upper bound of the bin holding the p-th percentile (in seconds)
+        '''
+        if self.count == 0:
+            return 0.
+        target = p / 100. * self.count
+        acc = 0
+        for idx, n in enumerate(self.hist):
+            acc += n
+            if acc >= target and n > 0:
+                return min(self.max, STATS_MIN_TIME * 2. ** ((idx + 1.) / STATS_BINS_PER_OCTAVE))
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count > 0 else 0.
+
+class StageTimer:
+    '''
+    per-stage timing with percentile statistics
+    '''
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.stats = {} # stage name -> StageStats
+        self.order = [] # stage names in first seen order
+        self.frame = {} # stage totals of current frame
+        self.t_begin = 0.
+        self.t_last = 0.
+
+    def begin(self):
+        '''
+        start timing a new frame
+        '''
+        if not self.enabled:
+            return
+        self.frame = {}
+        self.t_begin = time.time()
+        self.t_last = self.t_begin
+
+    def mark(self, name):
+        '''
+        add the time since the previous mark (or begin) to a stage
+        '''
+        if not self.enabled:
+            return
+        now = time.time()
+        self.frame[name] = self.frame.get(name, 0.) + now - self.t_last
+        self.t_last = now
+
+    def skip(self):
+        '''
+        discard the time since the previous mark
+        '''
+        if not self.enabled:
+            return
+        self.t_last = time.time()
+
+    def end(self):
+        '''
+        store the stage totals of the frame and the total frame time
+        '''
+        if not self.enabled:
+            return
+        self.frame["total"] = time.time() - self.t_begin
+        for name, dt in self.frame.items():
+            if name not in self.stats:
+                self.stats[name] = StageStats()
+                self.order.append(name)
+            self.stats[name].add(dt)
+        self.frame = {}
+
+    def reset(self):
+        self.stats = {}
+        self.order = []
+        self.frame = {}
+
+    def report(self):
+        '''
+        return a report with a line per stage: count, mean, p50, p95, p99 and max in ms
+        '''
+        if len(self.order) == 0:
+            return "no stats" + ("" if self.enabled else " (disabled)")
+        lines = []
+        for name in self.order:
+            s = self.stats[name]
+            lines.append("{} n {} mean {:.2f} p50 {:.2f} p95 {:.2f} p99 {:.2f} max {:.2f}".format(
+                name, s.count, 1000. * s.mean(), 1000. * s.percentile(50), 1000. * s.percentile(95),
+                1000. * s.percentile(99), 1000. * s.max))
+        return "\n".join(lines)
+
+    def parse_command(self, str_list):
+        '''
+        handle 'stats', 'stats reset' and 'stats on|off' commands
+        return the answer or None if not a stats command
+        '''
+        if len(str_list) == 0 or str_list[0] != "stats":
+            return None
+        if len(str_list) == 1:
+            return self.report()
+        elif len(str_list) == 2 and str_list[1] == "reset":
+            self.reset()
+            return "OK"
+        elif len(str_list) == 2 and str_list[1] in ["on", "off"]:
+            self.enabled = str_list[1] == "on"
+            return "OK"
+        return None
+
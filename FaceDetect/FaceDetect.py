@@ -1,7 +1,17 @@
 import libjevois as jevois
 import cv2
 import numpy as np
-from detector import Detector
+from detector import Detector, CASCADES
+from tracker import Tracker
+import os
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'Common')) # shared helpers
+from StageTimer import StageTimer
+from Pipeline import Pipeline
+from SerialQueue import SerialQueue
+from FrameRecorder import FrameRecorder
+from BinaryProtocol import encode_frame, KIND_FACE
  
 ## Simple face detection using OpenCV in Python on JeVois
 #
@@ -26,11 +36,39 @@ class FaceDetect:
     def __init__(self):
         jevois.LINFO("Init FaceDetect")
         self.timer = jevois.Timer("FaceDetect", 100, jevois.LOG_INFO)
+        self.frame = 0 # frame counter
         self.got_face = False
+        (self.x, self.y, self.w, self.h) = (0, 0, 0, 0)
+        self.roi = None # searched window of last detection
+        self.tracked = False # last face was tracked (not detected)
+        self.last_face = None # last face used by find_face
 
+        # Haar cascade by default, LBP or reduced image detection can be selected with the 'backend' command
         self.face_detector = Detector('/jevois/share/facedetector/haarcascade_frontalface_alt.xml')
-        #self.face_detector = Detector('/jevois/share/facedetector/lbpcascade_frontalface.xml')
-        self.faces = np.empty(shape=(0,0))
+        self.faces = []
+
+        # run the detector every N frames and track the face in between (N = 1: detect every frame)
+        self.detect_every = 1
+        self.track_th = 0.6 # min tracking confidence, detection is done below
+        self.tracker = Tracker()
+        self.frames_since_detect = 0
+
+        # search around the last face with a size band, full frame search every N detections (N = 1: always full frame)
+        self.full_every = 10
+        self.detections_since_full = 0
+
+        # per-stage timing statistics (disabled by default, see 'stats' commands)
+        self.stages = StageTimer()
+
+        # serial output (direct by default, see 'serial' commands)
+        self.serial = SerialQueue(jevois.sendSerial)
+
+        # asynchronous frame recording (see 'record' commands)
+        self.recorder = FrameRecorder()
+
+        # optional detection in a worker thread (see 'pipeline' commands)
+        self.pipeline = Pipeline(self.pipeline_find_face)
+        self.pipeline_stages = StageTimer() # stages of the worker are not timed
 
     # ###################################################################################################
     ## Process function without USB output
@@ -44,48 +82,192 @@ class FaceDetect:
         jevois.LINFO("Processing faces")
 
         self.timer.start()
+        self.stages.begin()
         inimg = inframe.getCvGRAY()
+        stamp = time.time() * 1000.
+        self.stages.mark("convert")
         #inimg.require("input", 640, 480, V4L2_PIX_FMT_GREY);
-        equimg = cv2.equalizeHist(inimg)
         if outframe is not None:
             outimg = outframe.get()
             jevois.pasteGreyToYUYV(inimg, outimg, 0, 0)
+            self.stages.mark("draw")
         #inframe.done()
 
-        # eyes will not be used since eyes detection is disabled by default (but here since not returned null)
-        self.faces = self.face_detector.detect(equimg)
+        if self.pipeline.running:
+            # detection in worker thread, render and send its most recent result
+            self.pipeline.submit(inimg)
+            res = self.pipeline.poll()
+            self.stages.mark("submit")
+            new_result = res is not None
+            if new_result:
+                self.set_result(res[1])
+        else:
+            self.set_result(self.find_face(inimg, self.stages))
+            new_result = True
 
-        self.got_face = False
-        (self.x, self.y, self.w, self.h) = (0, 0, 0, 0)
-        for (x,y,w,h) in self.faces:
-            # store face if first found or bigger
-            if (self.got_face == False) or (w * h > self.w * self.h):
-                (self.x, self.y, self.w, self.h) = (x, y, w, h)
-                self.got_face = True
-                jevois.LINFO("Found faces {} {} ({}, {})".format(x, y, w, h))
-            # draw rectangle if outframe requested
-            if outframe is not None:
+        if outframe is not None:
+            if self.roi is not None:
+                (x0, y0, x1, y1) = self.roi
+                jevois.drawRect(outimg, x0, y0, x1 - x0, y1 - y0, 1, 0x8080)
+            if self.tracked:
+                jevois.drawRect(outimg, int(self.x), int(self.y), int(self.w), int(self.h), 1, 0x80ff)
+            # draw rectangle of each detected face
+            for (x,y,w,h) in self.faces:
                 jevois.drawRect(outimg, int(x), int(y), int(w), int(h), 2, 0x80ff)
 
         fps = self.timer.stop()
+        self.stages.mark("draw")
 
         if outframe is not None:
             outframe.send()
+            self.stages.mark("send")
 
         # Communication over serial, sending a string
-        if self.got_face:
-            height, width = equimg.shape[:2]
+        if self.got_face and new_result:
+            height, width = inimg.shape[:2]
             jevois.LINFO("FPS {}".format(fps))
             x = self.x + self.w/2. - width/2.
             y = self.y + self.h/2. - height/2.
-            jevois.sendSerial("T2 {} {}".format(int(x * 2000./width), int(-y * 2000./height)))
+            if self.serial.binary():
+                target = (0, 1 if self.tracked else 0, x * 2000./width, -y * 2000./height, self.w, self.h)
+                self.serial.send(encode_frame(KIND_FACE, self.frame, stamp, [target]), "BIN")
+            else:
+                self.serial.send("T2 {} {}".format(int(x * 2000./width), int(-y * 2000./height)), "T2")
+            self.stages.mark("serial")
+        elif new_result and self.serial.binary():
+            # empty frame when no face
+            self.serial.send(encode_frame(KIND_FACE, self.frame, stamp, []), "BIN")
+            self.stages.mark("serial")
+        # last face (x, y, w, h, tracked), from an older frame in pipeline mode
+        results = [(self.x, self.y, self.w, self.h, self.tracked)] if self.got_face else []
+        if self.recorder.add(inimg, self.frame, stamp, results):
+            self.stages.mark("record")
+        self.stages.end()
+        self.frame += 1
+
+    # ###################################################################################################
+    ## Find the face in the gray image, by tracking or detection
+    # Returns (face, faces, roi, tracked) with the selected face (x, y, w, h) or None, the list of detected faces,
+    # the searched window (x0, y0, x1, y1) or None and True if the face was tracked. Only uses the state of the
+    # tracker and detector, so it can run in the pipeline worker thread.
+    def find_face(self, inimg, stages):
+        # follow the last face between detections
+        if self.detect_every > 1 and self.last_face is not None and self.frames_since_detect < self.detect_every:
+            rect, conf = self.tracker.track(inimg)
+            stages.mark("track")
+            self.frames_since_detect += 1
+            if rect is not None and conf >= self.track_th:
+                self.last_face = rect
+                return (rect, [], None, True)
+
+        # eyes will not be used since eyes detection is disabled by default (but here since not returned null)
+        faces = []
+        roi = None
+        window = None
+        if self.last_face is not None and self.detections_since_full + 1 < self.full_every:
+            window = self.face_detector.search_window(inimg.shape, self.last_face)
+        if window is not None:
+            # only equalize and search the padded window around the last face
+            (roi, min_size, max_size) = window
+            faces = self.face_detector.detect(inimg, roi, min_size, max_size, equalize=True)
+            self.detections_since_full += 1
+        if len(faces) == 0:
+            # no known face, periodic or fallback full frame search
+            faces = self.face_detector.detect(inimg, equalize=True)
+            self.detections_since_full = 0
+        self.frames_since_detect = 1
+        stages.mark("detect")
+
+        # keep the biggest face
+        face = None
+        for (x,y,w,h) in faces:
+            if face is None or w * h > face[2] * face[3]:
+                face = (x, y, w, h)
+        self.last_face = face
+        if face is not None:
+            jevois.LINFO("Found faces {} {} ({}, {})".format(*face))
+            if self.detect_every > 1:
+                self.tracker.init(inimg, face)
+                stages.mark("track")
+        return (face, faces, roi, False)
+
+    # ###################################################################################################
+    ## Settings of find_face, called in the pipeline worker when it runs (see Pipeline.call)
+    def set_detect_every(self, n):
+        self.detect_every = n
+        self.frames_since_detect = n # detect on next frame
+
+    def set_full_every(self, n):
+        self.full_every = n
+        self.detections_since_full = 0
+
+    def set_backend(self, name, factor):
+        self.face_detector.set_backend(name, factor)
+        self.tracker.reset()
+        self.last_face = None
+
+    # ###################################################################################################
+    ## Worker thread function of the pipeline
+    def pipeline_find_face(self, inimg):
+        return self.find_face(inimg, self.pipeline_stages)
+
+    # ###################################################################################################
+    ## Store the result of find_face for rendering and serial output
+    def set_result(self, result):
+        (face, self.faces, self.roi, self.tracked) = result
+        self.got_face = face is not None
+        (self.x, self.y, self.w, self.h) = face if self.got_face else (0, 0, 0, 0)
 
     # ###################################################################################################
     ## Parse a serial command forwarded to us by the JeVois Engine, return a string
     def parseSerial(self, str):
+        str_list = str.split(' ')
+        stats = self.stages.parse_command(str_list)
+        if stats is not None:
+            return stats
+        serial = self.serial.parse_command(str_list)
+        if serial is not None:
+            return serial
+        record = self.recorder.parse_command(str_list)
+        if record is not None:
+            return record
+        # settings used by find_face are changed between two frames of the pipeline worker
+        if len(str_list) == 2 and str_list[0] == "detect_every" and str_list[1].isdigit():
+            self.pipeline.call(lambda: self.set_detect_every(max(1, int(str_list[1]))))
+            return "OK"
+        elif len(str_list) == 2 and str_list[0] == "track_th":
+            try:
+                self.track_th = float(str_list[1])
+            except ValueError:
+                return "ERR: invalid confidence"
+            return "OK"
+        elif len(str_list) == 2 and str_list[0] == "full_every" and str_list[1].isdigit():
+            self.pipeline.call(lambda: self.set_full_every(max(1, int(str_list[1]))))
+            return "OK"
+        elif len(str_list) in [2, 3] and str_list[0] == "backend" and str_list[1] in CASCADES:
+            factor = 1
+            if len(str_list) == 3:
+                if str_list[2] not in ["1", "2", "4"]:
+                    return "ERR: invalid factor"
+                factor = int(str_list[2])
+            self.pipeline.call(lambda: self.set_backend(str_list[1], factor))
+            return "OK"
+        elif len(str_list) == 1 and str_list[0] == "backend":
+            return self.face_detector.name
+        elif len(str_list) == 2 and str_list[0] == "pipeline" and str_list[1] in ["on", "off"]:
+            if str_list[1] == "on":
+                self.pipeline.reset_stats()
+                self.pipeline.start()
+            else:
+                self.pipeline.stop()
+            return "OK"
+        elif len(str_list) == 1 and str_list[0] == "pipeline":
+            return self.pipeline.report()
+        elif len(str_list) == 1 and str_list[0] == "track":
+            return "detect_every {} track_th {:.2f} confidence {:.2f}".format(self.detect_every, self.track_th, self.tracker.confidence)
         return "ERR: Unsupported command"
 
     # ###################################################################################################
     ## Return a string that describes the custom commands we support, for the JeVois help message
     def supportedCommands(self):
-        return ""
+        return "backend haar|lbp [F] - select face detection cascade, on image reduced by F (1, 2 or 4)\nbackend - report current backend\ndetect_every N - run face detection every N frames and track the face in between (1 to disable tracking)\ntrack_th C - min tracking confidence (0 to 1), face detection is done below\nfull_every N - detect around the last face, full frame search every N detections (1 to always search the full frame)\ntrack - report tracking settings and last confidence\npipeline on|off - run face detection in a worker thread, dropping stale frames\npipeline - report pipeline frame counters and result latency\nserial queue on|off - send messages from a writer thread, keeping the latest of each kind\nserial rate R - max messages per second in queue mode (0 for no limit)\nserial proto text|bin [device] - text messages or one binary frame per video frame written to device (/dev/ttyS0 by default)\nserial [reset] - report (or reset) sent, coalesced and dropped counters\nrecord start [jpg|raw] - record frames and detections from a writer thread (JPEG files or raw frames)\nrecord stop - stop recording\nrecord snapshot [NAME] - save next frame as PNG\nrecord every N - record one frame every N\nrecord [reset] - report (or reset) waiting frames, written and dropped counters\nstats [reset|on|off] - per-stage timing statistics"
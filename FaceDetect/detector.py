@@ -1,24 +1,132 @@
 #!/usr/bin/python
+import os
 import sys
 import cv2
 
-class Detector:
-    def __init__(self, cascade_path=""):
-        #os.path.dirname(os.path.realpath(__file__))
-        if not cascade_path:
-            print("Detector: no cascade path, trying default location for face cascade")
-            cascade_path = '/jevois/share/facedetector/haarcascade_frontalface_alt.xml'
+def find_cascade(cascade_path):
+    '''
+    when the cascade file does not exist (not running on JeVois),
+    look for the same file next to this script or in OpenCV data
+    '''
+    if os.path.isfile(cascade_path):
+        return cascade_path
+    name = os.path.basename(cascade_path)
+    dirs = [os.path.dirname(os.path.realpath(__file__))]
+    if hasattr(cv2, 'data'):
+        dirs.append(cv2.data.haarcascades)
+    for d in dirs:
+        if os.path.isfile(os.path.join(d, name)):
+            return os.path.join(d, name)
+    return cascade_path
+
+# cascade files of the available backends (looked up next to this script or in OpenCV data if missing)
+CASCADES = {
+        'haar': '/jevois/share/facedetector/haarcascade_frontalface_alt.xml',
+        'lbp': '/jevois/share/facedetector/lbpcascade_frontalface.xml',
+        }
+
+class CascadeBackend:
+    '''
+    OpenCV cascade classifier (Haar or LBP features)
+    '''
+    def __init__(self, cascade_path):
+        cascade_path = find_cascade(cascade_path)
         self.classifier = cv2.CascadeClassifier(cascade_path)
         if(self.classifier.empty()):
             print("Detector: error loading cascade file " + cascade_path)
-                
-    def detect(self, gray):
+
+    def detect(self, gray, min_size, max_size):
+        return self.classifier.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=tuple(min_size), maxSize=tuple(max_size), flags = cv2.CASCADE_SCALE_IMAGE) # cv2.cv.CV_HAAR_SCALE_IMAGE in older OpenCV
+
+class DownscaleBackend:
+    '''
+    run another backend on the image reduced by factor
+    '''
+    def __init__(self, backend, factor=2):
+        self.backend = backend
+        self.factor = factor
+
+    def detect(self, gray, min_size, max_size):
+        f = self.factor
+        small = cv2.resize(gray, (gray.shape[1] // f, gray.shape[0] // f), interpolation=cv2.INTER_AREA)
+        min_size = (min_size[0] // f, min_size[1] // f)
+        max_size = (max_size[0] // f, max_size[1] // f)
+        faces = self.backend.detect(small, min_size, max_size)
+        return [(x * f, y * f, w * f, h * f) for (x, y, w, h) in faces]
+
+def make_backend(name, factor=1):
+    '''
+    return the backend from its name ('haar' or 'lbp')
+    and reduction factor of the image (1 for full resolution)
+    '''
+    if name not in CASCADES:
+        raise ValueError("unknown backend " + name)
+    backend = CascadeBackend(CASCADES[name])
+    if factor > 1:
+        backend = DownscaleBackend(backend, factor)
+    return backend
+
+class Detector:
+    def __init__(self, cascade_path="", backend=None):
+        self.name = "custom" # backend description
+        if backend is not None:
+            self.backend = backend
+            return
+        if not cascade_path:
+            print("Detector: no cascade path, trying default location for face cascade")
+            cascade_path = CASCADES['haar']
+        self.backend = CascadeBackend(cascade_path)
+        self.name = os.path.basename(cascade_path)
+
+    def set_backend(self, name, factor=1):
+        '''
+        select backend by name ('haar' or 'lbp') and reduction factor
+        '''
+        self.backend = make_backend(name, factor)
+        self.name = name if factor == 1 else "{} /{}".format(name, factor)
+
+    def detect(self, gray, roi=None, min_size=(30, 30), max_size=None, equalize=False):
+        '''
+        detect faces in gray image, return a list of (x, y, w, h)
+        roi: window (x0, y0, x1, y1) to search, full image by default
+        min_size, max_size: size band of the faces
+        equalize: equalize the histogram of the searched window first
+        '''
+        if roi is not None:
+            (x0, y0, x1, y1) = roi
+            gray = gray[y0:y1, x0:x1]
+        else:
+            (x0, y0) = (0, 0)
+        faces = []
         if (len(gray) != 0):
-            faces = self.classifier.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30), flags = cv2.CASCADE_SCALE_IMAGE) # cv2.cv.CV_HAAR_SCALE_IMAGE in older OpenCV
+            if equalize:
+                gray = cv2.equalizeHist(gray)
+            if max_size is None:
+                max_size = (0, 0) # no limit
+            faces = self.backend.detect(gray, min_size, max_size)
+            if len(faces) > 0 and (x0, y0) != (0, 0):
+                faces = [(x + x0, y + y0, w, h) for (x, y, w, h) in faces]
         else:
             print("Empty image...")
         return faces
 
+    def search_window(self, shape, rect, pad=0.5, band=(0.7, 1.4)):
+        '''
+        return the window (x0, y0, x1, y1) padded by pad * size around the face rect (x, y, w, h),
+        and the size band (min_size, max_size) relative to the face size
+        or None if the window is too small to hold the face
+        '''
+        (x, y, w, h) = [int(v) for v in rect]
+        height, width = shape[:2]
+        size = max(w, h)
+        min_size = max(30, int(size * band[0]))
+        max_size = max(min_size + 1, int(size * band[1]))
+        x0, y0 = max(0, int(x - pad * size)), max(0, int(y - pad * size))
+        x1, y1 = min(width, int(x + w + pad * size)), min(height, int(y + h + pad * size))
+        if x1 - x0 < min_size or y1 - y0 < min_size:
+            return None
+        return (x0, y0, x1, y1), (min_size, min_size), (max_size, max_size)
+
 
 if __name__ == '__main__':
     if(len(sys.argv) < 3):
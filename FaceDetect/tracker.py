@@ -0,0 +1,64 @@
+import cv2
+
+class Tracker:
+    '''
+    Template matching tracker for a single face
+
+    The face found by the detector is used as template, and searched in the
+    next frames in a window around its last position with normalized cross
+    correlation. Matching is done on images reduced so that the template
+    width is at most 'template_width' pixels, to keep the cost low and
+    independent of the face size.
+    '''
+
+    def __init__(self, margin=0.5, template_width=32):
+        self.margin = margin # search window padding relative to the face size
+        self.template_width = template_width # max template width for matching
+        self.reset()
+
+    def reset(self):
+        self.template = None
+        self.rect = None
+        self.confidence = 0.
+        self.factor = 1.
+
+    def init(self, gray, rect):
+        '''
+        start tracking rect (x, y, w, h) in the gray image
+        '''
+        (x, y, w, h) = [int(v) for v in rect]
+        self.factor = min(1., float(self.template_width) / max(w, 1))
+        patch = gray[y:y+h, x:x+w]
+        if patch.size == 0:
+            self.reset()
+            return
+        tw, th = max(4, int(round(w * self.factor))), max(4, int(round(h * self.factor)))
+        self.template = cv2.resize(patch, (tw, th), interpolation=cv2.INTER_AREA)
+        self.rect = (x, y, w, h)
+        self.confidence = 1.
+
+    def track(self, gray):
+        '''
+        search the face in the gray image
+        return the new rect (x, y, w, h) and the match confidence (-1 to 1)
+        '''
+        if self.template is None:
+            return None, 0.
+        (x, y, w, h) = self.rect
+        height, width = gray.shape[:2]
+        pad_x, pad_y = int(w * self.margin) + 1, int(h * self.margin) + 1
+        x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+        x1, y1 = min(width, x + w + pad_x), min(height, y + h + pad_y)
+        f = self.factor
+        th, tw = self.template.shape[:2]
+        sw, sh = int(round((x1 - x0) * f)), int(round((y1 - y0) * f))
+        if sw < tw or sh < th:
+            self.confidence = 0.
+            return None, 0. # face partially out of image
+        window = cv2.resize(gray[y0:y1, x0:x1], (sw, sh), interpolation=cv2.INTER_AREA)
+        res = cv2.matchTemplate(window, self.template, cv2.TM_CCOEFF_NORMED)
+        _, conf, _, (u, v) = cv2.minMaxLoc(res)
+        self.confidence = conf
+        self.rect = (int(round(x0 + u / f)), int(round(y0 + v / f)), w, h)
+        return self.rect, conf
+
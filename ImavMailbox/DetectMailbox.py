@@ -2,6 +2,17 @@ import cv2
 import cv2 as cv
 import numpy as np
 
+def reduce_image(img, level):
+    '''
+    return the image reduced by 2^level (area average)
+    the image is cropped to a multiple of 2^level
+    '''
+    if level == 0:
+        return img
+    s = 1 << level
+    h, w = img.shape[0] // s, img.shape[1] // s
+    return cv2.resize(img[:h * s, :w * s], (w, h), interpolation=cv2.INTER_AREA)
+
 class MailboxDetector:
 
     def __init__(self, hsv_th, size, aspect_ratio_th=0.8, area_th=0.7, size_th=(10,300), color="Unknown"):
@@ -13,12 +24,14 @@ class MailboxDetector:
         self.size_th = size_th
         self.kernel = np.ones((8,8),np.uint8) # create convolution
         self.mask = None
+        self.quality = 0. # shape quality of last detection (area ratio * squareness)
+        self.score = 0. # score of last detection
         self.color = color # color name
 
-    def detect(self, img, size_factor=None):
-
-        #blur = cv2.GaussianBlur(img,(5,5),0)
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    def threshold(self, hsv):
+        '''
+        compute the color mask of this detector from an HSV image
+        '''
         mask = None
         for th in self.hsv_th:
             hsv_min = np.array(th[0])
@@ -27,15 +40,80 @@ class MailboxDetector:
                 mask = cv2.inRange(hsv, hsv_min, hsv_max)
             else:
                 mask += cv2.inRange(hsv, hsv_min, hsv_max)
+        return mask
+
+    def detect(self, img, size_factor=None):
+
+        #blur = cv2.GaussianBlur(img,(5,5),0)
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        return self.detect_mask(self.threshold(hsv), size_factor)
+
+    def detect_mask(self, mask, size_factor=None, scale=1):
+        '''
+        search for the best mailbox candidate in a color mask
+        (typically computed by ColorSegmenter)
+        scale: reduction factor of the mask (see candidates)
+        '''
+        best_res = None
+        self.quality = 0.
+        self.score = 0.
+        for (score, quality, rect) in self.candidates(mask, size_factor, scale):
+            #print(score,self.score)
+            if score > self.score:
+                best_res = rect
+                self.quality = quality
+                self.score = score
+        return best_res
+
+    def detect_all(self, img, size_factor=None, k=None):
+        '''
+        return up to k (all if None) non-overlapping mailboxes found in image
+        as a list of (rect, score) sorted by decreasing score
+        '''
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        return self.detect_all_mask(self.threshold(hsv), size_factor, k)
 
+    def detect_all_mask(self, mask, size_factor=None, k=None, overlap_th=0.1, scale=1):
+        '''
+        return up to k (all if None) non-overlapping mailboxes found in a color mask
+        as a list of (rect, score) sorted by decreasing score
+        candidates overlapping a better one by more than overlap_th of their area are discarded
+        scale: reduction factor of the mask (see candidates)
+        '''
+        cands = sorted(self.candidates(mask, size_factor, scale), key=lambda c: c[0], reverse=True)
+        res = []
+        for (score, quality, rect) in cands:
+            if k is not None and len(res) >= k:
+                break
+            area = rect[1][0] * rect[1][1]
+            overlap = False
+            for (r, _) in res:
+                inter_type, inter = cv2.rotatedRectangleIntersection(rect, r)
+                if inter_type != cv2.INTERSECT_NONE and inter is not None:
+                    if cv2.contourArea(inter) > overlap_th * min(area, r[1][0] * r[1][1]):
+                        overlap = True
+                        break
+            if not overlap:
+                res.append((rect, score))
+        return res
+
+    def candidates(self, mask, size_factor=None, scale=1):
+        '''
+        return a list of (score, quality, rect) of all acceptable contours of a color mask
+        scale: reduction factor of the mask (see reduce_image), rects are mapped back
+        to full resolution before size checks so size_th and size_factor are unchanged
+        '''
         self.mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self.kernel) # opening
         #cv2.imshow('mask '+self.color,mask)
         cnts = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[-2]
         #self.draw_all(img.copy(),cnts)
-        best_res = None
-        best_score = 0.
+        cands = []
         for cnt in cnts:
             rect = cv2.minAreaRect(cnt)
+            if scale != 1:
+                (u, v), (w, h), angle = rect
+                # sizes like centers: minAreaRect of a contour is 1 pixel smaller than the blob
+                rect = (((u + 0.5) * scale - 0.5, (v + 0.5) * scale - 0.5), ((w + 1) * scale - 1, (h + 1) * scale - 1), angle)
             _, (w, h), _ = rect
             min_wh = min(w, h)
             max_wh = max(w, h)
@@ -53,16 +131,13 @@ class MailboxDetector:
             if size_factor is not None:
                 score_area = 1. / max(1., abs(area - self.size2 * size_factor)) # score according to expected size
                 #print(self.color, area, self.size2 * size_factor, score_area)
-            area_ratio = cv2.contourArea(cnt) / area
+            area_ratio = cv2.contourArea(cnt) * scale * scale / area
             if area_ratio < self.area_th:
                 #print("not good ratio")
                 continue # not enough full of color
             score = area_ratio * similarity * score_area
-            #print(score,best_score)
-            if score > best_score:
-                best_score = score
-                best_res = rect
-        return best_res
+            cands.append((score, area_ratio * similarity, rect))
+        return cands
 
     def draw_all(self, img, cnts):
         for cnt in cnts:
@@ -80,3 +155,85 @@ class MailboxDetector:
                 [[th_min[0], th_min[1], th_min[2]],[179      , th_max[1], th_max[2]]]
                 ])
 
+
+
+class ColorSegmenter:
+    '''
+    Shared segmentation stage for several MailboxDetector
+
+    The input image is converted to HSV only once per frame
+    and the mask of each detector is computed from it.
+
+    In LUT mode, a table mapping a quantized BGR value to a set of color
+    labels (one bit per detector) is built from the detectors' thresholds,
+    and the segmentation is a single gather per frame without HSV conversion.
+    The table must be rebuilt (with invalidate()) when a threshold changes.
+    '''
+
+    def __init__(self, detectors, use_lut=False, lut_bits=6):
+        if len(detectors) > 8:
+            raise ValueError("ColorSegmenter: at most 8 detectors are supported")
+        self.detectors = detectors
+        self.use_lut = use_lut
+        self.lut_bits = lut_bits # bits per channel for LUT mode
+        self.lut = None
+        # label image to mask of each detector
+        self.label_masks = []
+        for i in range(len(detectors)):
+            m = np.zeros(256, np.uint8)
+            m[(np.arange(256) & (1 << i)) > 0] = 255
+            self.label_masks.append(m)
+
+    def invalidate(self):
+        '''
+        request a rebuild of the LUT on next frame (after threshold change)
+        '''
+        self.lut = None
+
+    def set_lut(self, use_lut, lut_bits=None):
+        self.use_lut = use_lut
+        if lut_bits is not None and lut_bits != self.lut_bits:
+            self.lut_bits = lut_bits
+            self.lut = None
+
+    def build_lut(self):
+        '''
+        build the BGR to labels table from the center of each quantized BGR cell
+        '''
+        bits = self.lut_bits
+        shift = 8 - bits
+        levels = (np.arange(1 << bits, dtype=np.uint16) << shift) + ((1 << shift) >> 1)
+        b, g, r = np.meshgrid(levels, levels, levels, indexing='ij')
+        bgr = np.stack((b, g, r), axis=-1).astype(np.uint8).reshape((-1, 1, 3))
+        hsv = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV)
+        lut = np.zeros(bgr.shape[0], np.uint8)
+        for i, d in enumerate(self.detectors):
+            lut[d.threshold(hsv).ravel() > 0] |= np.uint8(1 << i)
+        self.lut = lut
+
+    def labels(self, img):
+        '''
+        return the label image (bit i set if pixel matches detector i) in LUT mode
+        '''
+        if self.lut is None:
+            self.build_lut()
+        bits = self.lut_bits
+        shift = 8 - bits
+        b, g, r = cv2.split(img)
+        idx = np.left_shift(b >> shift, 2 * bits, dtype=np.int32)
+        idx |= np.left_shift(g >> shift, bits, dtype=np.int32)
+        idx |= r >> shift
+        return self.lut.take(idx)
+
+    def segment(self, img, indexes=None):
+        '''
+        return the list of masks, in the same order as the detectors
+        or only for the detectors at the given indexes
+        '''
+        if indexes is None:
+            indexes = range(len(self.detectors))
+        if self.use_lut:
+            labels = self.labels(img)
+            return [cv2.LUT(labels, self.label_masks[i]) for i in indexes]
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        return [self.detectors[i].threshold(hsv) for i in indexes]
@@ -4,145 +4,315 @@
 #2 windows will pop out:
 #1st one is initial image, for you to find the mailbox
 #2nd one is the "Hue" image, for you to find the value may differ
+#
+#Interactive mode: HSV_histo.py image [image ...]
+#  images are loaded once, 'n'/'p' show next/previous image, the histogram
+#  is the sum over all images (computed only once)
+#
+#Batch calibration mode: HSV_histo.py --labels labels.txt --script script.cfg.std
+#                     or HSV_histo.py --color red --script script.cfg.std crop [crop ...]
+#  labels file lines: 'image color [x y w h]' (whole image if no region, color in red, blue, yellow, orange)
+#  images given with --color are used whole for this color
+#  the HSV histograms of the labeled regions are accumulated in parallel over
+#  all images, a hue/saturation range is fitted for each color and the
+#  'hsv_<color>' lines are written in the script file (or printed)
 import cv2
 import cv2 as cv
 import numpy as np
 #from matplotlib import pyplot as plt
+import os
 import sys
+from multiprocessing import Pool
 
-if len(sys.argv) != 2:
-    print("Missing file input")
-    sys.exit(1)
-
-file_name = sys.argv[1]
-
-hsv_map = np.zeros((180, 256, 3), np.uint8)
-h, s = np.indices(hsv_map.shape[:2])
-hsv_map[:,:,0] = h
-hsv_map[:,:,1] = s
-hsv_map[:,:,2] = 255
-hsv_map = cv2.cvtColor(hsv_map, cv2.COLOR_HSV2BGR)
-#cv2.imshow('hsv_map', hsv_map)
-
-cv2.namedWindow('hist', cv2.WINDOW_NORMAL)
-cv2.namedWindow('image', cv2.WINDOW_NORMAL)
-hist_scale = 10
-h_min = 0
-h_max = 179
-s_min = 0
-s_max = 255
-updated = True
-
-def set_scale(val):
-    global hist_scale
-    global updated
-    hist_scale = val
-    updated = True
-
-def set_h_min(val):
-    global h_min
-    global updated
-    h_min = val
-    updated = True
-
-def set_h_max(val):
-    global h_max
-    global updated
-    h_max = val
-    updated = True
-
-def set_s_min(val):
-    global s_min
-    global updated
-    s_min = val
-    updated = True
-
-def set_s_max(val):
-    global s_max
-    global updated
-    s_max = val
-    updated = True
-
-mouse_hsv = None
-def getpos(event,x,y,flags,param):
-    global mouse_hsv
-    global h_min, h_max, s_min, s_max, updated
-    if event == cv2.EVENT_LBUTTONDOWN:
-        if mouse_hsv is None:
-            mouse_hsv = (y, x)
-        else:
-            h_min = mouse_hsv[0]
-            s_min = mouse_hsv[1]
-            h_max = y
-            s_max = x
-            cv2.setTrackbarPos('h_min', 'hist', h_min)
-            cv2.setTrackbarPos('h_max', 'hist', h_max)
-            cv2.setTrackbarPos('s_min', 'hist', s_min)
-            cv2.setTrackbarPos('s_max', 'hist', s_max)
-            mouse_hsv = None
-            updated = True
-
-cv2.setMouseCallback("hist",getpos)
-
-cv2.createTrackbar('scale', 'hist', hist_scale, 32, set_scale)
-cv2.createTrackbar('h_min', 'hist', h_min, 179, set_h_min)
-cv2.createTrackbar('h_max', 'hist', h_max, 179, set_h_max)
-cv2.createTrackbar('s_min', 'hist', s_min, 255, set_s_min)
-cv2.createTrackbar('s_max', 'hist', s_max, 255, set_s_max)
-
-def plot_hist():
+COLORS = ['red', 'blue', 'yellow', 'orange'] # colors of the ImavMailbox hsv_* commands
+
+def load_hsv(file_name):
+    '''
+    return the BGR and HSV images of a file (None if it can't be read)
+    '''
     img = cv.imread(file_name)
-    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-
-    # can't swap s param
-    _s_min = min(s_min, s_max)
-    _s_max = max(s_min, s_max)
-
-    # discard dark colors
-    #dark = hsv[...,2] < 32
-    #hsv[dark] = 0
-    mask = None
-    if h_min <= h_max:
-        lower = np.array([h_min, _s_min, 0])
-        upper = np.array([h_max, _s_max, 255])
-        mask = cv2.inRange(hsv, lower, upper)
-    else: # splitted
-        lower1 = np.array([0, _s_min, 0])
-        upper1 = np.array([h_max, _s_max, 255])
-        mask1 = cv2.inRange(hsv, lower1, upper1)
-        lower2 = np.array([h_min, _s_min, 0])
-        upper2 = np.array([179, _s_max, 255])
-        mask2 = cv2.inRange(hsv, lower2, upper2)
-        mask = mask1 + mask2
-
-    #hsv_masked = cv2.bitwise_and(hsv, hsv, mask=mask)
-    img_masked = cv2.bitwise_and(img, img, mask=mask)
-
-    h = cv2.calcHist( [hsv], [0, 1], None, [180, 256], [0, 180, 0, 256] )
-
-    h = np.clip(h*0.005*hist_scale, 0, 1)
-    vis = hsv_map*h[:,:,np.newaxis] / 255.0
-    if h_min <= h_max:
-        cv2.rectangle(vis,(_s_min,h_min),(_s_max,h_max),(0,255,0),1)
-    else: # splitted
-        cv2.rectangle(vis,(_s_min,0),(_s_max,h_max),(0,255,0),1)
-        cv2.rectangle(vis,(_s_min,h_min),(_s_max,179),(0,255,0),1)
-    cv2.imshow('hist', vis)
-    cv2.imshow('image', img_masked)
-
-    # HSV output
-    print("[[{}, {}, 0],[{}, {}, 255]] | {} {} 0 {} {} 255".format(h_min, min(s_min,s_max), h_max, max(s_min,s_max), h_min, min(s_min,s_max), h_max, max(s_min,s_max)))
-
-while True:
-    if updated:
-        plot_hist()
-        updated = False
-    ch = 0xFF & cv2.waitKey(1)
-    if ch == 27 or ch == ord('q'):
-        break
-
-cv2.destroyAllWindows()
+    if img is None:
+        return None, None
+    return img, cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+
+def compute_hist(hsv, mask=None):
+    return cv2.calcHist( [hsv], [0, 1], mask, [180, 256], [0, 180, 0, 256] )
+
+def read_labels(file_name):
+    '''
+    return a dict image -> dict color -> list of regions (x, y, w, h), None for the whole image
+    image paths are relative to the labels file
+    '''
+    base = os.path.dirname(os.path.realpath(file_name))
+    labels = {}
+    with open(file_name) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 2 or fields[0].startswith('#'):
+                continue
+            if fields[1] not in COLORS:
+                print("unknown color {} in {}".format(fields[1], line.strip()))
+                continue
+            image = os.path.join(base, fields[0])
+            region = tuple(int(v) for v in fields[2:6]) if len(fields) >= 6 else None
+            labels.setdefault(image, {}).setdefault(fields[1], []).append(region)
+    return labels
+
+def image_histograms(job):
+    '''
+    return the histograms of the labeled regions of an image for each color
+    job: (image file, dict color -> list of regions, min value of the pixels)
+    '''
+    (file_name, regions, v_min) = job
+    img, hsv = load_hsv(file_name)
+    if hsv is None:
+        print("can't read {}".format(file_name))
+        return {}
+    hists = {}
+    for color, rects in regions.items():
+        mask = np.zeros(hsv.shape[:2], np.uint8)
+        for rect in rects:
+            if rect is None:
+                mask[:] = 255
+            else:
+                (x, y, w, h) = rect
+                mask[y:y+h, x:x+w] = 255
+        if v_min > 0:
+            mask[hsv[..., 2] < v_min] = 0 # discard dark pixels
+        hists[color] = compute_hist(hsv, mask)
+    return hists
+
+def accumulate(jobs, processes=None):
+    '''
+    sum the histograms of all images for each color, images are processed in parallel
+    '''
+    total = {}
+    pool = Pool(processes)
+    try:
+        for hists in pool.imap_unordered(image_histograms, jobs):
+            for color, h in hists.items():
+                if color in total:
+                    total[color] += h
+                else:
+                    total[color] = h
+    finally:
+        pool.close()
+        pool.join()
+    return total
+
+def percentile_bounds(values, coverage):
+    '''
+    return the indexes of the lower and upper percentiles holding coverage of the values
+    '''
+    cdf = np.cumsum(values) / max(np.sum(values), 1e-9)
+    lo = int(np.searchsorted(cdf, 0.5 * (1. - coverage)))
+    hi = int(np.searchsorted(cdf, 1. - 0.5 * (1. - coverage)))
+    return lo, min(hi, len(values) - 1)
+
+def fit_range(hist, coverage=0.95, h_margin=2, s_margin=10):
+    '''
+    fit the hue and saturation range holding coverage of a 180x256 H-S histogram
+    the hue range is centered on the hue peak, so it can wrap around 180
+    (h_min > h_max, like MailboxDetector.set_hsv_th)
+    return (h_min, s_min, h_max, s_max) or None if the histogram is empty
+    '''
+    hue = hist.sum(axis=1)
+    if hue.sum() <= 0:
+        return None
+    # peak of the hue smoothed over a few bins (circular)
+    smooth = np.convolve(np.concatenate([hue[-2:], hue, hue[:2]]), np.ones(5), 'valid')
+    shift = 90 - int(np.argmax(smooth))
+    lo, hi = percentile_bounds(np.roll(hue, shift), coverage)
+    lo, hi = lo - h_margin, hi + h_margin
+    if hi - lo >= 179:
+        h_min, h_max = 0, 179
+        rows = np.arange(180)
+    else:
+        h_min, h_max = (lo - shift) % 180, (hi - shift) % 180
+        rows = np.arange(lo, hi + 1) - shift
+    s_lo, s_hi = percentile_bounds(hist[rows % 180].sum(axis=0), coverage)
+    return (h_min, max(0, s_lo - s_margin), h_max, min(255, s_hi + s_margin))
+
+def hsv_line(color, rng, v_min=0):
+    (h_min, s_min, h_max, s_max) = rng
+    return "hsv_{} {} {} {} {} {} 255".format(color, h_min, s_min, v_min, h_max, s_max)
+
+def update_script(file_name, lines):
+    '''
+    replace the hsv_* lines of a JeVois script file, or add them after the
+    '# Custom HSV ranges here' comment (at the end if not found)
+    '''
+    with open(file_name) as f:
+        content = f.read().splitlines()
+    for line in lines:
+        cmd = line.split(' ')[0]
+        idx = [i for i, l in enumerate(content) if l.split(' ')[0] == cmd]
+        if len(idx) > 0:
+            content[idx[0]] = line
+            continue
+        anchor = [i for i, l in enumerate(content) if l.startswith('# Custom HSV ranges')]
+        if len(anchor) > 0:
+            # after the anchor and the hsv lines following it
+            i = anchor[0] + 1
+            while i < len(content) and content[i].startswith('hsv_'):
+                i += 1
+            content.insert(i, line)
+        else:
+            content.append(line)
+    with open(file_name, 'w') as f:
+        f.write("\n".join(content) + "\n")
+
+def calibrate(labels, coverage, v_min, processes):
+    '''
+    return the hsv_* lines of the labeled colors
+    labels: dict image -> dict color -> list of regions (see read_labels)
+    '''
+    jobs = [(image, regions, v_min) for image, regions in sorted(labels.items())]
+    hists = accumulate(jobs, processes)
+    lines = []
+    for color in COLORS:
+        if color not in hists:
+            continue
+        rng = fit_range(hists[color], coverage)
+        if rng is None:
+            print("no pixel for {}".format(color))
+            continue
+        lines.append(hsv_line(color, rng, v_min))
+    return lines
+
+def interactive(file_names):
+    '''
+    interactive histogram view with cached HSV images and histograms
+    '''
+    images = []
+    for name in file_names:
+        img, hsv = load_hsv(name)
+        if img is None:
+            print("can't read {}".format(name))
+            continue
+        images.append((name, img, hsv))
+    if len(images) == 0:
+        print("Missing file input")
+        sys.exit(1)
+    # histogram of all images, computed once
+    hist = sum(compute_hist(hsv) for (_, _, hsv) in images)
+
+    hsv_map = np.zeros((180, 256, 3), np.uint8)
+    h, s = np.indices(hsv_map.shape[:2])
+    hsv_map[:,:,0] = h
+    hsv_map[:,:,1] = s
+    hsv_map[:,:,2] = 255
+    hsv_map = cv2.cvtColor(hsv_map, cv2.COLOR_HSV2BGR)
+    #cv2.imshow('hsv_map', hsv_map)
+
+    cv2.namedWindow('hist', cv2.WINDOW_NORMAL)
+    cv2.namedWindow('image', cv2.WINDOW_NORMAL)
+    state = { 'scale': 10, 'h_min': 0, 'h_max': 179, 's_min': 0, 's_max': 255, 'index': 0, 'updated': True }
+    mouse_hsv = [None]
+
+    def setter(name):
+        def set_val(val):
+            state[name] = val
+            state['updated'] = True
+        return set_val
+
+    def getpos(event,x,y,flags,param):
+        if event == cv2.EVENT_LBUTTONDOWN:
+            if mouse_hsv[0] is None:
+                mouse_hsv[0] = (y, x)
+            else:
+                state['h_min'] = mouse_hsv[0][0]
+                state['s_min'] = mouse_hsv[0][1]
+                state['h_max'] = y
+                state['s_max'] = x
+                for name in ['h_min', 'h_max', 's_min', 's_max']:
+                    cv2.setTrackbarPos(name, 'hist', state[name])
+                mouse_hsv[0] = None
+                state['updated'] = True
+
+    cv2.setMouseCallback("hist",getpos)
+
+    cv2.createTrackbar('scale', 'hist', state['scale'], 32, setter('scale'))
+    cv2.createTrackbar('h_min', 'hist', state['h_min'], 179, setter('h_min'))
+    cv2.createTrackbar('h_max', 'hist', state['h_max'], 179, setter('h_max'))
+    cv2.createTrackbar('s_min', 'hist', state['s_min'], 255, setter('s_min'))
+    cv2.createTrackbar('s_max', 'hist', state['s_max'], 255, setter('s_max'))
+
+    def plot_hist():
+        (name, img, hsv) = images[state['index']]
+        h_min, h_max = state['h_min'], state['h_max']
+        # can't swap s param
+        _s_min = min(state['s_min'], state['s_max'])
+        _s_max = max(state['s_min'], state['s_max'])
+
+        if h_min <= h_max:
+            lower = np.array([h_min, _s_min, 0])
+            upper = np.array([h_max, _s_max, 255])
+            mask = cv2.inRange(hsv, lower, upper)
+        else: # splitted
+            mask1 = cv2.inRange(hsv, np.array([0, _s_min, 0]), np.array([h_max, _s_max, 255]))
+            mask2 = cv2.inRange(hsv, np.array([h_min, _s_min, 0]), np.array([179, _s_max, 255]))
+            mask = cv2.bitwise_or(mask1, mask2)
+
+        img_masked = cv2.bitwise_and(img, img, mask=mask)
+
+        h = np.clip(hist*0.005*state['scale']/len(images), 0, 1)
+        vis = hsv_map*h[:,:,np.newaxis] / 255.0
+        if h_min <= h_max:
+            cv2.rectangle(vis,(_s_min,h_min),(_s_max,h_max),(0,255,0),1)
+        else: # splitted
+            cv2.rectangle(vis,(_s_min,0),(_s_max,h_max),(0,255,0),1)
+            cv2.rectangle(vis,(_s_min,h_min),(_s_max,179),(0,255,0),1)
+        cv2.imshow('hist', vis)
+        cv2.imshow('image', img_masked)
+        cv2.setWindowTitle('image', name)
+
+        # HSV output
+        print("[[{}, {}, 0],[{}, {}, 255]] | {} {} 0 {} {} 255".format(h_min, _s_min, h_max, _s_max, h_min, _s_min, h_max, _s_max))
+
+    while True:
+        if state['updated']:
+            plot_hist()
+            state['updated'] = False
+        ch = 0xFF & cv2.waitKey(1)
+        if ch == 27 or ch == ord('q'):
+            break
+        elif ch in [ord('n'), ord('p')]:
+            state['index'] = (state['index'] + (1 if ch == ord('n') else -1)) % len(images)
+            state['updated'] = True
+
+    cv2.destroyAllWindows()
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="HSV histogram view and batch HSV threshold calibration")
+    parser.add_argument('images', nargs='*', help="image files (interactive mode, or whole images of --color)")
+    parser.add_argument("-l", "--labels", help="labels file for batch calibration ('image color [x y w h]' lines)", default=None)
+    parser.add_argument("--color", help="batch calibration of this color with whole images", choices=COLORS, default=None)
+    parser.add_argument("-s", "--script", help="JeVois script file where hsv_* lines are written (printed if not set)", default=None)
+    parser.add_argument("-c", "--coverage", help="ratio of the labeled pixels inside the fitted range", type=float, default=0.95)
+    parser.add_argument("-v", "--v_min", help="discard pixels darker than this value", type=int, default=0)
+    parser.add_argument("-j", "--jobs", help="number of worker processes (all cores by default)", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.labels is None and args.color is None:
+        if len(args.images) == 0:
+            print("Missing file input")
+            sys.exit(1)
+        interactive(args.images)
+        sys.exit(0)
 
+    labels = read_labels(args.labels) if args.labels is not None else {}
+    if args.color is not None:
+        for image in args.images:
+            labels.setdefault(os.path.realpath(image), {}).setdefault(args.color, []).append(None)
+    lines = calibrate(labels, args.coverage, args.v_min, args.jobs)
+    for line in lines:
+        print(line)
+    if args.script is not None and len(lines) > 0:
+        update_script(args.script, lines)
+        print("{} updated".format(args.script))
 
 #hist = cv2.calcHist([HSV], [0, 1], None, [180, 256], [0, 180, 0, 256])
 #def getpos(event,x,y,flags,param):
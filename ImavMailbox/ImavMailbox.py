@@ -2,7 +2,16 @@ import libjevois as jevois
 import numpy as np
 import cv2
 import cv2 as cv
-from DetectMailbox import MailboxDetector
+import os
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'Common')) # shared helpers
+from StageTimer import StageTimer
+from SerialQueue import SerialQueue
+from FrameRecorder import FrameRecorder
+from BinaryProtocol import encode_frame, KIND_MAILBOX
+from DetectMailbox import MailboxDetector, ColorSegmenter, reduce_image
+from TrackMailbox import MailboxTracker
 
 MARK_RED = 1
 MARK_BLUE = 2
@@ -19,115 +28,265 @@ class ImavMailbox:
         self.mailbox_blue = MailboxDetector([[109, 176, 0],[145, 241, 255]], 1200)
         self.mailbox_yellow = MailboxDetector([[21, 195, 0],[45, 255, 255]], 1500)
         self.mailbox_orange = MailboxDetector([[141, 61, 0],[163, 76, 255]], 500)
+        self.detectors = [
+                (MARK_RED, self.mailbox_red),
+                (MARK_BLUE, self.mailbox_blue),
+                (MARK_YELLOW, self.mailbox_yellow),
+                (MARK_ORANGE, self.mailbox_orange) # assuming only one in image
+                ]
+        # convert to HSV only once per frame for all colors
+        self.segmenter = ColorSegmenter([d for (_, d) in self.detectors])
+        self.max_marks = [1] * len(self.detectors) # max number of detections per color
+
+        # ROI tracking mode
+        self.tracking = False
+        self.trackers = [MailboxTracker() for _ in self.detectors]
+        self.windows = [None] * len(self.detectors) # search windows of last frame
+
+        # altitude adaptive processing resolution (disabled by default, see 'scale' commands)
+        self.auto_scale = False
+        self.min_box = 32 # min expected marker side in pixels at processing level
+        self.max_level = 3 # max pyramid level (image reduced by 8)
+        self.levels = [0] * len(self.detectors) # processing level of each detector on last frame
 
         # cam params
         self.focal = (770., 770.)
         self.center = (320., 240.)
         self.calib_fisheye = None
 
-        self.save = None # save current image
+        # asynchronous frame recording (see 'record' commands)
+        self.recorder = FrameRecorder()
+
+        # per-stage timing statistics (disabled by default, see 'stats' commands)
+        self.stages = StageTimer()
+
+        # serial output (direct by default, see 'serial' commands)
+        self.serial = SerialQueue(jevois.sendSerial)
+        self.frame = 0 # frame counter
 
     def processNoUSB(self, inframe):
+        self.stages.begin()
         img = inframe.getCvBGR()
+        self.stages.mark("convert")
         self.processImage(img) # no need to process returned data
+        self.stages.end()
 
     def process(self, inframe, outframe):
+        self.stages.begin()
         img = inframe.getCvBGR()
+        self.stages.mark("convert")
         detect = self.processImage(img)
-        for mark in detect.values():
-            box = cv2.boxPoints(mark)
-            ctr = np.array(box).reshape((-1,1,2)).astype(np.int32)
-            cv2.drawContours(img, [ctr], -1, (0, 255, 0), 4)
+        for marks in detect.values():
+            for mark in marks:
+                box = cv2.boxPoints(mark)
+                ctr = np.array(box).reshape((-1,1,2)).astype(np.int32)
+                cv2.drawContours(img, [ctr], -1, (0, 255, 0), 4)
+        for win in self.windows:
+            if win is not None:
+                cv2.rectangle(img, (win[0], win[1]), (win[2] - 1, win[3] - 1), (255, 0, 0), 1)
+        self.stages.mark("draw")
         outframe.sendCv(img)
+        self.stages.mark("send")
+        self.stages.end()
         #outframe.sendCv(self.mailbox_yellow.mask)
 
     def processImage(self, img):
         '''
         process a single image
-        return a dict with detected featured
+        return a dict with the list of detected features for each mark
         '''
-        if self.save is not None:
-            cv2.imwrite(self.save, img)
-            jevois.LINFO(self.save)
-            self.save = None
-
         detect = {} # dict of detected objects
+        stamp = time.time() * 1000.
+        detections = [] # (mark, index, rect) sent at the end of the frame
 
         size_factor = None
         if self.alt > 1000:
             size_factor = self.focal[0] * self.focal[1] / (self.alt * self.alt)
 
-        # red
-        ret = self.mailbox_red.detect(img, size_factor)
-        if ret is not None:
-            detect[MARK_RED] = ret
-            self.send_message(MARK_RED, ret)
-
-        # blue
-        ret = self.mailbox_blue.detect(img, size_factor)
-        if ret is not None:
-            detect[MARK_BLUE] = ret
-            self.send_message(MARK_BLUE, ret)
-
-        # yellow
-        ret = self.mailbox_yellow.detect(img, size_factor)
-        if ret is not None:
-            detect[MARK_YELLOW] = ret
-            self.send_message(MARK_YELLOW, ret)
-
-        # orange (assuming only one in image)
-        ret = self.mailbox_orange.detect(img, size_factor)
-        if ret is not None:
-            detect[MARK_ORANGE] = ret
-            self.send_message(MARK_ORANGE, ret)
+        # pyramid level of each detector
+        levels = self.scale_levels()
+        self.levels = levels
 
+        # predicted search windows of locked markers (None for full frame search)
+        windows = [None] * len(self.detectors)
+        if self.tracking:
+            windows = [t.window(img.shape, d.size2, size_factor) if k == 1 else None
+                    for t, (_, d), k in zip(self.trackers, self.detectors, self.max_marks)]
+        full = [i for i, win in enumerate(windows) if win is None]
+        masks = {}
+        for level in sorted(set(levels[i] for i in full)):
+            # one segmentation per level for all full frame searches
+            idx = [i for i in full if levels[i] == level]
+            masks.update(zip(idx, self.segmenter.segment(reduce_image(img, level), idx)))
+        self.stages.mark("segment")
+
+        for i, (mark, detector) in enumerate(self.detectors):
+            win = windows[i]
+            if self.max_marks[i] > 1:
+                # several markers of the same color, no tracking
+                rets = [r for (r, _) in detector.detect_all_mask(masks[i], size_factor, self.max_marks[i], scale=1 << levels[i])]
+                self.stages.mark("detect")
+                detections += [(mark, n, ret) for n, ret in enumerate(rets)]
+                if len(rets) > 0:
+                    detect[mark] = rets
+                continue
+            elif win is None:
+                ret = detector.detect_mask(masks[i], size_factor, 1 << levels[i])
+            else:
+                x0, y0, x1, y1 = win
+                level = levels[i]
+                while level > 0 and min(x1 - x0, y1 - y0) < self.min_box << level:
+                    level -= 1 # window clipped by the image border
+                mask = self.segmenter.segment(reduce_image(img[y0:y1, x0:x1], level), [i])[0]
+                self.stages.mark("segment")
+                ret = detector.detect_mask(mask, size_factor, 1 << level)
+                if ret is not None:
+                    (u, v), wh, angle = ret
+                    ret = ((u + x0, v + y0), wh, angle)
+                else:
+                    # fall back to full frame search on loss
+                    win = None
+                    mask = self.segmenter.segment(reduce_image(img, levels[i]), [i])[0]
+                    self.stages.mark("segment")
+                    ret = detector.detect_mask(mask, size_factor, 1 << levels[i])
+            if self.tracking:
+                self.trackers[i].update(ret, detector.quality, win is None)
+            self.stages.mark("detect")
+            if ret is not None:
+                detect[mark] = [ret]
+                detections.append((mark, 0, ret))
+        self.windows = windows
+
+        self.send_messages(detections, stamp)
+        self.stages.mark("serial")
+        results = [(mark, index, u, v, w, h, angle) for (mark, index, ((u, v), (w, h), angle)) in detections]
+        if self.recorder.add(img, self.frame, stamp, results, { "alt": self.alt }):
+            self.stages.mark("record")
+        self.frame += 1
         return detect
 
-    def send_message(self, mark, pos):
+    def scale_levels(self):
         '''
-        send message over serial link to AP
+        return the pyramid level of each detector: the highest one (up to max_level)
+        where the expected marker side, from altitude and focal, is at least min_box pixels
+        '''
+        if not self.auto_scale or self.alt <= 0:
+            return [0] * len(self.detectors)
+        f = np.sqrt(self.focal[0] * self.focal[1]) / self.alt
+        levels = []
+        for (_, d) in self.detectors:
+            side = np.sqrt(d.size2) * f # expected side in pixels
+            level = 0
+            while level < self.max_level and side / (2 << level) >= self.min_box:
+                level += 1
+            levels.append(level)
+        return levels
+
+    def send_messages(self, detections, stamp):
         '''
-        (u, v), (w, h), _ = pos
-        x ,y = 0., 0.
+        send messages over serial link to AP
+        detections: list of (mark, index, pos) of the frame, index is the rank
+        of the detection for marks with several detections
+        positions of all marks are converted at once
+        '''
+        binary = self.serial.binary()
+        if len(detections) == 0 and not binary:
+            return
+        uv = np.array([pos[0] for (_, _, pos) in detections], dtype=np.float64).reshape(-1, 2)
         if self.calib_fisheye is None:
             # pos in "mm" in image frame
-            x = 1000. * (u - self.center[0]) / self.focal[0]
-            y = 1000. * (v - self.center[1]) / self.focal[1]
+            xy = 1000. * (uv - self.center) / self.focal
+        elif len(detections) > 0:
+            # a single call for all the marks of the frame
+            undist = cv2.fisheye.undistortPoints(uv.reshape(-1, 1, 2), self.calib_fisheye[0], self.calib_fisheye[1])
+            xy = 1000. * undist.reshape(-1, 2)
         else:
-            pts_uv = np.array([[[u, v]]], dtype=np.float32)
-            undist = cv2.fisheye.undistortPoints(pts_uv, self.calib_fisheye[0], self.calib_fisheye[1])
-            x = 1000. * undist[0][0][0]
-            y = 1000. * undist[0][0][1]
-        jevois.sendSerial("N2 {} {:.2f} {:.2f} {:.2f} {:.2f}".format(mark, x, y, w, h))
+            xy = uv
+        targets = []
+        for (mark, index, (_, (w, h), _)), (x, y) in zip(detections, xy):
+            if binary:
+                targets.append((mark, index, x, y, w, h))
+            else:
+                self.serial.send("N2 {} {:.2f} {:.2f} {:.2f} {:.2f}".format(mark, x, y, w, h), ("N2", mark, index))
+        if binary:
+            # all markers of the frame in a single message
+            self.serial.send(encode_frame(KIND_MAILBOX, self.frame, stamp, targets), "BIN")
 
     def parseSerial(self, cmd):
         str_list = cmd.split(' ')
         str_len = len(str_list)
+        stats = self.stages.parse_command(str_list)
+        if stats is not None:
+            return stats
+        serial = self.serial.parse_command(str_list)
+        if serial is not None:
+            return serial
+        record = self.recorder.parse_command(str_list)
+        if record is not None:
+            return record
         if str_len == 2 and str_list[0] == "alt" and str_list[1].isdigit():
             self.alt = int(str_list[1])
             return "OK"
         elif str_len == 2 and str_list[0] == "save":
-            self.save = "/jevois/data/images/{}.png".format(str_list[1])
-            return self.save
+            return self.recorder.snapshot(str_list[1])
         elif str_len == 7 and str_list[0] == "hsv_red":
             h_min = [int(str_list[1]), int(str_list[2]), int(str_list[3])]
             h_max = [int(str_list[4]), int(str_list[5]), int(str_list[6])]
             self.mailbox_red.set_hsv_th(h_min, h_max)
+            self.segmenter.invalidate()
             return "OK"
         elif str_len == 7 and str_list[0] == "hsv_blue":
             h_min = [int(str_list[1]), int(str_list[2]), int(str_list[3])]
             h_max = [int(str_list[4]), int(str_list[5]), int(str_list[6])]
             self.mailbox_blue.set_hsv_th(h_min, h_max)
+            self.segmenter.invalidate()
             return "OK"
         elif str_len == 7 and str_list[0] == "hsv_yellow":
             h_min = [int(str_list[1]), int(str_list[2]), int(str_list[3])]
             h_max = [int(str_list[4]), int(str_list[5]), int(str_list[6])]
             self.mailbox_yellow.set_hsv_th(h_min, h_max)
+            self.segmenter.invalidate()
             return "OK"
         elif str_len == 7 and str_list[0] == "hsv_orange":
             h_min = [int(str_list[1]), int(str_list[2]), int(str_list[3])]
             h_max = [int(str_list[4]), int(str_list[5]), int(str_list[6])]
             self.mailbox_orange.set_hsv_th(h_min, h_max)
+            self.segmenter.invalidate()
+            return "OK"
+        elif str_len == 2 and str_list[0] == "lut" and str_list[1] in ["on", "off"]:
+            self.segmenter.set_lut(str_list[1] == "on")
+            return "OK"
+        elif str_len == 3 and str_list[0] == "lut" and str_list[1] == "on" and str_list[2] in ["5", "6"]:
+            self.segmenter.set_lut(True, int(str_list[2]))
+            return "OK"
+        elif str_len == 2 and str_list[0] == "track" and str_list[1] in ["on", "off"]:
+            self.tracking = str_list[1] == "on"
+            for t in self.trackers:
+                t.reset()
+            self.windows = [None] * len(self.detectors)
+            return "OK"
+        elif str_len == 3 and str_list[0] == "track" and str_list[1] == "refresh" and str_list[2].isdigit():
+            for t in self.trackers:
+                t.refresh = max(1, int(str_list[2]))
+            return "OK"
+        elif str_len == 1 and str_list[0] == "track":
+            return " | ".join(["{} {}".format(mark, t.status()) for t, (mark, _) in zip(self.trackers, self.detectors)])
+        elif str_len == 2 and str_list[0] == "scale" and str_list[1] in ["auto", "off"]:
+            self.auto_scale = str_list[1] == "auto"
+            return "OK"
+        elif str_len == 3 and str_list[0] == "scale" and str_list[1] == "min" and str_list[2].isdigit():
+            self.min_box = max(1, int(str_list[2]))
+            return "OK"
+        elif str_len == 1 and str_list[0] == "scale":
+            return "{} min {} levels {}".format("auto" if self.auto_scale else "off", self.min_box,
+                    " ".join("{}:{}".format(mark, l) for (mark, _), l in zip(self.detectors, self.levels)))
+        elif str_len == 3 and str_list[0] == "max_marks" and str_list[1].isdigit() and str_list[2].isdigit():
+            marks = [mark for (mark, _) in self.detectors]
+            if int(str_list[1]) not in marks or int(str_list[2]) < 1:
+                return "ERR"
+            i = marks.index(int(str_list[1]))
+            self.max_marks[i] = int(str_list[2])
+            self.trackers[i].reset()
             return "OK"
         elif str_len == 5 and str_list[0] == "calib":
             self.focal = (float(str_list[1]), float(str_list[2]))
@@ -141,5 +300,5 @@ class ImavMailbox:
         return "ERR"
 
     def supportedCommands(self):
-        return "alt - set alt in mm"
+        return "alt - set alt in mm\nlut on|off [bits] - use color lookup table for segmentation (5 or 6 bits)\ntrack on|off - search locked markers in predicted windows\ntrack refresh N - full frame search every N frames\ntrack - report lock and loss state of each marker\nmax_marks M N - max number of detections for mark M (1 red, 2 blue, 3 yellow, 4 orange)\nscale auto|off - process on a reduced image when markers are large (from alt and focal)\nscale min PX - min expected marker side in pixels at the processing level\nscale - report the processing level of each mark\nserial queue on|off - send messages from a writer thread, keeping the latest of each kind\nserial rate R - max messages per second in queue mode (0 for no limit)\nserial proto text|bin [device] - text messages or one binary frame per video frame written to device (/dev/ttyS0 by default)\nserial [reset] - report (or reset) sent, coalesced and dropped counters\nrecord start [jpg|raw] - record frames and detections from a writer thread (JPEG files or raw frames)\nrecord stop - stop recording\nrecord snapshot [NAME] - save next frame as PNG (same as save NAME)\nrecord every N - record one frame every N\nrecord [reset] - report (or reset) waiting frames, written and dropped counters\nstats [reset|on|off] - per-stage timing statistics"
 
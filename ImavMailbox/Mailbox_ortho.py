@@ -1,6 +1,6 @@
 #!/usr/bin/python3
 import cv2
-from DetectMailbox import MailboxDetector
+from DetectMailbox import MailboxDetector, ColorSegmenter
 import numpy as np
 
 def boxPoints(pts):
@@ -13,6 +13,11 @@ DEFAULT_IMAGE_VIEWER = "gwenview"
 DEFAULT_IMAGE_OUTPUT = "out_detect.png"
 DEFAULT_SCALE_FACTOR = 4
 DEFAULT_RESOLUTION = 20 # pixels per meter
+DEFAULT_TILE_SIZE = 0 # 0 to process the whole image at once
+DEFAULT_OVERVIEW_SIZE = 8192 # max size in pixels of the output image in tile mode
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.tif', '.tiff', '.bmp', '.ppm', '.pnm', '.npy']
+BATCH_FIELDS = ['file', 'label', 'u', 'v', 'lat', 'lon', 'score']
 
 mailbox_red = MailboxDetector([[163, 173, 0],[9, 255, 255]], 750, color="RED")
 mailbox_blue = MailboxDetector([[103, 129, 0],[129, 190, 255]], 1200, color="BLUE")
@@ -20,6 +25,15 @@ mailbox_yellow = MailboxDetector([[21, 195, 0],[45, 255, 255]], 1500, color="YEL
 #mailbox_yellow = MailboxDetector([[0, 0, 0],[179, 6, 255]], 1500, aspect_ratio_th=0.6, color="YELLOW") # for test image only
 mailbox_orange = MailboxDetector([[141, 61, 0],[163, 76, 255]], 500, color="ORANGE")
 
+# detectors and labels of the expected mailboxes
+MAILBOXES = [
+        (mailbox_red, ["RED"]),
+        (mailbox_blue, ["BLUE"]),
+        (mailbox_yellow, ["YELLOW"]),
+        (mailbox_orange, ["ORANGE_1", "ORANGE_2", "ORANGE_3"])
+        ]
+segmenter = ColorSegmenter([d for (d, _) in MAILBOXES])
+
 def get_geo_data(filename):
     import os
     if os.path.splitext(filename)[1] == '.tif':
@@ -36,19 +50,103 @@ def get_geo_data(filename):
         print('not a tif file')
         return None
 
-def transform_utm_to_wgs84(easting, northing, zone=31):
-    try:
-        import osr
-        utm_coordinate_system = osr.SpatialReference()
-        utm_coordinate_system.SetWellKnownGeogCS("WGS84") # Set geographic coordinate system to handle lat/lon
-        is_northern = northing > 0    
-        utm_coordinate_system.SetUTM(zone, is_northern)
-        wgs84_coordinate_system = utm_coordinate_system.CloneGeogCS() # Clone ONLY the geographic coordinate system 
-        # create transform component
-        utm_to_wgs84_transform = osr.CoordinateTransformation(utm_coordinate_system, wgs84_coordinate_system) # (<from>, <to>)
-        return utm_to_wgs84_transform.TransformPoint(easting, northing, 0) # returns lon, lat, altitude
-    except:
+# WGS84 ellipsoid and UTM projection parameters
+WGS84_A = 6378137.
+WGS84_F = 1. / 298.257223563
+UTM_K0 = 0.9996
+UTM_FALSE_EASTING = 500000.
+UTM_FALSE_NORTHING_SOUTH = 10000000.
+
+_utm_transforms = {} # cache of UTM to WGS84 transformations per (zone, is_northern)
+
+def get_utm_to_wgs84_transform(zone, is_northern):
+    '''
+    return a cached osr UTM to WGS84 transformation
+    or None if osr is not available
+    '''
+    key = (zone, bool(is_northern))
+    if key not in _utm_transforms:
+        try:
+            try:
+                from osgeo import osr
+            except ImportError:
+                import osr
+            utm_coordinate_system = osr.SpatialReference()
+            utm_coordinate_system.SetWellKnownGeogCS("WGS84") # Set geographic coordinate system to handle lat/lon
+            utm_coordinate_system.SetUTM(zone, bool(is_northern))
+            wgs84_coordinate_system = utm_coordinate_system.CloneGeogCS() # Clone ONLY the geographic coordinate system
+            if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+                # GDAL >= 3: keep lon, lat order
+                utm_coordinate_system.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+                wgs84_coordinate_system.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            # create transform component
+            _utm_transforms[key] = osr.CoordinateTransformation(utm_coordinate_system, wgs84_coordinate_system) # (<from>, <to>)
+        except ImportError:
+            _utm_transforms[key] = None
+    return _utm_transforms[key]
+
+def utm_to_wgs84_numpy(easting, northing, zone=31, is_northern=True):
+    '''
+    Pure numpy inverse UTM projection (Krueger series, sub-millimeter in zone)
+    return arrays of lon, lat in degrees
+    '''
+    easting = np.asarray(easting, dtype=np.float64)
+    northing = np.asarray(northing, dtype=np.float64)
+    n = WGS84_F / (2. - WGS84_F)
+    A = WGS84_A / (1. + n) * (1. + n**2 / 4. + n**4 / 64.)
+    beta = [n / 2. - 2. * n**2 / 3. + 37. * n**3 / 96., n**2 / 48. + n**3 / 15., 17. * n**3 / 480.]
+    delta = [2. * n - 2. * n**2 / 3. - 2. * n**3, 7. * n**2 / 3. - 8. * n**3 / 5., 56. * n**3 / 15.]
+    north0 = 0. if is_northern else UTM_FALSE_NORTHING_SOUTH
+    xi = (northing - north0) / (UTM_K0 * A)
+    eta = (easting - UTM_FALSE_EASTING) / (UTM_K0 * A)
+    xi_p = xi.copy()
+    eta_p = eta.copy()
+    for j, b in enumerate(beta, 1):
+        xi_p -= b * np.sin(2 * j * xi) * np.cosh(2 * j * eta)
+        eta_p -= b * np.cos(2 * j * xi) * np.sinh(2 * j * eta)
+    chi = np.arcsin(np.sin(xi_p) / np.cosh(eta_p))
+    lat = chi.copy()
+    for j, d in enumerate(delta, 1):
+        lat += d * np.sin(2 * j * chi)
+    lon0 = np.radians(zone * 6. - 183.)
+    lon = lon0 + np.arctan2(np.sinh(eta_p), np.cos(xi_p))
+    return np.degrees(lon), np.degrees(lat)
+
+def transform_utm_to_wgs84_batch(easting, northing, zone=31, is_northern=True):
+    '''
+    project arrays of UTM coordinates in a single call
+    return a (N, 3) array of lon, lat, altitude
+    '''
+    easting = np.asarray(easting, dtype=np.float64).ravel()
+    northing = np.asarray(northing, dtype=np.float64).ravel()
+    transform = get_utm_to_wgs84_transform(zone, is_northern)
+    if transform is not None:
+        try:
+            pts = np.column_stack((easting, northing, np.zeros_like(easting)))
+            return np.array(transform.TransformPoints(pts.tolist()), dtype=np.float64).reshape((-1, 3))
+        except RuntimeError:
+            pass # fall back to numpy projection
+    lon, lat = utm_to_wgs84_numpy(easting, northing, zone, is_northern)
+    return np.column_stack((lon, lat, np.zeros_like(lon)))
+
+def transform_utm_to_wgs84(easting, northing, zone=31, is_northern=None):
+    if is_northern is None:
+        is_northern = northing > 0
+    return tuple(float(c) for c in transform_utm_to_wgs84_batch([easting], [northing], zone, is_northern)[0]) # returns lon, lat, altitude
+
+def pixels2coords(x, y, geo, zone=31, is_northern=True):
+    '''
+    Returns global coordinates from arrays of pixel x, y coords
+    as a (N, 3) array of lon, lat, altitude, or None without geo data
+    '''
+    if geo is None:
         return None
+    x = np.asarray(x, dtype=np.float64).ravel()
+    y = np.asarray(y, dtype=np.float64).ravel()
+    xoff, a, b, yoff, d, e = geo
+    xp = a * x + b * y + xoff
+    yp = d * x + e * y + yoff
+    return transform_utm_to_wgs84_batch(xp, yp, zone, is_northern)
 
 def pixel2coord(x, y, geo):
     """Returns global coordinates from pixel x, y coords"""
@@ -60,7 +158,7 @@ def pixel2coord(x, y, geo):
     else:
         return None
 
-def process_result(img, out, res, label, geo=None):
+def draw_result(out, res, label, geo=None):
     center = (int(res[0][0]), int(res[0][1]))
     cv2.circle(out, center, 50, (0, 255, 0), 5)
     cv2.putText(out, label, (center[0]+60, center[1]), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 0), lineType=cv2.LINE_AA)
@@ -68,52 +166,355 @@ def process_result(img, out, res, label, geo=None):
     if coord is not None:
         # print lat lon if available
         cv2.putText(out, '{:.7f} {:.7f}'.format(coord[1], coord[0]), (center[0]+60, center[1]+30), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0, 255, 0), lineType=cv2.LINE_AA)
-    box = boxPoints(res)
-    ctr = np.array(box).reshape((-1,1,2)).astype(np.int32)
-    mask = np.zeros((img.shape[0], img.shape[1], 1), np.uint8)
-    cv2.drawContours(mask, [ctr], -1, (255,255,255),-1)
-    img = cv2.bitwise_and(img,img,mask = cv2.bitwise_not(mask))
-    return img, out
+    return out
+
+def show_image(out):
+    cv2.imshow('frame', out)
+    while True:
+        if cv2.waitKey(-1)  & 0xFF == ord('q'):
+            break
+    cv2.destroyAllWindows()
+
+def detect_mailboxes(img, res=DEFAULT_RESOLUTION):
+    '''
+    return a list of (label, rect, score) of the mailboxes found in image
+    '''
+    scale_factor = pow(res / 1000., 2)
+    results = []
+    masks = segmenter.segment(img)
+    for (detector, labels), mask in zip(MAILBOXES, masks):
+        for label, (rect, score) in zip(labels, detector.detect_all_mask(mask, scale_factor, len(labels))):
+            results.append((label, rect, score))
+    return results
 
 def find_mailboxes(img, output=None, scale=DEFAULT_SCALE_FACTOR, res=DEFAULT_RESOLUTION, geo=None):
+    results = detect_mailboxes(img, res)
+
     out = img.copy()
+    for (label, rect, _) in results:
+        draw_result(out, rect, label, geo)
 
-    scale_factor = pow(res / 1000., 2)
+    if output is None:
+        w, h, _ = img.shape
+        show_image(cv2.resize(out, (int(h/scale),int(w/scale))))
+    else:
+        cv2.imwrite(output, out)
+    return results
+
+def read_bmp_header(filename):
+    '''
+    return (offset, width, height, bottom_up) for an uncompressed 24 bits BMP file
+    '''
+    import struct
+    with open(filename, 'rb') as f:
+        header = f.read(54)
+    if len(header) < 54 or header[:2] != b'BM':
+        raise ValueError('not a BMP file')
+    offset = struct.unpack('<I', header[10:14])[0]
+    width, height = struct.unpack('<ii', header[18:26])
+    bpp, compression = struct.unpack('<HI', header[28:34])
+    if bpp != 24 or compression != 0:
+        raise ValueError('only uncompressed 24 bits BMP can be memory-mapped')
+    return offset, width, abs(height), height > 0
+
+def read_ppm_header(filename):
+    '''
+    return (offset, width, height) for a binary 8 bits PPM file
+    '''
+    with open(filename, 'rb') as f:
+        data = f.read(512)
+    fields = []
+    pos = 0
+    while len(fields) < 4:
+        while data[pos:pos+1].isspace():
+            pos += 1
+        if data[pos:pos+1] == b'#':
+            pos = data.index(b'\n', pos)
+            continue
+        end = pos
+        while not data[end:end+1].isspace():
+            end += 1
+        fields.append(data[pos:end])
+        pos = end
+    if fields[0] != b'P6' or int(fields[3]) != 255:
+        raise ValueError('only binary 8 bits PPM can be memory-mapped')
+    return pos + 1, int(fields[1]), int(fields[2])
+
+def open_image_reader(filename):
+    '''
+    Open an image for windowed reads without loading it entirely
+    return (width, height, block, read) where read(x, y, w, h) returns a BGR window
+    and block is the preferred (width, height) of a read or None
+
+    GDAL block reads are used for 8 bits RGB(A) GeoTIFF, memory-mapped reads
+    for numpy (.npy), uncompressed BMP and binary PPM files.
+    Other formats (and other GeoTIFF) are fully loaded with OpenCV.
+    '''
+    import os
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in ['.tif', '.tiff']:
+        try:
+            from osgeo import gdal
+            ds = gdal.Open(filename)
+            bands = [ds.GetRasterBand(i + 1) for i in range(min(3, ds.RasterCount))]
+            if len(bands) == 3 and all(b.DataType == gdal.GDT_Byte for b in bands):
+                def read_gdal(x, y, w, h):
+                    # GDAL bands are RGB, swap to BGR
+                    chans = [b.ReadAsArray(x, y, w, h) for b in reversed(bands)]
+                    return np.ascontiguousarray(np.dstack(chans))
+                return ds.RasterXSize, ds.RasterYSize, tuple(bands[0].GetBlockSize()), read_gdal
+            print('GeoTIFF is not 8 bits RGB, loading whole image')
+        except:
+            print('failed loading gdal, loading whole image')
+    elif ext == '.npy':
+        data = np.load(filename, mmap_mode='r')
+        def read_npy(x, y, w, h):
+            win = np.array(data[y:y+h, x:x+w])
+            if win.ndim == 2:
+                win = cv2.cvtColor(win, cv2.COLOR_GRAY2BGR)
+            return win
+        return data.shape[1], data.shape[0], None, read_npy
+    elif ext == '.bmp':
+        try:
+            offset, width, height, bottom_up = read_bmp_header(filename)
+            stride = ((width * 3 + 3) // 4) * 4 # rows are padded to 4 bytes
+            data = np.memmap(filename, np.uint8, 'r', offset, (height, stride))
+            def read_bmp(x, y, w, h):
+                if bottom_up:
+                    rows = data[height-y-h:height-y][::-1]
+                else:
+                    rows = data[y:y+h]
+                return np.array(rows[:, 3*x:3*(x+w)]).reshape((h, w, 3))
+            return width, height, None, read_bmp
+        except ValueError as e:
+            print('{}, loading whole image'.format(e))
+    elif ext in ['.ppm', '.pnm']:
+        try:
+            offset, width, height = read_ppm_header(filename)
+            data = np.memmap(filename, np.uint8, 'r', offset, (height, width, 3))
+            def read_ppm(x, y, w, h):
+                return np.ascontiguousarray(data[y:y+h, x:x+w, ::-1]) # RGB to BGR
+            return width, height, None, read_ppm
+        except ValueError as e:
+            print('{}, loading whole image'.format(e))
+    img = cv2.imread(filename)
+    def read_img(x, y, w, h):
+        return img[y:y+h, x:x+w]
+    return img.shape[1], img.shape[0], None, read_img
+
+def iter_tiles(width, height, tile_size, overlap, block=None):
+    '''
+    iterate over overlapping tiles (x, y, w, h) covering the image
+    tile size is aligned on the reader block size on each axis where the block
+    is not larger than the tile (e.g. not on the width of striped GeoTIFF)
+    '''
+    step = max(1, tile_size - overlap)
+    step_x, step_y = step, step
+    if block is not None and 0 < block[0] <= step:
+        step_x = (step // block[0]) * block[0]
+    if block is not None and 0 < block[1] <= step:
+        step_y = (step // block[1]) * block[1]
+    for y in range(0, max(1, height - overlap), step_y):
+        for x in range(0, max(1, width - overlap), step_x):
+            yield x, y, min(step_x + overlap, width - x), min(step_y + overlap, height - y)
 
-    res = mailbox_red.detect(img, scale_factor)
-    if res is not None:
-        img, out = process_result(img, out, res, "RED", geo)
+def same_box(r1, r2):
+    '''
+    True if two detections are the same box seen from overlapping tiles
+    '''
+    (u1, v1), (w1, h1), _ = r1
+    (u2, v2), (w2, h2), _ = r2
+    dist = 0.5 * max(w1, h1, w2, h2)
+    return abs(u1 - u2) < dist and abs(v1 - v2) < dist
 
-    res = mailbox_blue.detect(img, scale_factor)
-    if res is not None:
-        img, out = process_result(img, out, res, "BLUE", geo)
+def detect_mailboxes_tiled(filename, res=DEFAULT_RESOLUTION, tile_size=4096, overlap=None, scale=None, reader=None):
+    '''
+    Search mailboxes in a large image by overlapping tiles
+    Peak memory only depends on the tile size (and overview size)
+    reader: result of open_image_reader(filename) if already opened
+    return (results, overview) where results is a list of (label, rect, score)
+    in full image coordinates and overview a downscaled image (None if scale is None)
+    '''
+    if reader is None:
+        reader = open_image_reader(filename)
+    width, height, block, read = reader
+    if overlap is None:
+        # any accepted box (whatever its orientation) fully fits in at least one tile
+        max_size = max([d.size_th[1] for (d, _) in MAILBOXES])
+        overlap = int(np.ceil(max_size * np.sqrt(2.)))
+    tile_size = max(tile_size, 2 * overlap)
 
-    res = mailbox_yellow.detect(img, scale_factor)
-    if res is not None:
-        img, out = process_result(img, out, res, "YELLOW", geo)
+    out = None
+    if scale is not None:
+        out = np.zeros((int(np.ceil(height / float(scale))), int(np.ceil(width / float(scale))), 3), np.uint8)
 
-    res = mailbox_orange.detect(img, scale_factor)
-    if res is not None:
-        img, out = process_result(img, out, res, "ORANGE_1", geo)
+    scale_factor = pow(res / 1000., 2)
+    candidates = [[] for _ in MAILBOXES]
+    for (x, y, w, h) in iter_tiles(width, height, tile_size, overlap, block):
+        tile = read(x, y, w, h)
+        if out is not None:
+            ox, oy = int(x / scale), int(y / scale)
+            small = cv2.resize(tile, (int(np.ceil((x + w) / float(scale))) - ox, int(np.ceil((y + h) / float(scale))) - oy))
+            out[oy:oy+small.shape[0], ox:ox+small.shape[1]] = small
+        masks = segmenter.segment(tile)
+        for i, ((detector, labels), mask) in enumerate(zip(MAILBOXES, masks)):
+            for (rect, score) in detector.detect_all_mask(mask, scale_factor, len(labels)):
+                (u, v), wh, angle = rect
+                rect = ((u + x, v + y), wh, angle)
+                # merge duplicates from tile overlaps, keep best score
+                dup = [k for k, (r, _) in enumerate(candidates[i]) if same_box(r, rect)]
+                if len(dup) == 0:
+                    candidates[i].append((rect, score))
+                elif score > candidates[i][dup[0]][1]:
+                    candidates[i][dup[0]] = (rect, score)
 
-    res = mailbox_orange.detect(img, scale_factor)
-    if res is not None:
-        img, out = process_result(img, out, res, "ORANGE_2", geo)
+    results = []
+    for (detector, labels), cands in zip(MAILBOXES, candidates):
+        cands = sorted(cands, key=lambda c: c[1], reverse=True)
+        for label, (rect, score) in zip(labels, cands):
+            results.append((label, rect, score))
+    return results, out
 
-    res = mailbox_orange.detect(img, scale_factor)
-    if res is not None:
-        img, out = process_result(img, out, res, "ORANGE_3", geo)
+def find_mailboxes_tiled(filename, output=None, scale=DEFAULT_SCALE_FACTOR, res=DEFAULT_RESOLUTION, geo=None, tile_size=4096, overlap=None):
+    '''
+    Search mailboxes in a large image by overlapping tiles
+    and print results, output is a bounded size overview
+    '''
+    reader = open_image_reader(filename)
+    width, height, _, _ = reader
+    scale = max(scale, int(np.ceil(max(width, height) / float(DEFAULT_OVERVIEW_SIZE))))
+    results, out = detect_mailboxes_tiled(filename, res, tile_size, overlap, scale, reader)
+    for (label, rect, score) in results:
+        center = (int(rect[0][0] / scale), int(rect[0][1] / scale))
+        cv2.circle(out, center, int(50 / scale) + 5, (0, 255, 0), 2)
+        cv2.putText(out, label, (center[0]+15, center[1]), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), lineType=cv2.LINE_AA)
+        coord = pixel2coord(rect[0][0], rect[0][1], geo)
+        if coord is not None:
+            print('{} {:.1f} {:.1f} {:.7f} {:.7f}'.format(label, rect[0][0], rect[0][1], coord[1], coord[0]))
+        else:
+            print('{} {:.1f} {:.1f}'.format(label, rect[0][0], rect[0][1]))
 
     if output is None:
-        w, h, _ = img.shape
-        img_out = cv2.resize(out, (int(h/scale),int(w/scale)))
-        cv2.imshow('frame',img_out)
-        while True:
-            if cv2.waitKey(-1)  & 0xFF == ord('q'):
-                break
-        cv2.destroyAllWindows()
+        show_image(out)
     else:
         cv2.imwrite(output, out)
+    return results
+
+def list_images(path):
+    '''
+    list image files from a directory or a glob pattern
+    '''
+    import os
+    import glob
+    if os.path.isdir(path):
+        names = [os.path.join(path, f) for f in os.listdir(path)]
+        return sorted([f for f in names if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS])
+    return sorted(glob.glob(path))
+
+def init_worker():
+    cv2.setNumThreads(1) # parallelism comes from the process pool
+
+def process_file(job):
+    '''
+    batch worker: search mailboxes in a single file
+    return (filename, megapixels, records, error)
+    '''
+    import os
+    filename, res, tile_size, overlap, render_dir, scale = job
+    try:
+        geo = None
+        if os.path.splitext(filename)[1] == '.tif':
+            geo = get_geo_data(filename)
+        out = None
+        if tile_size > 0:
+            reader = open_image_reader(filename) # opened once, fallback readers decode the whole image
+            width, height, _, _ = reader
+            overview = None
+            if render_dir is not None:
+                overview = max(scale, int(np.ceil(max(width, height) / float(DEFAULT_OVERVIEW_SIZE))))
+            results, out = detect_mailboxes_tiled(filename, res, tile_size, overlap, overview, reader)
+        else:
+            img = cv2.imread(filename)
+            if img is None:
+                return filename, 0., [], 'failed loading image'
+            height, width = img.shape[:2]
+            results = detect_mailboxes(img, res)
+            if render_dir is not None:
+                out = img.copy()
+                for (label, rect, _) in results:
+                    draw_result(out, rect, label, geo)
+                out = cv2.resize(out, (int(width/scale), int(height/scale)))
+        records = []
+        coords = None
+        if len(results) > 0:
+            coords = pixels2coords([r[0][0] for (_, r, _) in results], [r[0][1] for (_, r, _) in results], geo)
+        for i, (label, rect, score) in enumerate(results):
+            coord = None if coords is None else coords[i]
+            records.append({
+                'file': filename,
+                'label': label,
+                'u': round(float(rect[0][0]), 2),
+                'v': round(float(rect[0][1]), 2),
+                'lat': None if coord is None else float(coord[1]),
+                'lon': None if coord is None else float(coord[0]),
+                'score': float(score)
+                })
+        if out is not None:
+            name = os.path.splitext(os.path.basename(filename))[0] + '_detect.png'
+            cv2.imwrite(os.path.join(render_dir, name), out)
+        return filename, width * height / 1e6, records, None
+    except Exception as e:
+        return filename, 0., [], str(e)
+
+def run_batch(path, results=None, render_dir=None, scale=DEFAULT_SCALE_FACTOR, res=DEFAULT_RESOLUTION, tile_size=DEFAULT_TILE_SIZE, overlap=None, jobs=None):
+    '''
+    Search mailboxes in all images of a directory or glob with a process pool
+    Results are streamed to CSV or JSON Lines (from results file extension, CSV on stdout by default)
+    '''
+    import sys
+    import time
+    import json
+    import csv
+    from multiprocessing import Pool, cpu_count
+
+    files = list_images(path)
+    if len(files) == 0:
+        print('no image found in {}'.format(path))
+        return
+    jobs = cpu_count() if jobs is None else jobs
+
+    out = sys.stdout if results is None else open(results, 'w')
+    use_json = results is not None and results.endswith(('.jsonl', '.json'))
+    writer = None
+    if not use_json:
+        writer = csv.DictWriter(out, fieldnames=BATCH_FIELDS)
+        writer.writeheader()
+
+    nb_img, nb_mp = 0, 0.
+    start = time.time()
+    pool = Pool(jobs, init_worker)
+    try:
+        args = [(f, res, tile_size, overlap, render_dir, scale) for f in files]
+        for filename, mp, records, error in pool.imap_unordered(process_file, args):
+            if error is not None:
+                sys.stderr.write('{}: {}\n'.format(filename, error))
+                continue
+            nb_img += 1
+            nb_mp += mp
+            for r in records:
+                if use_json:
+                    out.write(json.dumps(r) + '\n')
+                else:
+                    writer.writerow(r)
+            out.flush()
+    finally:
+        pool.close()
+        pool.join()
+        if out is not sys.stdout:
+            out.close()
+    elapsed = max(time.time() - start, 1e-6)
+    sys.stderr.write('{} images, {:.1f} Mpx in {:.2f} s: {:.2f} images/s, {:.2f} Mpx/s ({} jobs)\n'.format(
+        nb_img, nb_mp, elapsed, nb_img / elapsed, nb_mp / elapsed, jobs))
 
 if __name__ == '__main__':
     '''
@@ -121,20 +522,32 @@ if __name__ == '__main__':
     '''
     import argparse
     import subprocess
+    import sys
 
     parser = argparse.ArgumentParser(description="Search mailboxes in image")
-    parser.add_argument('img', help="image path")
+    parser.add_argument('img', help="image path (directory or glob pattern in batch mode)")
     parser.add_argument("-v", "--viewer", help="program used to open the image", default=DEFAULT_IMAGE_VIEWER)
     parser.add_argument("-nv", "--no_view", help="Do not open image after processing", action='store_true')
-    parser.add_argument("-o", "--output", help="output file name", default=None)
+    parser.add_argument("-o", "--output", help="output file name (results file in batch mode, .csv or .jsonl)", default=None)
     parser.add_argument("-s", "--scale", help="resize scale factor", type=int, default=DEFAULT_SCALE_FACTOR)
     parser.add_argument("-r", "--resolution", help="resolution in pixels per meter", type=float, default=DEFAULT_RESOLUTION)
+    parser.add_argument("-t", "--tile", help="process image by tiles of this size in pixels (0 for whole image)", type=int, default=DEFAULT_TILE_SIZE)
+    parser.add_argument("--overlap", help="tile overlap in pixels (default from max mailbox size)", type=int, default=None)
+    parser.add_argument("-b", "--batch", help="process all images of a directory or glob pattern", action='store_true')
+    parser.add_argument("-j", "--jobs", help="number of processes in batch mode (default to number of cores)", type=int, default=None)
+    parser.add_argument("--render_dir", help="write rendered images to this directory in batch mode (none by default)", default=None)
     args = parser.parse_args()
 
-    img = cv2.imread(args.img)
+    if args.batch:
+        run_batch(args.img, args.output, args.render_dir, args.scale, args.resolution, args.tile, args.overlap, args.jobs)
+        sys.exit(0)
+
     geo = get_geo_data(args.img)
-    find_mailboxes(img, args.output, args.scale, args.resolution, geo)
+    if args.tile > 0:
+        find_mailboxes_tiled(args.img, args.output, args.scale, args.resolution, geo, args.tile, args.overlap)
+    else:
+        img = cv2.imread(args.img)
+        find_mailboxes(img, args.output, args.scale, args.resolution, geo)
 
     if not args.no_view and args.output is not None:
         subprocess.call([args.viewer, args.output])
-
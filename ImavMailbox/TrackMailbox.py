@@ -0,0 +1,92 @@
+import numpy as np
+
+STATE_SEARCH = "SEARCH" # no lock, full frame search
+STATE_LOCK = "LOCK" # locked, search in predicted window
+STATE_LOST = "LOST" # lock lost on last frame, full frame search
+
+class MailboxTracker:
+    '''
+    Track-then-verify state for a single mailbox marker
+
+    After a confident detection, the next frames are only searched in a
+    predicted window around the last rectangle. A full frame search is done
+    when the lock is lost or every 'refresh' frames.
+    '''
+
+    def __init__(self, refresh=10, margin=2., quality_th=0.8):
+        self.refresh = refresh # force full frame search every N frames
+        self.margin = margin # window size relative to the marker size
+        self.quality_th = quality_th # min quality to get a lock
+        self.reset()
+
+    def reset(self):
+        self.state = STATE_SEARCH
+        self.rect = None
+        self.velocity = (0., 0.)
+        self.frames_since_full = 0
+        self.lock_frames = 0 # number of frames in current lock
+        self.loss_count = 0 # number of lost locks since reset
+
+    def locked(self):
+        return self.state == STATE_LOCK
+
+    def window(self, shape, size2=None, size_factor=None):
+        '''
+        return the predicted search window (x0, y0, x1, y1) in image of given shape
+        or None if a full frame search is required
+        '''
+        if not self.locked() or self.frames_since_full >= self.refresh:
+            return None
+        (u, v), (w, h), _ = self.rect
+        du, dv = self.velocity
+        side = max(w, h)
+        if size2 is not None and size_factor is not None:
+            side = max(side, np.sqrt(size2 * size_factor)) # expected size in pixels
+        half_w = 0.5 * side * self.margin + abs(du)
+        half_h = 0.5 * side * self.margin + abs(dv)
+        u += du
+        v += dv
+        x0 = int(max(0, u - half_w))
+        y0 = int(max(0, v - half_h))
+        x1 = int(min(shape[1], u + half_w + 1))
+        y1 = int(min(shape[0], v + half_h + 1))
+        if x1 <= x0 or y1 <= y0:
+            return None # prediction out of image
+        return (x0, y0, x1, y1)
+
+    def update(self, rect, quality=0., full=True):
+        '''
+        update tracker state with the result of a search
+        full: True if the search was done on the full frame
+        '''
+        if full:
+            self.frames_since_full = 0
+        else:
+            self.frames_since_full += 1
+        if rect is None:
+            if self.locked():
+                self.loss_count += 1
+                self.state = STATE_LOST
+            else:
+                self.state = STATE_SEARCH
+            self.rect = None
+            self.velocity = (0., 0.)
+            self.lock_frames = 0
+            return
+        if self.locked():
+            # smoothed constant velocity motion model
+            du = rect[0][0] - self.rect[0][0]
+            dv = rect[0][1] - self.rect[0][1]
+            self.velocity = (0.5 * (self.velocity[0] + du), 0.5 * (self.velocity[1] + dv))
+            self.lock_frames += 1
+        elif quality >= self.quality_th:
+            self.state = STATE_LOCK
+            self.velocity = (0., 0.)
+            self.lock_frames = 1
+        else:
+            self.state = STATE_SEARCH
+        self.rect = rect
+
+    def status(self):
+        return "{} locked {} lost {}".format(self.state, self.lock_frames, self.loss_count)
+
@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+'''
+Compare speed and mask agreement of the HSV and LUT segmentation paths
+
+Usage: bench_segmentation.py [-n loops] [-b bits] [images...]
+Without image, a random color frame is used.
+'''
+import cv2
+import numpy as np
+import time
+from DetectMailbox import MailboxDetector, ColorSegmenter
+
+# same initial thresholds as ImavMailbox
+DETECTORS = [
+        MailboxDetector([[163, 173, 0],[9, 255, 255]], 750, color="RED"),
+        MailboxDetector([[109, 176, 0],[145, 241, 255]], 1200, color="BLUE"),
+        MailboxDetector([[21, 195, 0],[45, 255, 255]], 1500, color="YELLOW"),
+        MailboxDetector([[141, 61, 0],[163, 76, 255]], 500, color="ORANGE")
+        ]
+
+def time_segment(segmenter, img, loops):
+    segmenter.segment(img) # warm up (and build LUT)
+    start = time.time()
+    for _ in range(loops):
+        masks = segmenter.segment(img)
+    return (time.time() - start) / loops, masks
+
+def bench(images, loops=20, bits=6):
+    hsv_seg = ColorSegmenter(DETECTORS)
+    lut_seg = ColorSegmenter(DETECTORS, use_lut=True, lut_bits=bits)
+    start = time.time()
+    lut_seg.build_lut()
+    print("LUT build ({} bits): {:.1f} ms".format(bits, 1000. * (time.time() - start)))
+    for name, img in images:
+        t_hsv, masks_hsv = time_segment(hsv_seg, img, loops)
+        t_lut, masks_lut = time_segment(lut_seg, img, loops)
+        print("{} {}x{}: hsv {:.2f} ms | lut {:.2f} ms | speedup {:.2f}".format(
+            name, img.shape[1], img.shape[0], 1000. * t_hsv, 1000. * t_lut, t_hsv / t_lut))
+        for d, m_hsv, m_lut in zip(DETECTORS, masks_hsv, masks_lut):
+            a = m_hsv > 0
+            b = m_lut > 0
+            union = np.count_nonzero(a | b)
+            iou = np.count_nonzero(a & b) / union if union > 0 else 1.
+            print("  {:7s} agreement {:.4f} | IoU {:.4f} | pixels hsv {} lut {}".format(
+                d.color, np.mean(a == b), iou, np.count_nonzero(a), np.count_nonzero(b)))
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark HSV and LUT color segmentation")
+    parser.add_argument('img', nargs='*', help="image path (random frame if none)")
+    parser.add_argument("-n", "--loops", help="number of loops per image", type=int, default=20)
+    parser.add_argument("-b", "--bits", help="LUT bits per channel", type=int, default=6, choices=[5, 6])
+    args = parser.parse_args()
+
+    images = []
+    for name in args.img:
+        img = cv2.imread(name)
+        if img is None:
+            print("failed loading {}".format(name))
+            continue
+        images.append((name, img))
+    if len(images) == 0:
+        rng = np.random.RandomState(0)
+        images.append(("random", rng.randint(0, 256, (480, 640, 3)).astype(np.uint8)))
+
+    bench(images, args.loops, args.bits)
+
@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+'''
+Benchmark of the detection pipelines on deterministic synthetic scenes
+
+Each pipeline (module) is run on generated frames at several resolutions:
+- led: bright LED blob with static distractors for UavLedDetector
+  (led_s2 and led_s4 with detection on reduced images)
+- mailbox: colored squares of known size under noise and blur for ImavMailbox
+- face: face crops pasted on backgrounds for FaceDetect
+
+Throughput and latency distribution are reported and can be saved as
+a JSON baseline. When comparing with a baseline, regressions beyond a
+threshold are flagged and the script exits with an error.
+
+Example:
+    benchmark.py --save baseline.json
+    benchmark.py --compare baseline.json --threshold 0.15
+'''
+
+import os
+import sys
+import json
+import time
+import cv2
+import numpy as np
+import replay
+import libjevois as jevois
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+RESOLUTIONS = [(320, 240), (640, 480), (1280, 1024)]
+
+def noise(rng, img, sigma):
+    '''
+    add zero mean gaussian noise, saturated to the uint8 range
+    '''
+    return np.clip(img.astype(np.int16) + rng.normal(0., sigma, img.shape).round(), 0, 255).astype(np.uint8)
+
+def led_scene(width, height, nb, seed=0):
+    '''
+    dark scene with static bright distractors and a moving LED blob
+    '''
+    rng = np.random.RandomState(seed)
+    base = np.full((height, width, 3), 20, np.uint8)
+    for _ in range(5):
+        # static lights (masked on first frame)
+        x, y = rng.randint(0, width - 40), rng.randint(0, height - 40)
+        cv2.rectangle(base, (x, y), (x + rng.randint(8, 40), y + rng.randint(8, 40)), (250, 250, 250), -1)
+    radius = max(2, width // 160)
+    frames = []
+    for i in range(nb):
+        img = noise(rng, base, 4.)
+        t = 2. * np.pi * i / max(nb, 1)
+        center = (int(width * (0.5 + 0.3 * np.cos(t))), int(height * (0.5 + 0.3 * np.sin(t))))
+        cv2.circle(img, center, radius, (255, 255, 255), -1)
+        frames.append(cv2.GaussianBlur(img, (3, 3), 0))
+    return frames
+
+MAILBOX_HSV = [(170, 220, 200), (120, 200, 200), (30, 230, 220), (150, 70, 200)]
+
+def mailbox_scene(width, height, nb, seed=0):
+    '''
+    grass-like background with one square of each mailbox color
+    '''
+    rng = np.random.RandomState(seed)
+    base = np.full((height, width, 3), (60, 110, 70), np.uint8)
+    side = max(12, width // 12)
+    colors = [cv2.cvtColor(np.uint8([[hsv]]), cv2.COLOR_HSV2BGR)[0, 0].tolist() for hsv in MAILBOX_HSV]
+    frames = []
+    for i in range(nb):
+        img = noise(rng, base, 8.)
+        for c in colors:
+            x, y = rng.randint(0, width - side), rng.randint(0, height - side)
+            cv2.rectangle(img, (x, y), (x + side - 1, y + side - 1), c, -1)
+        frames.append(cv2.GaussianBlur(img, (5, 5), 0))
+    return frames
+
+def synthetic_face(size, rng):
+    '''
+    simple drawn face crop (used when no face crops are provided)
+    '''
+    face = np.full((size, size, 3), 90, np.uint8)
+    c = size // 2
+    skin = tuple(int(v) for v in rng.randint(120, 220, 3))
+    cv2.ellipse(face, (c, c), (int(size * 0.38), int(size * 0.47)), 0, 0, 360, skin, -1)
+    for dx in [-1, 1]:
+        cv2.ellipse(face, (c + dx * size // 6, int(size * 0.4)), (size // 12, size // 20), 0, 0, 360, (40, 40, 40), -1)
+        cv2.line(face, (c + dx * size // 10, int(size * 0.3)), (c + dx * size // 4, int(size * 0.3)), (50, 50, 50), max(1, size // 40))
+    cv2.line(face, (c, int(size * 0.45)), (c, int(size * 0.6)), (100, 100, 100), max(1, size // 40))
+    cv2.ellipse(face, (c, int(size * 0.72)), (size // 7, size // 20), 0, 0, 360, (60, 60, 140), -1)
+    return face
+
+def face_scene(width, height, nb, seed=0, crops=None):
+    '''
+    textured backgrounds with one or two face crops
+    '''
+    rng = np.random.RandomState(seed)
+    frames = []
+    for i in range(nb):
+        img = cv2.resize(rng.randint(0, 256, (height // 16, width // 16, 3)).astype(np.uint8), (width, height))
+        for _ in range(1 + i % 2):
+            size = rng.randint(height // 6, height // 3)
+            if crops:
+                face = cv2.resize(crops[rng.randint(len(crops))], (size, size))
+            else:
+                face = synthetic_face(size, rng)
+            x, y = rng.randint(0, width - size), rng.randint(0, height - size)
+            img[y:y+size, x:x+size] = face
+        frames.append(noise(rng, img, 3.))
+    return frames
+
+def load_crops(path):
+    if path is None:
+        return None
+    names = sorted(os.listdir(path))
+    crops = [cv2.imread(os.path.join(path, n)) for n in names]
+    return [c for c in crops if c is not None]
+
+# pipeline name -> (module directory, scene generator, module commands)
+PIPELINES = {
+        'led': ('UavLedDetector', led_scene, []),
+        'led_s2': ('UavLedDetector', led_scene, ['set_scale 2']),
+        'led_s4': ('UavLedDetector', led_scene, ['set_scale 4']),
+        'mailbox': ('ImavMailbox', mailbox_scene, []),
+        'face': ('FaceDetect', face_scene, []),
+        }
+
+def bench_pipeline(name, width, height, nb, warmup=3, seed=0, crops=None):
+    '''
+    run a pipeline (headless) on generated frames
+    return latency statistics in ms
+    '''
+    module_dir, scene, commands = PIPELINES[name]
+    module = replay.load_module(os.path.join(ROOT_DIR, module_dir))
+    for cmd in commands:
+        module.parseSerial(cmd)
+    if name == 'face':
+        frames = scene(width, height, nb + warmup, seed, crops)
+    else:
+        frames = scene(width, height, nb + warmup, seed)
+    inframes = [jevois.InputFrame(jevois.bgr_to_yuyv(img)) for img in frames]
+    latencies = []
+    for i, inframe in enumerate(inframes):
+        start = time.time()
+        module.processNoUSB(inframe)
+        if i >= warmup:
+            latencies.append(time.time() - start)
+    return replay.latency_stats(latencies)
+
+def run(pipelines, resolutions, nb, crops=None):
+    results = {}
+    for name in pipelines:
+        for (w, h) in resolutions:
+            key = "{}_{}x{}".format(name, w, h)
+            stats = bench_pipeline(name, w, h, nb, crops=crops)
+            results[key] = stats
+            print("{:22s} mean {mean:8.2f} p50 {p50:8.2f} p95 {p95:8.2f} p99 {p99:8.2f} max {max:8.2f} ms | {fps:8.1f} fps".format(key, **stats))
+    return results
+
+def compare(results, baseline, threshold):
+    '''
+    return the list of regressions (key, metric, baseline, current)
+    where the latency increased more than threshold (relative)
+    '''
+    regressions = []
+    for key, stats in sorted(results.items()):
+        if key not in baseline:
+            continue
+        for metric in ['mean', 'p50', 'p95']:
+            ref = baseline[key][metric]
+            if ref > 0. and (stats[metric] - ref) / ref > threshold:
+                regressions.append((key, metric, ref, stats[metric]))
+    return regressions
+
+if __name__ == '__main__':
+    '''
+    When used as a standalone script
+    '''
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark detection pipelines on synthetic scenes")
+    parser.add_argument("-p", "--pipeline", help="pipeline to run (can be repeated, led, mailbox and face by default)", action='append', choices=sorted(PIPELINES.keys()))
+    parser.add_argument("-r", "--resolution", help="resolution WxH (can be repeated, 320x240 640x480 1280x1024 by default)", action='append')
+    parser.add_argument("-n", "--frames", help="number of measured frames per run", type=int, default=50)
+    parser.add_argument("--faces", help="directory of face crops (drawn faces by default)", default=None)
+    parser.add_argument("--save", help="save results as JSON baseline", default=None)
+    parser.add_argument("--compare", help="JSON baseline to compare with", default=None)
+    parser.add_argument("-t", "--threshold", help="relative latency increase flagged as regression", type=float, default=0.1)
+    args = parser.parse_args()
+
+    jevois.log_level = jevois.LOG_ERR
+    pipelines = args.pipeline or ['led', 'mailbox', 'face']
+    resolutions = RESOLUTIONS
+    if args.resolution:
+        resolutions = [tuple(int(v) for v in r.split('x')) for r in args.resolution]
+
+    results = run(pipelines, resolutions, args.frames, load_crops(args.faces))
+
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump({'version': 1, 'cv2': cv2.__version__, 'results': results}, f, indent=2, sort_keys=True)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for (key, metric, ref, cur) in regressions:
+            print("REGRESSION {} {}: {:.2f} ms -> {:.2f} ms (+{:.0f}%)".format(key, metric, ref, cur, 100. * (cur - ref) / ref))
+        if len(regressions) > 0:
+            sys.exit(1)
+        print("no regression above {:.0f}%".format(100. * args.threshold))
+
@@ -0,0 +1,202 @@
+#!/usr/bin/python3
+'''
+Flight dataset stored as a memory-mapped frame array
+
+A dataset is a directory with:
+- frames.raw: all frames (uint8, same shape, BGR or gray) back to back
+- index.json: {"shape": [N, H, W(, 3)], "frames": [entry, ...]} with one
+  entry per frame: "timestamp" (ms), "alt" (mm) and "boxes", the ground truth
+  as a list of [label, x, y, w, h] (top left corner and size in pixels)
+
+Frames are read with numpy.memmap, so any frame can be accessed without
+decoding a video and several processes can share the same file (see
+eval_dataset.py).
+
+A dataset is built from a video file or an image directory with an optional
+labels file holding lines 'frame label x y w h' (frame index from 0) and
+'frame alt A' (altitude in mm from this frame), or imported from a
+FrameRecorder session of a module ('record start raw|jpg'), in which case
+the recorded detections are used as boxes (to be checked before using them
+as ground truth).
+
+Example:
+    dataset.py build flight_ds flight.avi --labels flight_labels.txt --fps 30
+    dataset.py import flight_ds /jevois/data/images/rec_20180605_101010.jsonl --kind mailbox
+    dataset.py info flight_ds
+'''
+
+import os
+import sys
+import json
+import cv2
+import numpy as np
+import replay
+
+FRAMES_FILE = "frames.raw"
+INDEX_FILE = "index.json"
+
+class Dataset:
+    '''
+    read access to a dataset directory
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE)) as f:
+            index = json.load(f)
+        self.shape = tuple(index['shape'])
+        self.entries = index['frames']
+        self.frames = np.memmap(os.path.join(path, FRAMES_FILE), np.uint8, 'r', shape=self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, i):
+        '''
+        return (frame, entry) of frame i
+        '''
+        return self.frames[i], self.entries[i]
+
+    def labels(self):
+        return sorted(set(str(b[0]) for e in self.entries for b in e['boxes']))
+
+class DatasetWriter:
+    '''
+    create a dataset by appending frames
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.frames = open(os.path.join(path, FRAMES_FILE), 'wb')
+        self.shape = None
+        self.entries = []
+
+    def add(self, img, timestamp=0., alt=0, boxes=()):
+        if self.shape is None:
+            self.shape = img.shape
+        elif img.shape != self.shape:
+            raise ValueError("frame shape {} differs from dataset shape {}".format(img.shape, self.shape))
+        self.frames.write(np.ascontiguousarray(img, dtype=np.uint8).data)
+        self.entries.append({ 'timestamp': timestamp, 'alt': alt,
+            'boxes': [[str(b[0])] + [round(float(v), 2) for v in b[1:5]] for b in boxes] })
+
+    def close(self):
+        self.frames.close()
+        if self.shape is None:
+            raise ValueError("empty dataset")
+        with open(os.path.join(self.path, INDEX_FILE), 'w') as f:
+            json.dump({ 'shape': [len(self.entries)] + list(self.shape), 'frames': self.entries }, f)
+
+def read_labels(filename):
+    '''
+    return ({frame: [(label, x, y, w, h)]}, {frame: alt}) from a labels file
+    '''
+    boxes, alts = {}, {}
+    with open(filename) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 0 or fields[0].startswith('#'):
+                continue
+            frame = int(fields[0])
+            if len(fields) == 3 and fields[1] == "alt":
+                alts[frame] = int(float(fields[2]))
+            elif len(fields) == 6:
+                boxes.setdefault(frame, []).append((fields[1],) + tuple(float(v) for v in fields[2:6]))
+    return boxes, alts
+
+def build(path, source, labels=None, fps=30., alt=0, gray=False, width=None, height=None):
+    '''
+    create a dataset from a video file or an image directory
+    return the number of frames
+    '''
+    boxes, alts = read_labels(labels) if labels is not None else ({}, {})
+    writer = DatasetWriter(path)
+    for i, img in enumerate(replay.read_frames(source, width, height)):
+        alt = alts.get(i, alt)
+        if gray:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        writer.add(img, round(1000. * i / fps, 1), alt, boxes.get(i, []))
+    writer.close()
+    return len(writer.entries)
+
+def rect_box(rect):
+    '''
+    return the bounding box (x, y, w, h) of a rotated rect ((u, v), (w, h), angle)
+    '''
+    pts = cv2.boxPoints(rect)
+    x0, y0 = pts.min(axis=0)
+    x1, y1 = pts.max(axis=0)
+    return (float(x0), float(y0), float(x1 - x0), float(y1 - y0))
+
+# module recording results to (label, x, y, w, h)
+RECORD_BOXES = {
+        'mailbox': lambda r: (str(int(r[0])),) + rect_box(((r[2], r[3]), (r[4], r[5]), r[6])), # mark, index, u, v, w, h, angle
+        'led': lambda r: ('led', r[0] - r[2] / 2., r[1] - r[3] / 2., r[2], r[3]), # center x, y, w, h
+        'face': lambda r: ('face', r[0], r[1], r[2], r[3]), # x, y, w, h, tracked
+        }
+
+def import_recording(path, index_file, kind):
+    '''
+    create a dataset from a FrameRecorder session (raw or jpg)
+    return the number of frames
+    '''
+    base = os.path.dirname(os.path.realpath(index_file))
+    raw = os.path.splitext(index_file)[0] + ".raw"
+    data = np.memmap(raw, np.uint8, 'r') if os.path.exists(raw) else None
+    writer = DatasetWriter(path)
+    with open(index_file) as f:
+        for line in f:
+            entry = json.loads(line)
+            shape = tuple(entry['shape'])
+            if 'offset' in entry:
+                offset = entry['offset']
+                img = data[offset:offset + int(np.prod(shape))].reshape(shape)
+            else:
+                img = cv2.imread(os.path.join(base, entry['file']), cv2.IMREAD_COLOR if len(shape) == 3 else cv2.IMREAD_GRAYSCALE)
+            boxes = [RECORD_BOXES[kind](r) for r in entry['results']]
+            writer.add(img, entry['timestamp'], entry.get('alt', 0), boxes)
+    writer.close()
+    return len(writer.entries)
+
+if __name__ == '__main__':
+    '''
+    When used as a standalone script
+    '''
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build or inspect a memory-mapped flight dataset")
+    sub = parser.add_subparsers(dest='command')
+    p = sub.add_parser('build', help="create a dataset from a video file or an image directory")
+    p.add_argument('dataset', help="dataset directory")
+    p.add_argument('source', help="video file or image directory")
+    p.add_argument("-l", "--labels", help="labels file with lines 'frame label x y w h' and 'frame alt A'", default=None)
+    p.add_argument("-f", "--fps", help="frame rate for timestamps", type=float, default=30.)
+    p.add_argument("-a", "--alt", help="altitude in mm when not in labels", type=int, default=0)
+    p.add_argument("-g", "--gray", help="store gray frames", action='store_true')
+    p.add_argument("-W", "--width", help="resize frames to this width", type=int, default=None)
+    p.add_argument("-H", "--height", help="resize frames to this height", type=int, default=None)
+    p = sub.add_parser('import', help="create a dataset from a module recording (record start raw|jpg)")
+    p.add_argument('dataset', help="dataset directory")
+    p.add_argument('index', help="recording index file (.jsonl)")
+    p.add_argument("-k", "--kind", help="module of the recording", choices=sorted(RECORD_BOXES.keys()), required=True)
+    p = sub.add_parser('info', help="print the content of a dataset")
+    p.add_argument('dataset', help="dataset directory")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        nb = build(args.dataset, args.source, args.labels, args.fps, args.alt, args.gray, args.width, args.height)
+        print("{} frames".format(nb))
+    elif args.command == 'import':
+        nb = import_recording(args.dataset, args.index, args.kind)
+        print("{} frames".format(nb))
+    elif args.command == 'info':
+        ds = Dataset(args.dataset)
+        nb_boxes = sum(len(e['boxes']) for e in ds.entries)
+        alts = [e['alt'] for e in ds.entries]
+        print("{} frames {} | {} boxes, labels {} | alt {}-{} mm".format(len(ds), "x".join(str(v) for v in ds.shape[1:]),
+            nb_boxes, " ".join(ds.labels()), min(alts), max(alts)))
+    else:
+        parser.print_help()
+        sys.exit(1)
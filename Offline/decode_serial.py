@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+'''
+Host side decoder of the binary detection frames (see Common/BinaryProtocol.py)
+
+Decode frames from a serial port or a recorded file and print one line per
+frame: frame counter, timestamp, kind and targets [id x y w h].
+
+With --loopback, a module is replayed on a workstation with its output sent
+through a pseudo-terminal, in text then in binary mode, to compare the
+number of bytes per frame and measure the decoding latency (from capture
+timestamp to reception of the full frame).
+
+Example:
+    decode_serial.py /dev/ttyUSB0 -b 115200
+    decode_serial.py --loopback ../ImavMailbox flight.avi --script ../ImavMailbox/script.cfg.std
+'''
+
+import os
+import sys
+import time
+import threading
+import tty
+import termios
+import numpy as np
+import replay
+import libjevois as jevois
+
+sys.path.insert(1, os.path.join(replay.OFFLINE_DIR, '..', 'Common'))
+from BinaryProtocol import Decoder, format_frame
+
+BAUDRATES = { 9600: termios.B9600, 57600: termios.B57600, 115200: termios.B115200, 230400: termios.B230400, 921600: termios.B921600 }
+
+def open_port(device, baud=None):
+    '''
+    open a serial port (or file) for reading in raw mode
+    '''
+    fd = os.open(device, os.O_RDONLY | os.O_NOCTTY)
+    if os.isatty(fd):
+        tty.setraw(fd)
+        if baud is not None:
+            attr = termios.tcgetattr(fd)
+            attr[4] = attr[5] = BAUDRATES[baud]
+            termios.tcsetattr(fd, termios.TCSANOW, attr)
+    return fd
+
+def decode(fd, out=sys.stdout):
+    decoder = Decoder()
+    while True:
+        data = os.read(fd, 4096)
+        if len(data) == 0:
+            break
+        for frame in decoder.feed(data):
+            out.write(format_frame(frame) + "\n")
+    return decoder
+
+class LoopbackReader(threading.Thread):
+    '''
+    read the master side of a pseudo-terminal, count bytes and decode binary frames
+    '''
+
+    def __init__(self, fd, binary):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.fd = fd
+        self.binary = binary
+        self.decoder = Decoder()
+        self.nb_bytes = 0
+        self.latencies = [] # ms from capture timestamp to reception
+        self.running = True
+
+    def run(self):
+        while self.running:
+            try:
+                data = os.read(self.fd, 4096)
+            except OSError:
+                break
+            now = int(time.time() * 1000.) & 0xffffffff
+            self.nb_bytes += len(data)
+            if self.binary:
+                for (_, _, timestamp, _) in self.decoder.feed(data):
+                    self.latencies.append((now - timestamp) & 0xffffffff)
+
+def loopback(module_path, source, commands, max_frames=None, binary=True):
+    '''
+    replay a module with its serial output through a pseudo-terminal
+    return (number of frames, reader)
+    '''
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    reader = LoopbackReader(master, binary)
+    reader.start()
+    module = replay.load_module(module_path)
+    if binary:
+        commands = commands + ["serial proto bin " + os.ttyname(slave)]
+    else:
+        jevois.serial_callback = lambda msg: os.write(slave, (msg + "\r\n").encode())
+    try:
+        latencies = replay.replay(module, replay.read_frames(source), max_frames=max_frames, commands=commands)
+    finally:
+        jevois.serial_callback = None
+        module.parseSerial("serial proto text")
+    time.sleep(0.2) # let the reader get the last bytes
+    reader.running = False
+    os.close(slave)
+    os.close(master)
+    return len(latencies), reader
+
+if __name__ == '__main__':
+    '''
+    When used as a standalone script
+    '''
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Decode binary detection frames")
+    parser.add_argument('input', help="serial device or recorded file (module directory with --loopback)")
+    parser.add_argument('source', nargs='?', help="video file or image directory (with --loopback)", default=None)
+    parser.add_argument("-b", "--baud", help="serial port baudrate", type=int, choices=sorted(BAUDRATES.keys()), default=None)
+    parser.add_argument("--loopback", help="replay a module through a pseudo-terminal and compare text and binary output", action='store_true')
+    parser.add_argument("-n", "--max_frames", help="max number of frames (with --loopback)", type=int, default=None)
+    parser.add_argument("-c", "--cmd", help="module command sent before replay (can be repeated)", action='append', default=[])
+    parser.add_argument("--script", help="JeVois script file with module commands", default=None)
+    args = parser.parse_args()
+
+    if not args.loopback:
+        fd = open_port(args.input, args.baud)
+        try:
+            decoder = decode(fd)
+        except KeyboardInterrupt:
+            sys.exit(0)
+        sys.stderr.write("{} frames, {} crc errors, {} bytes skipped\n".format(decoder.frames, decoder.crc_errors, decoder.skipped))
+        sys.exit(0)
+
+    if args.source is None:
+        sys.exit("a video file or image directory is required with --loopback")
+    jevois.log_level = jevois.LOG_ERR
+    commands = []
+    if args.script is not None:
+        commands += replay.read_script(args.script)
+    commands += args.cmd
+    for binary in [False, True]:
+        nb, reader = loopback(args.input, args.source, commands, args.max_frames, binary)
+        bytes_per_frame = float(reader.nb_bytes) / max(nb, 1)
+        line = "{:6s} {} frames {} bytes | {:.1f} bytes/frame | {:.1f} ms/frame at 115200 baud".format(
+                "binary" if binary else "text", nb, reader.nb_bytes, bytes_per_frame, bytes_per_frame * 10000. / 115200.)
+        if binary:
+            lat = np.asarray(reader.latencies, dtype=np.float64)
+            line += " | {} decoded, {} crc errors".format(reader.decoder.frames, reader.decoder.crc_errors)
+            if len(lat) > 0:
+                line += " | latency ms: mean {:.2f} p95 {:.2f} max {:.2f}".format(np.mean(lat), np.percentile(lat, 95), np.max(lat))
+        print(line)
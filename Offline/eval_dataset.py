@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+'''
+Evaluate a detection pipeline over a whole flight dataset (see dataset.py)
+
+The dataset is split into contiguous shards processed in parallel by
+worker processes, each one opening the memory-mapped frames and running
+its own instance of the pipeline:
+- mailbox: ImavMailbox color detection (processImage, with the altitude
+  of each frame and the module commands of --script/--cmd)
+- led: UavLedDetector detection (detect on the gray image)
+- face: FaceDetect Detector with the backend selected by --backend
+Each shard starts with a fresh pipeline, like a module started at the
+beginning of the shard (tracking state, LED mask learned on first frame).
+
+Detections are matched to the ground truth boxes of the same label with an
+intersection over union threshold, and precision and recall per label are
+reported with the per-frame latency percentiles. Latencies are measured
+in the workers, so they include the contention between jobs.
+
+Example:
+    eval_dataset.py flight_ds -k mailbox --script ../ImavMailbox/script.cfg.std -c "scale auto" -j 4
+    eval_dataset.py faces_ds -k face -b lbp/2
+'''
+
+import os
+import sys
+import json
+import time
+import multiprocessing
+import cv2
+import numpy as np
+import replay
+import libjevois as jevois
+from dataset import Dataset, rect_box
+
+sys.path.insert(1, os.path.join(replay.OFFLINE_DIR, '..', 'FaceDetect'))
+from eval_faces import match, parse_backend
+from detector import Detector, make_backend
+
+ROOT_DIR = os.path.dirname(replay.OFFLINE_DIR)
+
+class MailboxPipeline:
+    '''
+    ImavMailbox module, labels are the mark numbers
+    '''
+
+    def __init__(self, options):
+        self.module = replay.load_module(os.path.join(ROOT_DIR, 'ImavMailbox'))
+        for cmd in options['commands']:
+            self.module.parseSerial(cmd)
+
+    def prepare(self, entry):
+        self.module.parseSerial("alt {}".format(int(entry.get('alt', 0))))
+
+    def detect(self, img):
+        detect = self.module.processImage(img)
+        return [(str(mark),) + rect_box(r) for mark, rects in detect.items() for r in rects]
+
+class LedPipeline:
+    '''
+    UavLedDetector module detection, label 'led'
+    '''
+
+    def __init__(self, options):
+        self.module = replay.load_module(os.path.join(ROOT_DIR, 'UavLedDetector'))
+        for cmd in options['commands']:
+            self.module.parseSerial(cmd)
+
+    def prepare(self, entry):
+        pass
+
+    def detect(self, img):
+        gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        return [('led', x - w / 2., y - h / 2., w, h) for ((x, y), (w, h), _) in self.module.detect(gray)]
+
+class FacePipeline:
+    '''
+    FaceDetect Detector, label 'face'
+    '''
+
+    def __init__(self, options):
+        name, factor = parse_backend(options['backend'])
+        self.detector = Detector(backend=make_backend(name, factor))
+
+    def prepare(self, entry):
+        pass
+
+    def detect(self, img):
+        gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        return [('face',) + tuple(float(v) for v in f) for f in self.detector.detect(gray, equalize=True)]
+
+PIPELINES = { 'mailbox': MailboxPipeline, 'led': LedPipeline, 'face': FacePipeline }
+
+def shards(nb, jobs):
+    '''
+    return the list of (start, stop) of jobs contiguous shards
+    '''
+    bounds = np.linspace(0, nb, jobs + 1).astype(int)
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+def evaluate_shard(args):
+    '''
+    run a pipeline on frames [start, stop) of a dataset
+    return ({label: [true positives, detections, truth]}, latencies in s)
+    '''
+    (path, kind, options, start, stop) = args
+    jevois.log_level = jevois.LOG_ERR
+    dataset = Dataset(path)
+    pipeline = PIPELINES[kind](options)
+    counts = {}
+    latencies = []
+    for i in range(start, stop):
+        img, entry = dataset[i]
+        img = np.array(img) # read from the file outside of the timing
+        pipeline.prepare(entry)
+        t = time.time()
+        dets = pipeline.detect(img)
+        latencies.append(time.time() - t)
+        del jevois.serial_out[:]
+        truth = entry['boxes']
+        for label in set([d[0] for d in dets] + [str(b[0]) for b in truth]):
+            d = [b[1:5] for b in dets if b[0] == label]
+            g = [b[1:5] for b in truth if str(b[0]) == label]
+            c = counts.setdefault(label, [0, 0, 0])
+            c[0] += match(d, g, options['iou'])
+            c[1] += len(d)
+            c[2] += len(g)
+    return counts, latencies
+
+def evaluate(path, kind, options, jobs=1):
+    '''
+    evaluate a pipeline on a dataset with jobs worker processes
+    return (per label statistics, latency statistics)
+    '''
+    work = [(path, kind, options, a, b) for (a, b) in shards(len(Dataset(path)), jobs)]
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.map(evaluate_shard, work)
+        pool.close()
+        pool.join()
+    else:
+        results = [evaluate_shard(w) for w in work]
+    counts = {}
+    latencies = []
+    for (c, lat) in results:
+        for label, (tp, det, truth) in c.items():
+            total = counts.setdefault(label, [0, 0, 0])
+            total[0] += tp
+            total[1] += det
+            total[2] += truth
+        latencies += lat
+    labels = {}
+    for label, (tp, det, truth) in sorted(counts.items()):
+        labels[label] = {
+                'recall': float(tp) / truth if truth > 0 else 0.,
+                'precision': float(tp) / det if det > 0 else 1.,
+                'true_positives': tp, 'detections': det, 'truth': truth }
+    return labels, replay.latency_stats(latencies)
+
+if __name__ == '__main__':
+    '''
+    When used as a standalone script
+    '''
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Evaluate a detection pipeline on a flight dataset")
+    parser.add_argument('dataset', help="dataset directory (see dataset.py)")
+    parser.add_argument("-k", "--kind", help="detection pipeline", choices=sorted(PIPELINES.keys()), required=True)
+    parser.add_argument("-j", "--jobs", help="number of worker processes", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("-c", "--cmd", help="module command sent before evaluation (can be repeated)", action='append', default=[])
+    parser.add_argument("--script", help="JeVois script file with module commands", default=None)
+    parser.add_argument("-b", "--backend", help="face backend name[/factor]", default='haar')
+    parser.add_argument("--iou", help="min intersection over union to match a box", type=float, default=0.5)
+    parser.add_argument("--json", help="save results as JSON", default=None)
+    args = parser.parse_args()
+
+    commands = []
+    if args.script is not None:
+        commands += replay.read_script(args.script)
+    commands += args.cmd
+    options = { 'commands': commands, 'backend': args.backend, 'iou': args.iou }
+
+    start = time.time()
+    labels, latency = evaluate(args.dataset, args.kind, options, max(1, args.jobs))
+    duration = time.time() - start
+    for label, s in labels.items():
+        print("{:6s} recall {recall:.3f} precision {precision:.3f} | truth {truth} detections {detections} matched {true_positives}".format(label, **s))
+    if len(latency) > 0:
+        print("latency ms: mean {mean:.2f} p50 {p50:.2f} p95 {p95:.2f} p99 {p99:.2f} max {max:.2f}".format(**latency))
+        print("{} frames in {:.2f} s with {} jobs ({:.1f} frames/s)".format(latency['frames'], duration, args.jobs, latency['frames'] / duration))
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({ 'kind': args.kind, 'options': options, 'labels': labels, 'latency': latency, 'duration': duration },
+                    f, indent=2, sort_keys=True)
@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+'''
+Evaluate the face detection backends of FaceDetect on a labeled image set
+
+The labels file holds one line per face 'image x y w h' (image path relative
+to the labels file), and images without faces are listed with their name
+only. Each backend is run on every image like in the module (histogram
+equalization then detection), detections are matched to the labels with an
+intersection over union threshold, and recall, precision and per-frame
+latency are reported to choose the backend for a given compute budget.
+
+Example:
+    eval_faces.py faces/labels.txt -b haar -b lbp -b haar/2 -b lbp/2
+'''
+
+import os
+import sys
+import json
+import time
+import cv2
+import replay
+
+sys.path.insert(1, os.path.join(replay.OFFLINE_DIR, '..', 'FaceDetect'))
+from detector import Detector, CASCADES, make_backend
+
+def read_labels(filename):
+    '''
+    return the list of (image path, list of (x, y, w, h)) in order of appearance
+    '''
+    base = os.path.dirname(os.path.realpath(filename))
+    labels = {}
+    order = []
+    with open(filename) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 0 or fields[0].startswith('#'):
+                continue
+            path = os.path.join(base, fields[0])
+            if path not in labels:
+                labels[path] = []
+                order.append(path)
+            if len(fields) >= 5:
+                labels[path].append(tuple(int(float(v)) for v in fields[1:5]))
+    return [(path, labels[path]) for path in order]
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    ih = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = iw * ih
+    union = aw * ah + bw * bh - inter
+    return float(inter) / union if union > 0 else 0.
+
+def match(detections, truth, iou_th=0.5):
+    '''
+    greedy matching by decreasing IoU
+    return the number of true positives
+    '''
+    pairs = sorted([(iou(d, t), i, j) for i, d in enumerate(detections) for j, t in enumerate(truth)], reverse=True)
+    used_d, used_t = set(), set()
+    for (v, i, j) in pairs:
+        if v < iou_th:
+            break
+        if i in used_d or j in used_t:
+            continue
+        used_d.add(i)
+        used_t.add(j)
+    return len(used_d)
+
+def parse_backend(spec):
+    '''
+    return (name, factor) from 'name' or 'name/factor'
+    '''
+    fields = spec.split('/')
+    name = fields[0]
+    factor = int(fields[1]) if len(fields) > 1 else 1
+    if name not in CASCADES or factor < 1:
+        raise ValueError("invalid backend " + spec)
+    return name, factor
+
+def evaluate(detector, dataset, iou_th=0.5, warmup=1):
+    '''
+    run a detector on the dataset [(gray image, labels)]
+    return a dict of statistics
+    '''
+    for (gray, _) in dataset[:warmup]:
+        detector.detect(gray, equalize=True)
+    tp, nb_det, nb_truth = 0, 0, 0
+    latencies = []
+    for (gray, truth) in dataset:
+        start = time.time()
+        faces = detector.detect(gray, equalize=True)
+        latencies.append(time.time() - start)
+        faces = [tuple(int(v) for v in f) for f in faces]
+        tp += match(faces, truth, iou_th)
+        nb_det += len(faces)
+        nb_truth += len(truth)
+    stats = replay.latency_stats(latencies)
+    stats['recall'] = float(tp) / nb_truth if nb_truth > 0 else 0.
+    stats['precision'] = float(tp) / nb_det if nb_det > 0 else 1.
+    stats['detections'] = nb_det
+    stats['faces'] = nb_truth
+    return stats
+
+if __name__ == '__main__':
+    '''
+    When used as a standalone script
+    '''
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Evaluate face detection backends on a labeled image set")
+    parser.add_argument('labels', help="labels file with lines 'image x y w h' (or 'image' for images without faces)")
+    parser.add_argument("-b", "--backend", help="backend name[/factor] (can be repeated, haar lbp haar/2 lbp/2 by default)", action='append')
+    parser.add_argument("-W", "--width", help="resize images to this width (keeping labels consistent)", type=int, default=None)
+    parser.add_argument("--iou", help="min intersection over union to match a label", type=float, default=0.5)
+    parser.add_argument("--json", help="save results as JSON", default=None)
+    args = parser.parse_args()
+
+    dataset = []
+    for (path, truth) in read_labels(args.labels):
+        img = cv2.imread(path)
+        if img is None:
+            print("can't read {}".format(path))
+            continue
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        if args.width is not None and gray.shape[1] != args.width:
+            r = float(args.width) / gray.shape[1]
+            gray = cv2.resize(gray, (args.width, int(round(gray.shape[0] * r))), interpolation=cv2.INTER_AREA)
+            truth = [tuple(int(round(v * r)) for v in t) for t in truth]
+        dataset.append((gray, truth))
+    if len(dataset) == 0:
+        sys.exit("no image")
+
+    results = {}
+    for spec in args.backend or ['haar', 'lbp', 'haar/2', 'lbp/2']:
+        name, factor = parse_backend(spec)
+        stats = evaluate(Detector(backend=make_backend(name, factor)), dataset, args.iou)
+        results[spec] = stats
+        print("{:8s} recall {recall:.3f} precision {precision:.3f} | latency ms: mean {mean:.2f} p50 {p50:.2f} p95 {p95:.2f} max {max:.2f} | {fps:.1f} fps".format(spec, **stats))
+
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({'images': len(dataset), 'iou': args.iou, 'results': results}, f, indent=2, sort_keys=True)
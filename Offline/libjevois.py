@@ -0,0 +1,162 @@
+'''
+Offline stand-in for the libjevois Python module
+
+Provides the subset of the JeVois API used by the modules of this repository
+(logging, serial output, timer, drawing helpers and input/output frames)
+so they can be run and profiled on a workstation.
+Frames are stored in YUYV like on the camera, so the cost of the
+conversions done by getCvBGR / getCvGRAY is accounted for.
+'''
+
+import sys
+import time
+import cv2
+import numpy as np
+
+LOG_EMERG = 0
+LOG_ALERT = 1
+LOG_CRIT = 2
+LOG_ERR = 3
+LOG_WARNING = 4
+LOG_NOTICE = 5
+LOG_INFO = 6
+LOG_DEBUG = 7
+
+log_level = LOG_INFO # messages above this level are discarded
+serial_out = [] # messages sent with sendSerial since last clear
+serial_callback = None # optional function called for each serial message
+
+def _log(level, name, msg):
+    if level <= log_level:
+        sys.stderr.write("{}: {}\n".format(name, msg))
+
+def LDEBUG(msg):
+    _log(LOG_DEBUG, "DBG", msg)
+
+def LINFO(msg):
+    _log(LOG_INFO, "INF", msg)
+
+def LERROR(msg):
+    _log(LOG_ERR, "ERR", msg)
+
+def LFATAL(msg):
+    _log(LOG_CRIT, "FTL", msg)
+    raise RuntimeError(msg)
+
+def sendSerial(msg):
+    serial_out.append(msg)
+    if serial_callback is not None:
+        serial_callback(msg)
+
+class Timer:
+    '''
+    Same behavior as jevois.Timer: stop() returns a string with the average
+    frame rate, which is also logged every 'interval' frames
+    '''
+
+    def __init__(self, name, interval, level=LOG_INFO):
+        self.name = name
+        self.interval = max(1, interval)
+        self.level = level
+        self.count = 0
+        self.elapsed = 0.
+        self.start_time = None
+        self.msg = "-- fps"
+
+    def start(self):
+        self.start_time = time.time()
+
+    def stop(self):
+        if self.start_time is not None:
+            self.elapsed += time.time() - self.start_time
+            self.count += 1
+        if self.count >= self.interval:
+            fps = self.count / max(self.elapsed, 1e-9)
+            self.msg = "{:.1f} fps".format(fps)
+            _log(self.level, "INF", "{}: {}".format(self.name, self.msg))
+            self.count = 0
+            self.elapsed = 0.
+        return self.msg
+
+def bgr_to_yuyv(img):
+    '''
+    convert a BGR image to a YUYV (H, W, 2) buffer, like camera frames
+    '''
+    yuv = cv2.cvtColor(img, cv2.COLOR_BGR2YUV)
+    yuyv = np.empty((img.shape[0], img.shape[1], 2), np.uint8)
+    yuyv[:, :, 0] = yuv[:, :, 0]
+    uv = yuv[:, :, 1:].reshape((img.shape[0], img.shape[1] // 2, 2, 2)).mean(axis=2)
+    yuyv[:, 0::2, 1] = uv[:, :, 0]
+    yuyv[:, 1::2, 1] = uv[:, :, 1]
+    return yuyv
+
+def yuyv_to_bgr(yuyv):
+    return cv2.cvtColor(yuyv, cv2.COLOR_YUV2BGR_YUYV)
+
+def drawRect(img, x, y, w, h, thick, color):
+    '''
+    draw a rectangle in a YUYV buffer, color is a YUYV value (0xUUYY)
+    '''
+    cv2.rectangle(img, (int(x), int(y)), (int(x + w - 1), int(y + h - 1)),
+            (int(color) & 0xff, (int(color) >> 8) & 0xff), max(1, int(thick)))
+
+def pasteGreyToYUYV(src, dst, x, y):
+    h, w = src.shape[:2]
+    dst[y:y+h, x:x+w, 0] = src
+    dst[y:y+h, x:x+w, 1] = 0x80
+
+class InputFrame:
+    '''
+    input frame from a YUYV buffer
+    '''
+
+    def __init__(self, yuyv):
+        self.yuyv = yuyv
+
+    def get(self):
+        return self.yuyv
+
+    def done(self):
+        pass
+
+    def getCvGRAY(self):
+        return cv2.cvtColor(self.yuyv, cv2.COLOR_YUV2GRAY_YUYV)
+
+    def getCvBGR(self):
+        return cv2.cvtColor(self.yuyv, cv2.COLOR_YUV2BGR_YUYV)
+
+    def getCvRGB(self):
+        return cv2.cvtColor(self.yuyv, cv2.COLOR_YUV2RGB_YUYV)
+
+    def getCvRGBA(self):
+        return cv2.cvtColor(self.yuyv, cv2.COLOR_YUV2RGBA_YUYV)
+
+class OutputFrame:
+    '''
+    output frame capturing the rendered image as BGR
+    '''
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.yuyv = None
+        self.image = None # last sent image (BGR)
+
+    def get(self):
+        if self.yuyv is None:
+            self.yuyv = np.zeros((self.height, self.width, 2), np.uint8)
+            self.yuyv[:, :, 1] = 0x80
+        return self.yuyv
+
+    def send(self):
+        self.image = yuyv_to_bgr(self.get())
+        self.yuyv = None
+
+    def sendCv(self, img):
+        if img.ndim == 2:
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        elif img.shape[2] == 4:
+            img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+        self.image = img
+        self.yuyv = None
+
@@ -0,0 +1,211 @@
+#!/usr/bin/python3
+'''
+Replay recorded frames through a JeVois Python module on a workstation
+
+The module is loaded with the offline libjevois stand-in, frames are read
+from a video file or an image directory, serial messages and rendered frames
+are captured and the per-frame latency is reported.
+
+Example:
+    replay.py ../ImavMailbox flight.avi --script ../ImavMailbox/script.cfg.std --usb -o out.avi
+'''
+
+import os
+import sys
+import time
+import importlib
+import cv2
+import numpy as np
+
+OFFLINE_DIR = os.path.dirname(os.path.realpath(__file__))
+if OFFLINE_DIR not in sys.path:
+    sys.path.insert(0, OFFLINE_DIR) # use the stand-in libjevois
+import libjevois as jevois
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.bmp', '.ppm', '.pgm', '.tif', '.tiff']
+VIDEO_EXTENSIONS = ['.avi', '.mp4', '.mkv', '.mov']
+
+def load_module(path):
+    '''
+    load a JeVois module class from its directory (class with the same name as the directory)
+    or from its python file (class with the same name as the file)
+    return an instance of the module
+    '''
+    path = os.path.realpath(path)
+    if os.path.isdir(path):
+        module_dir, name = path, os.path.basename(path)
+    else:
+        module_dir, name = os.path.dirname(path), os.path.splitext(os.path.basename(path))[0]
+    if module_dir not in sys.path:
+        sys.path.insert(1, module_dir)
+    module = importlib.import_module(name)
+    return getattr(module, name)()
+
+def read_frames(source, width=None, height=None):
+    '''
+    iterate over BGR frames of a video file, camera index or image directory
+    '''
+    if os.path.isdir(source):
+        names = sorted([f for f in os.listdir(source) if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS])
+        frames = (cv2.imread(os.path.join(source, f)) for f in names)
+    else:
+        video = cv2.VideoCapture(int(source) if source.isdigit() else source)
+        def read_video():
+            while True:
+                ret, img = video.read()
+                if not ret:
+                    break
+                yield img
+            video.release()
+        frames = read_video()
+    for img in frames:
+        if img is None:
+            continue
+        if width is not None and height is not None and (img.shape[1], img.shape[0]) != (width, height):
+            img = cv2.resize(img, (width, height))
+        yield img
+
+def read_script(filename):
+    '''
+    return the module commands of a JeVois script file (engine commands are skipped)
+    '''
+    cmds = []
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if len(line) == 0 or line.startswith('#'):
+                continue
+            if line.split(' ')[0] in ['setcam', 'setpar', 'info', 'setmapping', 'setmapping2', 'streamon', 'streamoff']:
+                continue
+            cmds.append(line)
+    return cmds
+
+class FrameWriter:
+    '''
+    write rendered frames to a video file or to an image directory
+    '''
+
+    def __init__(self, output, fps=20.):
+        self.output = output
+        self.fps = fps
+        self.video = None
+        self.count = 0
+        self.is_video = os.path.splitext(output)[1].lower() in VIDEO_EXTENSIONS
+        if not self.is_video and not os.path.isdir(output):
+            os.makedirs(output)
+
+    def write(self, img):
+        if self.is_video:
+            if self.video is None:
+                fourcc = cv2.VideoWriter_fourcc(*'MJPG')
+                self.video = cv2.VideoWriter(self.output, fourcc, self.fps, (img.shape[1], img.shape[0]))
+            self.video.write(img)
+        else:
+            cv2.imwrite(os.path.join(self.output, "{:06d}.png".format(self.count)), img)
+        self.count += 1
+
+    def close(self):
+        if self.video is not None:
+            self.video.release()
+
+def latency_stats(latencies):
+    '''
+    return a dict of latency statistics in ms
+    '''
+    lat = 1000. * np.asarray(latencies)
+    if len(lat) == 0:
+        return {}
+    return {
+            'frames': len(lat),
+            'mean': float(np.mean(lat)),
+            'p50': float(np.percentile(lat, 50)),
+            'p95': float(np.percentile(lat, 95)),
+            'p99': float(np.percentile(lat, 99)),
+            'max': float(np.max(lat)),
+            'fps': float(1000. / max(np.mean(lat), 1e-9))
+            }
+
+def replay(module, frames, usb=False, fps=0., max_frames=None, writer=None, serial=None, commands=None):
+    '''
+    feed frames to a module instance
+    usb: call process with an output frame, processNoUSB otherwise
+    fps: replay rate (0 for as fast as possible)
+    serial: file object receiving captured serial messages
+    return the list of per-frame latencies in seconds
+    '''
+    for cmd in commands or []:
+        jevois.LINFO("{} -> {}".format(cmd, module.parseSerial(cmd)))
+    latencies = []
+    next_time = time.time()
+    for nb, img in enumerate(frames):
+        if max_frames is not None and nb >= max_frames:
+            break
+        inframe = jevois.InputFrame(jevois.bgr_to_yuyv(img))
+        outframe = jevois.OutputFrame(img.shape[1], img.shape[0])
+        if fps > 0.:
+            delay = next_time - time.time()
+            if delay > 0.:
+                time.sleep(delay)
+            next_time = max(next_time, time.time()) + 1. / fps
+        del jevois.serial_out[:]
+        start = time.time()
+        if usb:
+            module.process(inframe, outframe)
+        else:
+            module.processNoUSB(inframe)
+        latencies.append(time.time() - start)
+        if serial is not None:
+            for msg in jevois.serial_out:
+                serial.write("{} {}\n".format(nb, msg))
+        if writer is not None and outframe.image is not None:
+            writer.write(outframe.image)
+    return latencies
+
+if __name__ == '__main__':
+    '''
+    When used as a standalone script
+    '''
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay frames through a JeVois Python module")
+    parser.add_argument('module', help="module directory or python file")
+    parser.add_argument('source', help="video file, camera index or image directory")
+    parser.add_argument("-u", "--usb", help="call process with an output frame (processNoUSB otherwise)", action='store_true')
+    parser.add_argument("-f", "--fps", help="replay rate (0 for as fast as possible)", type=float, default=0.)
+    parser.add_argument("-n", "--max_frames", help="max number of frames", type=int, default=None)
+    parser.add_argument("-W", "--width", help="resize input frames to this width", type=int, default=None)
+    parser.add_argument("-H", "--height", help="resize input frames to this height", type=int, default=None)
+    parser.add_argument("-o", "--output", help="rendered frames output (video file or directory)", default=None)
+    parser.add_argument("-s", "--serial", help="serial messages output file ('-' for stdout)", default=None)
+    parser.add_argument("-c", "--cmd", help="module command sent before replay (can be repeated)", action='append', default=[])
+    parser.add_argument("--script", help="JeVois script file with module commands", default=None)
+    parser.add_argument("-q", "--quiet", help="only log errors", action='store_true')
+    args = parser.parse_args()
+
+    if args.quiet:
+        jevois.log_level = jevois.LOG_ERR
+    commands = []
+    if args.script is not None:
+        commands += read_script(args.script)
+    commands += args.cmd
+
+    module = load_module(args.module)
+    frames = read_frames(args.source, args.width, args.height)
+    writer = FrameWriter(args.output, args.fps if args.fps > 0. else 20.) if args.output is not None else None
+    serial = None
+    if args.serial == '-':
+        serial = sys.stdout
+    elif args.serial is not None:
+        serial = open(args.serial, 'w')
+    try:
+        latencies = replay(module, frames, args.usb, args.fps, args.max_frames, writer, serial, commands)
+    finally:
+        if writer is not None:
+            writer.close()
+        if serial is not None and serial is not sys.stdout:
+            serial.close()
+
+    stats = latency_stats(latencies)
+    if len(stats) > 0:
+        print("{frames} frames | latency ms: mean {mean:.2f} p50 {p50:.2f} p95 {p95:.2f} p99 {p99:.2f} max {max:.2f} | {fps:.1f} fps".format(**stats))
+
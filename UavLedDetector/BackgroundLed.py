@@ -0,0 +1,79 @@
+import cv2
+import numpy as np
+
+class BrightBackground:
+    '''
+    Running background model of bright pixels
+
+    The presence of pixels above the brightness threshold is computed on a
+    grid of cells (reduced resolution) and accumulated with an exponential
+    decay, every 'rate' frames, so that lights smaller than a cell are learned
+    as well as large ones. Cells that hold a bright pixel for a large part of
+    the time (model above 'level') are considered as background and masked, while
+    lights that disappear are forgotten after a while. The model is
+    initialized with the first frame, like the static mask.
+    Boxes around the current targets can be left out of an update, so that
+    a target holding still in the image is not learned as background.
+    '''
+
+    def __init__(self, cell=8, rate=5, alpha=0.05, level=0.5):
+        self.cell = cell # cell size in pixels (full resolution)
+        self.rate = rate # update every N frames
+        self.alpha = alpha # weight of a new update
+        self.level = level # min model value of background cells
+        self.frozen = False
+        self.reset()
+
+    def reset(self):
+        self.model = None
+        self.mask = None
+        self.count = 0
+        self.updates = 0
+
+    def update(self, gray, threshold, exclude=()):
+        '''
+        update the model with a full resolution gray image (every 'rate' calls)
+        exclude: list of boxes (x0, y0, x1, y1) in full resolution without bright pixels for this update
+        return True if the model was updated
+        '''
+        if self.frozen and self.model is not None:
+            return False
+        self.count += 1
+        size = (max(1, gray.shape[1] // self.cell), max(1, gray.shape[0] // self.cell))
+        if self.model is not None and self.count < self.rate and self.model.shape == (size[1], size[0]):
+            return False
+        self.count = 0
+        ret, th = cv2.threshold(gray, threshold, 255, cv2.THRESH_BINARY)
+        for (x0, y0, x1, y1) in exclude:
+            th[max(0, y0):max(0, y1), max(0, x0):max(0, x1)] = 0
+        # presence of bright pixels per cell: max over the cell stored at its top left corner
+        th = cv2.dilate(th, np.ones((self.cell, self.cell), np.uint8), anchor=(0, 0))
+        present = th[::self.cell, ::self.cell][:size[1], :size[0]].astype(np.float32) * (1. / 255.)
+        if self.model is None or self.model.shape != present.shape:
+            self.model = present
+        else:
+            cv2.accumulateWeighted(present, self.model, self.alpha)
+        self.mask = None
+        self.updates += 1
+        return True
+
+    def get_mask(self, shape):
+        '''
+        return the mask of the foreground (255) for an image of given shape
+        or None if the model is not initialized
+        '''
+        if self.model is None:
+            return None
+        if self.mask is None or self.mask.shape != shape:
+            fg = np.where(self.model < self.level, 255, 0).astype(np.uint8)
+            fg = cv2.erode(fg, np.ones((3, 3), np.uint8)) # one cell margin around background
+            self.mask = cv2.resize(fg, (shape[1], shape[0]), interpolation=cv2.INTER_NEAREST)
+        return self.mask
+
+    def status(self):
+        if self.model is None:
+            return "empty" + (" (frozen)" if self.frozen else "")
+        return "{} cells {}x{} background {} updates {}".format(
+                "frozen" if self.frozen else "running", self.model.shape[1], self.model.shape[0],
+                int(np.count_nonzero(self.model >= self.level)), self.updates)
+
@@ -0,0 +1,171 @@
+import numpy as np
+
+def merge_windows(wins):
+    '''
+    merge overlapping windows (x0, y0, x1, y1) so that no area is searched twice
+    '''
+    wins = list(wins)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(wins)):
+            for j in range(i + 1, len(wins)):
+                a, b = wins[i], wins[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    wins[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del wins[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return wins
+
+class LedTrack:
+    '''
+    State of a single tracked LED (image coordinates in full resolution pixels)
+    '''
+
+    def __init__(self, track_id, rect):
+        (x, y), (w, h), _ = rect
+        self.id = track_id
+        self.x = x
+        self.y = y
+        self.vx = 0.
+        self.vy = 0.
+        self.w = w
+        self.h = h
+        self.hits = 1 # number of associated detections
+        self.misses = 0 # number of consecutive frames without detection
+        self.confirmed = False
+
+    def predict(self):
+        return (self.x + self.vx, self.y + self.vy)
+
+    def size(self):
+        return max(self.w, self.h, 1.)
+
+class LedTracker:
+    '''
+    Multi-target tracker with stable IDs
+
+    Tracks follow a constant velocity model (alpha-beta filter). Detections
+    are associated to the nearest predicted position within a gate, greedily
+    by increasing distance. A track is confirmed after 'confirm' detections
+    and deleted after 'max_misses' frames without detection.
+    Between full frame scans (every 'refresh' frames), only the predicted
+    windows around the existing tracks need to be searched.
+    '''
+
+    def __init__(self, refresh=10, margin=3., gate=20., confirm=3, max_misses=5, max_tracks=8):
+        self.refresh = refresh # force full frame search every N frames
+        self.margin = margin # window size relative to the LED size
+        self.gate = gate # min association distance in pixels
+        self.confirm = confirm # nb of detections to confirm a track
+        self.max_misses = max_misses # nb of missed frames before deleting a track
+        self.max_tracks = max_tracks # max nb of tracks
+        self.alpha = 0.7 # position gain
+        self.beta = 0.3 # velocity gain
+        self.reset()
+
+    def reset(self):
+        self.tracks = []
+        self.next_id = 0
+        self.frames_since_full = 0
+        self.full = True # last search was on the full frame
+
+    def confirmed(self):
+        return [t for t in self.tracks if t.confirmed]
+
+    def gate_size(self, track):
+        return max(self.gate, 2. * track.size())
+
+    def windows(self, shape):
+        '''
+        return the list of predicted search windows (x0, y0, x1, y1) in image of given shape
+        or None if a full frame search is required
+        '''
+        if len(self.tracks) == 0 or self.frames_since_full >= self.refresh:
+            return None
+        wins = []
+        for t in self.tracks:
+            u, v = t.predict()
+            half = 0.5 * t.size() * self.margin + self.gate_size(t)
+            x0 = int(max(0, u - half - abs(t.vx)))
+            y0 = int(max(0, v - half - abs(t.vy)))
+            x1 = int(min(shape[1], u + half + abs(t.vx) + 1))
+            y1 = int(min(shape[0], v + half + abs(t.vy) + 1))
+            if x1 > x0 and y1 > y0:
+                wins.append((x0, y0, x1, y1))
+        if len(wins) == 0:
+            return None # all predictions out of image
+        return merge_windows(wins)
+
+    def associate(self, rects):
+        '''
+        return the list of (track index, rect index) pairs
+        greedy nearest neighbor association within the gates
+        '''
+        if len(self.tracks) == 0 or len(rects) == 0:
+            return []
+        pred = np.array([t.predict() for t in self.tracks])
+        det = np.array([r[0] for r in rects])
+        dist = np.hypot(pred[:, 0:1] - det[:, 0], pred[:, 1:2] - det[:, 1])
+        gates = np.array([self.gate_size(t) for t in self.tracks])
+        # gates differ per track: keep only the pairs inside their own track gate
+        ii, jj = np.nonzero(dist <= gates[:, np.newaxis])
+        pairs = []
+        used_t, used_r = set(), set()
+        for k in np.argsort(dist[ii, jj], kind='mergesort'):
+            i, j = ii[k], jj[k]
+            if i in used_t or j in used_r:
+                continue
+            pairs.append((int(i), int(j)))
+            used_t.add(i)
+            used_r.add(j)
+        return pairs
+
+    def update(self, rects, full=True):
+        '''
+        update tracks with the detections of a frame
+        full: True if the search was done on the full frame
+        '''
+        self.full = full
+        if full:
+            self.frames_since_full = 0
+        else:
+            self.frames_since_full += 1
+        pairs = self.associate(rects)
+        matched = set()
+        for (i, j) in pairs:
+            t = self.tracks[i]
+            (x, y), (w, h), _ = rects[j]
+            u, v = t.predict()
+            rx, ry = x - u, y - v
+            t.x = u + self.alpha * rx
+            t.y = v + self.alpha * ry
+            t.vx += self.beta * rx
+            t.vy += self.beta * ry
+            t.w, t.h = w, h
+            t.hits += 1
+            t.misses = 0
+            if t.hits >= self.confirm:
+                t.confirmed = True
+            matched.add(i)
+        for i, t in enumerate(self.tracks):
+            if i not in matched:
+                t.x, t.y = t.predict()
+                t.misses += 1
+        self.tracks = [t for t in self.tracks if t.misses <= self.max_misses and (t.confirmed or t.misses == 0)]
+        # new tentative tracks from unassociated detections, biggest first
+        assigned = set(j for (_, j) in pairs)
+        new = [r for j, r in enumerate(rects) if j not in assigned]
+        new.sort(key=lambda r: -r[1][0] * r[1][1])
+        for r in new:
+            if len(self.tracks) >= self.max_tracks:
+                break
+            self.tracks.append(LedTrack(self.next_id, r))
+            self.next_id += 1
+
+    def status(self):
+        return "tracks {} confirmed {} next_id {}".format(len(self.tracks), len(self.confirmed()), self.next_id)
+
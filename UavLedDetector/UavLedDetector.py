@@ -29,6 +29,16 @@ If their are bright static elements in the scene, they can be masked before the
 import libjevois as jevois
 import cv2
 import numpy as np
+import os
+import sys
+import time
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'Common')) # shared helpers
+from StageTimer import StageTimer
+from SerialQueue import SerialQueue
+from FrameRecorder import FrameRecorder
+from BinaryProtocol import encode_frame, KIND_POS, KIND_TRK
+from TrackLed import LedTracker
+from BackgroundLed import BrightBackground
 
 class UavLedDetector:
     # ###################################################################################################
@@ -41,6 +51,12 @@ class UavLedDetector:
         self.y = 0.
         self.area = 0.
         self.threshold = 200
+        self.scale = 1 # detection on image reduced by this factor (1, 2 or 4)
+        self.min_area = 1 # min blob area in pixels (at detection scale)
+        self.fill_th = 0.5 # min ratio of blob area over its bounding box area
+        self.max_blobs = 16 # max number of blobs refined per frame (biggest first)
+        self.height = 0
+        self.width = 0
         
         # A simple frame counter used to demonstrate sendSerial():
         self.frame = 0
@@ -48,109 +64,302 @@ class UavLedDetector:
         # Instantiate a JeVois Timer to measure our processing framerate:
         self.timer = jevois.Timer("sample", 100, jevois.LOG_INFO)
 
+        # Per-stage timing statistics (disabled by default, see 'stats' commands)
+        self.stages = StageTimer()
+
+        # Serial output (direct by default, see 'serial' commands)
+        self.serial = SerialQueue(jevois.sendSerial)
+
+        # Asynchronous frame recording (see 'record' commands)
+        self.recorder = FrameRecorder()
+
+        # Running background model of bright pixels (see 'bg' commands)
+        self.use_background = False
+        self.background = BrightBackground()
+        self.protect_targets = True # keep current targets out of the background
+
+        # Multi-target tracking mode (see 'track' commands)
+        self.tracking = False
+        self.tracker = LedTracker()
+
     # ###################################################################################################
     ## Process function with no USB output
     def processNoUSB(self, inframe):
-        # Get the next camera image (may block until it is captured) and convert it to OpenCV GRAY:
-        img = inframe.getCvBGR()
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        self.height, self.width = gray.shape
-        blur = cv2.GaussianBlur(gray,(5,5),0)
-        ret,th = cv2.threshold(blur,self.threshold,255,cv2.THRESH_BINARY)
-        if self.set_mask:
-            self.mask = cv2.dilate(th, np.ones((10,10), np.uint8), iterations=1)
-            self.mask = cv2.bitwise_not(self.mask)
-            self.set_mask = False
-        th_masked = cv2.bitwise_and(th, th, mask=self.mask)
-        image, contours, hierarchy = cv2.findContours(th_masked,cv2.RETR_TREE,cv2.CHAIN_APPROX_SIMPLE)
-        for cnt in contours:
-            ## rotated rectangle (min area)
-            rect = cv2.minAreaRect(cnt)
-            ((x, y), (w, h), _) = rect
-            if abs(w - h) > 10: # not square
-                continue
-            self.x = x-self.width/2
-            self.y = -(y-self.height/2)
-            self.area = w * h
-            jevois.sendSerial("POS {:.2f} {:.2f} {:.2f}".format(self.x, self.y, self.area))
+        # call process without outframe
+        self.process(inframe)
 
     # ###################################################################################################
-    ## Process function with USB output
-    def process(self, inframe, outframe):
-        # Get the next camera image (may block until it is captured) and convert it to OpenCV GRAY:
-        img = inframe.getCvBGR()
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-#        circles = cv2.HoughCircles(img,cv2.HOUGH_GRADIENT,1,20,param1=50,param2=30,minRadius=0,maxRadius=0)
-
-        # Get image width, height, channels in pixels. Beware that if you change this module to get img as a grayscale
-        # image, then you should change the line below to: "height, width = img.shape" otherwise numpy will throw. See
-        # how it is done in the PythonOpenCv module of jevoisbase:
-        self.height, self.width = gray.shape
-        jevois.LINFO("{} {}".format(self.height, self.width))
+    ## Process function with or without USB output
+    def process(self, inframe, outframe = None):
+        self.stages.begin()
+        self.timer.start()
+        # Get the luminance of the next camera image directly (may block until it is captured):
+        gray = inframe.getCvGRAY()
+        stamp = time.time() * 1000.
+        self.stages.mark("convert")
 
-        # Draw red cross
-        cv2.line(img,(int(self.width/2),int(self.height*0.1)), (int(self.width/2),int(self.height*0.9)), (0,0,255),2)
-        cv2.line(img,(int(self.width*0.1),int(self.height/2)), (int(self.width*0.9),int(self.height/2)), (0,0,255),2)
+        binary = self.serial.binary()
+        targets = [] # (id, flags, x, y, w, h) for binary output
+        if self.tracking:
+            # search only around the predicted tracks between full frame scans
+            windows = self.tracker.windows(gray.shape)
+            if self.set_mask:
+                windows = None
+            rects = self.detect(gray, windows)
+            self.tracker.update(rects, windows is None)
+            self.stages.mark("track")
+            # one message per confirmed track, with the number of frames since its last detection
+            # (0 if measured in this frame, predicted position otherwise)
+            for t in self.tracker.confirmed():
+                self.x = t.x-self.width/2
+                self.y = -(t.y-self.height/2)
+                self.area = t.w * t.h
+                if binary:
+                    targets.append((t.id, t.misses, self.x, self.y, t.w, t.h))
+                else:
+                    self.serial.send("TRK {} {:.2f} {:.2f} {:.2f} {}".format(t.id, self.x, self.y, self.area, t.misses), ("TRK", t.id))
+        else:
+            rects = self.detect(gray)
+            msgs = []
+            for i, rect in enumerate(rects):
+                ((x, y), (w, h), _) = rect
+                self.x = x-self.width/2
+                self.y = -(y-self.height/2)
+                self.area = w * h
+                if binary:
+                    targets.append((i, 0, self.x, self.y, w, h))
+                elif outframe is None:
+                    msgs.append("POS {:.2f} {:.2f} {:.2f}".format(self.x, self.y, self.area))
+                else:
+                    msgs.append("POS {:.2f} {:.2f} {:.3f} {:.3f} {:.4f} {}".format(self.x, self.y, w, h, self.area, self.frame))
+            if not binary:
+                # blobs have no identity between frames: the POS of a frame replace all the waiting ones
+                self.serial.send_group(msgs, "POS")
+        if binary:
+            # all targets of the frame in a single message
+            self.serial.send(encode_frame(KIND_TRK if self.tracking else KIND_POS, self.frame, stamp, targets), "BIN")
+        self.stages.mark("serial")
 
-        #if self.mask is None:
-        #    self.mask = np.zeros(gray.shape, np.uint8)
+        if self.use_background:
+            self.background.update(gray, self.threshold, self.target_boxes(rects) if self.protect_targets else ())
+            self.stages.mark("background")
 
-        # Start measuring image processing time (NOTE: does not account for input conversion time):
-        self.timer.start()
+        if self.recorder.add(gray, self.frame, stamp, [(x, y, w, h) for ((x, y), (w, h), _) in rects]):
+            self.stages.mark("record")
 
-        blur = cv2.GaussianBlur(gray,(5,5),0)
-        ret,th = cv2.threshold(blur,self.threshold,255,cv2.THRESH_BINARY)
-        if self.set_mask:
-            self.mask = cv2.dilate(th, np.ones((10,10), np.uint8), iterations=1)
-            self.mask = cv2.bitwise_not(self.mask)
-            self.set_mask = False
-        th_masked = cv2.bitwise_and(th, th, mask=self.mask)
-        image, contours, hierarchy = cv2.findContours(th_masked,cv2.RETR_TREE,cv2.CHAIN_APPROX_SIMPLE)
-        for cnt in contours:
-            ## rotated rectangle (min area)
-            rect = cv2.minAreaRect(cnt)
-            ((x, y), (w, h), _) = rect
-            if abs(w - h) > 10: # not square
-                continue
-            self.x = x-self.width/2
-            self.y = -(y-self.height/2)
-            self.area = w * h
-            box = np.int0(cv2.boxPoints(rect))
-            cv2.drawContours(img, [box], 0, (0,255,0), 3)
-            jevois.sendSerial("POS {:.2f} {:.2f} {:.3f} {:.3f} {:.4f} {}".format(self.x, self.y, w, h, self.area, self.frame))
-            
         # Write frames/s info from our timer (NOTE: does not account for output conversion time):
         fps = self.timer.stop()
-        c = (255,255,255)
-        if len(contours) > 0:
-            c = (0,0,255)
-        cv2.putText(img, fps, (3, self.height - 6), cv2.FONT_HERSHEY_SIMPLEX, 0.5, c, 1, cv2.LINE_AA)
-    
-        # Convert our image to video output format and send to host over USB:
-        outframe.sendCv(img)
-         
+
+        if outframe is not None:
+            # Color image is only needed for display
+            img = inframe.getCvBGR()
+            self.stages.mark("convert")
+
+            # Draw red cross
+            cv2.line(img,(int(self.width/2),int(self.height*0.1)), (int(self.width/2),int(self.height*0.9)), (0,0,255),2)
+            cv2.line(img,(int(self.width*0.1),int(self.height/2)), (int(self.width*0.9),int(self.height/2)), (0,0,255),2)
+            for rect in rects:
+                box = cv2.boxPoints(rect).astype(np.int32)
+                cv2.drawContours(img, [box], 0, (0,255,0), 3)
+            if self.tracking:
+                for (x0, y0, x1, y1) in windows or []:
+                    cv2.rectangle(img, (x0, y0), (x1 - 1, y1 - 1), (255,0,0), 1)
+                for t in self.tracker.confirmed():
+                    cv2.putText(img, str(t.id), (int(t.x + t.size()), int(t.y - t.size())), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,255,0), 1, cv2.LINE_AA)
+            c = (255,255,255)
+            if len(rects) > 0:
+                c = (0,0,255)
+            cv2.putText(img, fps, (3, self.height - 6), cv2.FONT_HERSHEY_SIMPLEX, 0.5, c, 1, cv2.LINE_AA)
+            self.stages.mark("draw")
+
+            # Convert our image to video output format and send to host over USB:
+            outframe.sendCv(img)
+            self.stages.mark("send")
+        self.stages.end()
+
         # Send a string over serial (e.g., to an Arduino). Remember to tell the JeVois Engine to display those messages,
         # as they are turned off by default. For example: 'setpar serout All' in the JeVois console:
         #jevois.sendSerial("DONE frame {}".format(self.frame));
         self.frame += 1
 
+    # ###################################################################################################
+    ## Boxes (x0, y0, x1, y1) around the detected rects and the confirmed tracks (full resolution)
+    # The margin of one background cell covers the blur and the halo of the LED.
+    def target_boxes(self, rects):
+        targets = [(x, y, max(w, h)) for ((x, y), (w, h), _) in rects]
+        if self.tracking:
+            targets += [(t.x, t.y, t.size()) for t in self.tracker.confirmed()]
+        m = self.background.cell
+        return [(int(x - s / 2 - m), int(y - s / 2 - m), int(x + s / 2 + m) + 1, int(y + s / 2 + m) + 1) for (x, y, s) in targets]
+
+    # ###################################################################################################
+    ## Detection pipeline on the gray image
+    # Detection is done on the image reduced by self.scale (1, 2 or 4). Bright blobs are extracted with
+    # connected components and filtered all at once on area, squareness and fill ratio. The position of the
+    # remaining blobs is refined at full resolution with an intensity-weighted centroid.
+    # If a list of windows (x0, y0, x1, y1) is given, only these parts of the image are searched.
+    # Returns the list of accepted rectangles ((x, y), (w, h), angle) in full resolution.
+    def detect(self, gray, windows=None):
+        self.height, self.width = gray.shape
+        s = self.scale
+        sw, sh = self.width // s, self.height // s # size of the reduced image
+        if windows is None or self.set_mask:
+            windows = [(0, 0, self.width, self.height)] # mask is built on the full frame
+        rects = []
+        for (x0, y0, x1, y1) in windows:
+            # window in the reduced image
+            rx0, ry0 = x0 // s, y0 // s
+            rx1, ry1 = min(sw, (x1 + s - 1) // s), min(sh, (y1 + s - 1) // s)
+            if rx1 <= rx0 or ry1 <= ry0:
+                continue
+            rects += self.detect_window(gray, rx0, ry0, rx1, ry1)
+        return rects
+
+    # ###################################################################################################
+    ## Detection in the window (x0, y0, x1, y1) of the reduced image
+    def detect_window(self, gray, x0, y0, x1, y1):
+        s = self.scale
+        roi = gray[y0*s:y1*s, x0*s:x1*s]
+        if s > 1:
+            # area interpolation already smooths the image, no need for extra blur
+            small = cv2.resize(roi, (x1 - x0, y1 - y0), interpolation=cv2.INTER_AREA)
+        else:
+            small = cv2.GaussianBlur(roi,(5,5),0)
+        self.stages.mark("blur")
+        ret,th = cv2.threshold(small,self.threshold,255,cv2.THRESH_BINARY)
+        if self.set_mask:
+            k = max(1, 10 // s) # same margin at all scales
+            self.mask = cv2.dilate(th, np.ones((k,k), np.uint8), iterations=1)
+            self.mask = cv2.bitwise_not(self.mask)
+            self.set_mask = False
+        if self.mask is not None:
+            if self.mask.shape != (self.height // s, self.width // s):
+                # detection scale changed since the mask was set
+                self.mask = cv2.resize(self.mask, (self.width // s, self.height // s), interpolation=cv2.INTER_NEAREST)
+            th = cv2.bitwise_and(th, th, mask=self.mask[y0:y1, x0:x1])
+        if self.use_background:
+            bg_mask = self.background.get_mask((self.height // s, self.width // s))
+            if bg_mask is not None:
+                th = cv2.bitwise_and(th, th, mask=bg_mask[y0:y1, x0:x1])
+        self.stages.mark("threshold")
+        # connected components only on the area holding bright pixels
+        bx, by, bw, bh = cv2.boundingRect(th)
+        if bw == 0 or bh == 0:
+            self.stages.mark("components")
+            return []
+        ltype = cv2.CV_16U if bw * bh < 4 * 65535 else cv2.CV_32S # max nb of 8-connected blobs is area/4
+        nb, labels, stats, _ = cv2.connectedComponentsWithStats(th[by:by+bh, bx:bx+bw], connectivity=8, ltype=ltype)
+        bx += x0
+        by += y0
+        stats[:, cv2.CC_STAT_LEFT] += bx
+        stats[:, cv2.CC_STAT_TOP] += by
+        self.stages.mark("components")
+
+        # vectorized filtering of all blobs (label 0 is the background)
+        w = stats[1:, cv2.CC_STAT_WIDTH]
+        h = stats[1:, cv2.CC_STAT_HEIGHT]
+        area = stats[1:, cv2.CC_STAT_AREA]
+        keep = (area >= self.min_area) & (np.abs(w - h) * s <= 10) & (area >= self.fill_th * w * h)
+        idx = np.flatnonzero(keep)
+        if len(idx) > self.max_blobs:
+            idx = idx[np.argsort(-area[idx], kind='mergesort')[:self.max_blobs]] # keep biggest ones
+        rects = [self.centroid(gray, labels, (bx, by), i + 1, stats[i + 1]) for i in idx]
+        self.stages.mark("select")
+        return rects
+
+    # ###################################################################################################
+    ## Intensity-weighted sub-pixel centroid at full resolution of a blob found on the (reduced) image
+    def centroid(self, gray, labels, offset, label, stat):
+        s = self.scale
+        x, y, w, h = [int(v) for v in stat[:4]]
+        pad = 2 * s + 2 # blur kernel and rounding margin
+        x0, y0 = max(0, x * s - pad), max(0, y * s - pad)
+        x1, y1 = min(self.width, (x + w) * s + pad), min(self.height, (y + h) * s + pad)
+        roi = cv2.GaussianBlur(gray[y0:y1, x0:x1],(5,5),0)
+        # blob region at full resolution (excludes neighbor blobs)
+        lx0, ly0 = x0 // s, y0 // s
+        lx1, ly1 = (x1 + s - 1) // s, (y1 + s - 1) // s
+        region = np.zeros((ly1 - ly0, lx1 - lx0), np.uint8)
+        # copy the part of the label image (with given offset) overlapping the region
+        ox, oy = offset
+        cx0, cy0 = max(lx0, ox), max(ly0, oy)
+        cx1, cy1 = min(lx1, ox + labels.shape[1]), min(ly1, oy + labels.shape[0])
+        region[cy0-ly0:cy1-ly0, cx0-lx0:cx1-lx0] = labels[cy0-oy:cy1-oy, cx0-ox:cx1-ox] == label
+        if s > 1:
+            region = cv2.resize(region, ((lx1 - lx0) * s, (ly1 - ly0) * s), interpolation=cv2.INTER_NEAREST)
+            region = region[y0 - ly0 * s:y1 - ly0 * s, x0 - lx0 * s:x1 - lx0 * s]
+        region = cv2.dilate(region, np.ones((2 * s + 1, 2 * s + 1), np.uint8))
+        weights = (roi.astype(np.float32) - self.threshold) * region
+        weights[weights < 0.] = 0.
+        total = weights.sum()
+        if total <= 0.:
+            # keep the reduced resolution estimate
+            return (((x + w / 2.) * s - 0.5, (y + h / 2.) * s - 0.5), (float(w * s), float(h * s)), 0.)
+        wx = weights.sum(axis=0)
+        wy = weights.sum(axis=1)
+        cx = np.dot(wx, np.arange(len(wx))) / total
+        cy = np.dot(wy, np.arange(len(wy))) / total
+        cols = np.flatnonzero(wx)
+        rows = np.flatnonzero(wy)
+        return ((x0 + cx, y0 + cy), (float(cols[-1] - cols[0] + 1), float(rows[-1] - rows[0] + 1)), 0.)
+
     # ###################################################################################################
     ## Parse a serial command forwarded to us by the JeVois Engine, return a string
     # This function is optional and only needed if you want your module to handle custom commands. Delete if not needed.
     def parseSerial(self, str):
         print("parseserial received command [{}]".format(str))
         str_list = str.split(' ')
+        stats = self.stages.parse_command(str_list)
+        if stats is not None:
+            return stats
+        serial = self.serial.parse_command(str_list)
+        if serial is not None:
+            return serial
+        record = self.recorder.parse_command(str_list)
+        if record is not None:
+            return record
         if str == "set_mask":
             self.set_mask = True
             return("Mask set")
         elif str == "clear_mask":
-            self.mask = np.zeros((self.height, self.width), np.uint8)
-            self.mask = cv2.bitwise_not(self.mask)
+            self.mask = None
             return("Mask cleared")
         elif len(str_list) == 2 and str_list[0] == "set_thres" and str_list[1].isdigit():
             self.threshold = max(0, min(255, int(str_list[1])))
             return("Threshold set")
+        elif len(str_list) == 2 and str_list[0] == "set_scale" and str_list[1] in ["1", "2", "4"]:
+            self.scale = int(str_list[1])
+            return("Scale set")
+        elif len(str_list) == 2 and str_list[0] == "set_max_blobs" and str_list[1].isdigit():
+            self.max_blobs = max(1, int(str_list[1]))
+            return("Max blobs set")
+        elif len(str_list) == 2 and str_list[0] == "track" and str_list[1] in ["on", "off"]:
+            self.tracking = str_list[1] == "on"
+            self.tracker.reset()
+            return("Tracking " + str_list[1])
+        elif len(str_list) == 3 and str_list[0] == "track" and str_list[1] == "refresh" and str_list[2].isdigit():
+            self.tracker.refresh = max(1, int(str_list[2]))
+            return("Refresh set")
+        elif len(str_list) == 1 and str_list[0] == "track":
+            return self.tracker.status()
+        elif len(str_list) == 2 and str_list[0] == "bg" and str_list[1] in ["on", "off"]:
+            self.use_background = str_list[1] == "on"
+            self.background.reset()
+            return("Background " + str_list[1])
+        elif len(str_list) == 2 and str_list[0] == "bg" and str_list[1] in ["freeze", "run"]:
+            self.background.frozen = str_list[1] == "freeze"
+            return("Background " + str_list[1])
+        elif len(str_list) == 2 and str_list[0] == "bg" and str_list[1] == "reset":
+            self.background.reset()
+            return("Background reset")
+        elif len(str_list) == 3 and str_list[0] == "bg" and str_list[1] == "protect" and str_list[2] in ["on", "off"]:
+            self.protect_targets = str_list[2] == "on"
+            return("Background protect " + str_list[2])
+        elif len(str_list) == 3 and str_list[0] == "bg" and str_list[1] == "rate" and str_list[2].isdigit():
+            self.background.rate = max(1, int(str_list[2]))
+            return("Background rate set")
+        elif len(str_list) == 1 and str_list[0] == "bg":
+            return self.background.status()
         return "ERR: Unsupported command"
     
     # ###################################################################################################
@@ -158,5 +367,5 @@ class UavLedDetector:
     # This function is optional and only needed if you want your module to handle custom commands. Delete if not needed.
     def supportedCommands(self):
         # use \n seperator if your module supports several commands
-        return "set_mask - hide visible objects from the scene\nclear_mask - clear all mask (show all objects)"
+        return "set_mask - hide visible objects from the scene\nclear_mask - clear all mask (show all objects)\nset_thres T - set brightness threshold (0-255)\nset_scale S - detect on image reduced by S (1, 2 or 4)\nset_max_blobs N - max number of blobs reported per frame\ntrack on|off - track LEDs with IDs, send TRK id x y area misses per confirmed track instead of POS (misses: frames since last detection, 0 if measured)\ntrack refresh N - full frame search every N frames (predicted windows only in between)\ntrack - report number of tracks\nbg on|off - mask bright background learned over time (in addition to set_mask)\nbg freeze|run - stop or resume background updates\nbg reset - learn background again from next frame\nbg rate N - update background every N frames\nbg protect on|off - keep (or not) the current detections and tracks out of the background (on by default)\nbg - report background model state\nserial queue on|off - send messages from a writer thread, keeping the latest of each kind\nserial rate R - max messages per second in queue mode (0 for no limit)\nserial proto text|bin [device] - text messages or one binary frame per video frame written to device (/dev/ttyS0 by default)\nserial [reset] - report (or reset) sent, coalesced and dropped counters\nrecord start [jpg|raw] - record frames and detections from a writer thread (JPEG files or raw frames)\nrecord stop - stop recording\nrecord snapshot [NAME] - save next frame as PNG\nrecord every N - record one frame every N\nrecord [reset] - report (or reset) waiting frames, written and dropped counters\nstats [reset|on|off] - per-stage timing statistics"
 
@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# offline libjevois stand-in, shared helpers and module directories
+for d in ['Offline', 'Common', 'UavLedDetector', 'ImavMailbox', 'FaceDetect']:
+    sys.path.insert(0, os.path.join(ROOT_DIR, d))
@@ -0,0 +1,26 @@
+import numpy as np
+from BackgroundLed import BrightBackground
+
+def run_light(x, y, size, nb=100):
+    bg = BrightBackground(rate=1)
+    gray = np.zeros((480, 640), np.uint8)
+    gray[y:y + size, x:x + size] = 255
+    for _ in range(nb):
+        bg.update(gray, 200)
+    return bg.get_mask(gray.shape)[y:y + size, x:x + size]
+
+def test_small_static_light_masked():
+    assert not run_light(101, 201, 2).any() # inside a single cell
+    assert not run_light(13, 301, 4).any() # split across cells
+
+def test_light_forgotten():
+    bg = BrightBackground(rate=1)
+    gray = np.zeros((240, 320), np.uint8)
+    gray[100:103, 100:103] = 255
+    for _ in range(50):
+        bg.update(gray, 200)
+    assert not bg.get_mask(gray.shape)[100:103, 100:103].any()
+    gray[:] = 0
+    for _ in range(50):
+        bg.update(gray, 200)
+    assert bg.get_mask(gray.shape).all()
@@ -0,0 +1,15 @@
+import numpy as np
+from benchmark import noise
+
+def test_noise_zero_mean():
+    rng = np.random.RandomState(0)
+    img = np.full((200, 200, 3), 100, np.uint8)
+    out = noise(rng, img, 8.)
+    assert out.dtype == np.uint8 and out.shape == img.shape
+    assert abs(out.astype(float).mean() - 100.) < 0.2
+    assert abs(out.astype(float).std() - 8.) < 0.3
+
+def test_noise_saturates():
+    rng = np.random.RandomState(0)
+    out = noise(rng, np.array([[0, 255]] * 1000, np.uint8), 8.)
+    assert out[:, 0].min() == 0 and out[:, 1].max() == 255
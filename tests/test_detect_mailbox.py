@@ -0,0 +1,13 @@
+import numpy as np
+from DetectMailbox import MailboxDetector, reduce_image
+
+def test_reduced_level_same_size():
+    detector = MailboxDetector([[0, 0, 0], [179, 255, 255]], 1000)
+    for (x, y, side) in [(100, 120, 60), (300, 200, 120), (400, 40, 100)]:
+        mask = np.zeros((480, 640), np.uint8)
+        mask[y:y + side, x:x + side] = 255
+        (_, _, full), = detector.candidates(mask)
+        for level in [1, 2]:
+            (_, _, small), = detector.candidates(reduce_image(mask, level), scale=1 << level)
+            assert np.allclose(small[0], full[0], atol=0.5), (level, small, full)
+            assert np.allclose(small[1], full[1], atol=0.5), (level, small, full)
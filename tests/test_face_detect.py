@@ -0,0 +1,78 @@
+import threading
+import time
+import numpy as np
+import libjevois as jevois
+from FaceDetect import FaceDetect
+
+FACE = (100, 80, 60, 60)
+
+class StubDetector:
+    def __init__(self):
+        self.calls = 0
+        self.name = "stub"
+
+    def detect(self, gray, roi=None, min_size=(30, 30), max_size=None, equalize=False):
+        self.calls += 1
+        return [FACE]
+
+    def search_window(self, shape, rect, pad=0.5, band=(0.7, 1.4)):
+        return None
+
+class StubTracker:
+    confidence = 1.
+
+    def init(self, gray, rect):
+        pass
+
+    def track(self, gray):
+        return FACE, 1.
+
+def run_frames(module, nb):
+    '''
+    return the indexes of the frames where face detection was run
+    '''
+    gray = np.zeros((240, 320), np.uint8)
+    frames = []
+    for i in range(nb):
+        calls = module.face_detector.calls
+        module.find_face(gray, module.stages)
+        if module.face_detector.calls > calls:
+            frames.append(i)
+    return frames
+
+def make_module():
+    jevois.log_level = jevois.LOG_ERR
+    module = FaceDetect()
+    module.face_detector = StubDetector()
+    module.tracker = StubTracker()
+    return module
+
+def test_detect_every_n_frames():
+    for n in [1, 2, 3, 5]:
+        module = make_module()
+        assert module.parseSerial("detect_every {}".format(n)) == "OK"
+        assert run_frames(module, 20) == list(range(0, 20, n))
+
+def test_detect_every_change_detects_next_frame():
+    module = make_module()
+    module.parseSerial("detect_every 3")
+    run_frames(module, 2)
+    module.parseSerial("detect_every 4")
+    assert run_frames(module, 9) == [0, 4, 8]
+
+def test_backend_change_in_pipeline_worker():
+    module = make_module()
+    names = []
+    module.set_backend = lambda name, factor: names.append((name, factor, threading.current_thread().name))
+    module.parseSerial("pipeline on")
+    try:
+        assert module.parseSerial("backend lbp 2") == "OK"
+        end = time.time() + 2.
+        while len(names) == 0 and time.time() < end:
+            time.sleep(0.001)
+    finally:
+        module.parseSerial("pipeline off")
+    assert names == [("lbp", 2, "pipeline")]
+    # applied directly when the pipeline is off
+    module.parseSerial("backend haar")
+    assert names[-1] == ("haar", 1, threading.current_thread().name)
@@ -0,0 +1,39 @@
+import os
+import time
+import numpy as np
+from FrameRecorder import FrameRecorder
+
+def wait_written(recorder, nb, timeout=5.):
+    end = time.time() + timeout
+    while recorder.written + recorder.errors < nb and time.time() < end:
+        time.sleep(0.01)
+
+def test_sessions_same_second(tmp_path):
+    recorder = FrameRecorder(str(tmp_path))
+    img = np.zeros((8, 8), np.uint8)
+    first = recorder.start_session("raw")
+    recorder.add(img, 0, 0.)
+    recorder.stop_session()
+    second = recorder.start_session("raw")
+    recorder.add(img, 1, 33.)
+    recorder.stop_session()
+    wait_written(recorder, 2)
+    assert first != second
+    for path in [first, second]:
+        with open(path + ".jsonl") as f:
+            assert len(f.readlines()) == 1
+
+def test_dropped_frame_keeps_snapshots(tmp_path):
+    recorder = FrameRecorder(str(tmp_path), slots=1)
+    recorder.start = lambda: None # writer not started, frames stay waiting
+    img = np.zeros((8, 8), np.uint8)
+    recorder.snapshot("first")
+    recorder.add(img, 0, 0.)
+    recorder.snapshot("second")
+    recorder.add(img + 1, 1, 33.)
+    assert recorder.dropped == 1
+    del recorder.start
+    recorder.start()
+    wait_written(recorder, 1)
+    assert os.path.exists(str(tmp_path / "first.png"))
+    assert os.path.exists(str(tmp_path / "second.png"))
@@ -0,0 +1,32 @@
+import os
+import cv2
+import numpy as np
+import libjevois as jevois
+import replay
+from ImavMailbox import ImavMailbox
+
+POINTS = [(320., 240.), (10.5, 12.), (630., 470.), (600.25, 30.), (25., 400.75), (200., 300.)]
+
+def send(module):
+    del jevois.serial_out[:]
+    detections = [(mark, 0, ((u, v), (40., 40.), 0.)) for mark, (u, v) in enumerate(POINTS)]
+    module.send_messages(detections, 0.)
+    return np.array([[float(v) for v in m.split()[2:4]] for m in jevois.serial_out])
+
+def test_fisheye_batch_matches_points():
+    module = ImavMailbox()
+    cmds = replay.read_script(os.path.join(replay.OFFLINE_DIR, '..', 'ImavMailbox', 'script.cfg.global'))
+    for cmd in cmds:
+        if cmd.startswith("calib_fisheye"):
+            assert module.parseSerial(cmd) == "OK"
+    K, D = module.calib_fisheye
+    xy = send(module)
+    expected = [1000. * cv2.fisheye.undistortPoints(np.array([[p]]), K, D).reshape(2) for p in POINTS]
+    assert np.allclose(xy, expected, atol=0.006) # messages have 2 decimals
+
+def test_pinhole_matches_formula():
+    module = ImavMailbox()
+    module.parseSerial("calib 760 780 322 238")
+    xy = send(module)
+    expected = [(1000. * (u - 322.) / 760., 1000. * (v - 238.) / 780.) for (u, v) in POINTS]
+    assert np.allclose(xy, expected, atol=0.006)
@@ -0,0 +1,42 @@
+from Mailbox_ortho import iter_tiles
+
+def test_tiles_striped_block():
+    # striped GeoTIFF: one row per block, tiles must not span the full width
+    tiles = list(iter_tiles(50000, 10000, 4096, 500, block=(50000, 1)))
+    assert max(w for (_, _, w, _) in tiles) <= 4096
+    assert max(h for (_, _, _, h) in tiles) <= 4096
+    assert (tiles[1][0], tiles[1][1]) == (3596, 0)
+
+def test_tiles_aligned_block():
+    tiles = list(iter_tiles(10000, 10000, 4096, 500, block=(256, 256)))
+    assert all(x % 256 == 0 and y % 256 == 0 for (x, y, _, _) in tiles)
+    assert max(w for (_, _, w, _) in tiles) <= 4096
+
+def test_batch_opens_image_once(tmp_path, monkeypatch):
+    import cv2
+    import numpy as np
+    import Mailbox_ortho
+    filename = str(tmp_path / "ortho.png")
+    cv2.imwrite(filename, np.full((600, 800, 3), 90, np.uint8))
+    reads = []
+    imread = cv2.imread
+    monkeypatch.setattr(Mailbox_ortho.cv2, 'imread', lambda *args: reads.append(args) or imread(*args))
+    _, megapixels, _, error = Mailbox_ortho.process_file((filename, 20, 512, None, None, 4))
+    assert error is None
+    assert megapixels == 0.48
+    assert len(reads) == 1
+
+def test_reader_geotiff_gray_16bits(tmp_path):
+    import numpy as np
+    import pytest
+    gdal = pytest.importorskip('osgeo.gdal')
+    from Mailbox_ortho import open_image_reader
+    filename = str(tmp_path / "ortho.tif")
+    ds = gdal.GetDriverByName('GTiff').Create(filename, 64, 48, 1, gdal.GDT_UInt16)
+    ds.GetRasterBand(1).WriteArray(np.full((48, 64), 200 * 256, np.uint16))
+    ds = None
+    width, height, _, read = open_image_reader(filename)
+    win = read(8, 8, 16, 16)
+    assert (width, height) == (64, 48)
+    assert win.shape == (16, 16, 3) and win.dtype == np.uint8
+    assert win.min() == win.max() == 200 # scaled like the OpenCV conversion, not wrapped
@@ -0,0 +1,53 @@
+import threading
+import time
+from Pipeline import Pipeline
+
+def wait_result(pipeline, timeout=2.):
+    end = time.time() + timeout
+    while time.time() < end:
+        res = pipeline.poll()
+        if res is not None:
+            return res
+        time.sleep(0.001)
+    return None
+
+def test_call_runs_in_worker_between_items():
+    log = []
+    def func(item):
+        log.append(("item", item, threading.current_thread().name))
+        time.sleep(0.02)
+        return item
+    pipeline = Pipeline(func)
+    pipeline.start()
+    try:
+        pipeline.submit(1)
+        time.sleep(0.005) # worker busy with item 1
+        pipeline.call(lambda: log.append(("call", None, threading.current_thread().name)))
+        pipeline.submit(2)
+        assert wait_result(pipeline)[1] in [1, 2]
+        while len(log) < 3:
+            time.sleep(0.001)
+    finally:
+        pipeline.stop()
+    assert [e[0] for e in log] == ["item", "call", "item"]
+    assert all(e[2] == "pipeline" for e in log)
+
+def test_call_direct_when_stopped():
+    log = []
+    pipeline = Pipeline(lambda item: item)
+    pipeline.call(lambda: log.append(threading.current_thread().name))
+    assert log == [threading.current_thread().name]
+
+def test_call_pending_at_stop_is_run():
+    log = []
+    started = threading.Event()
+    def func(item):
+        started.set()
+        time.sleep(0.05)
+    pipeline = Pipeline(func)
+    pipeline.start()
+    pipeline.submit(0)
+    started.wait(1.)
+    pipeline.call(lambda: log.append(1))
+    pipeline.stop()
+    assert log == [1]
@@ -0,0 +1,68 @@
+import threading
+import time
+from SerialQueue import SerialQueue
+
+class FailingPort:
+    device = "fail"
+
+    def write(self, data):
+        raise OSError(5, "Input/output error")
+
+    def close(self):
+        pass
+
+class SlowPort:
+    device = "slow"
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.closed = False
+        self.closed_during_write = None
+
+    def write(self, data):
+        self.started.set()
+        self.release.wait(2.)
+        self.closed_during_write = self.closed
+
+    def close(self):
+        self.closed = True
+
+def test_direct_write_error_counted():
+    serial = SerialQueue(lambda msg: None)
+    serial.port = FailingPort()
+    serial.send(b'\xa5\x5a')
+    assert (serial.sent, serial.errors) == (0, 1)
+
+def test_port_closed_after_writer_is_done():
+    serial = SerialQueue(lambda msg: None)
+    port = serial.port = SlowPort()
+    serial.start()
+    serial.send(b'\xa5\x5a')
+    assert port.started.wait(2.)
+    serial.set_binary(None)
+    assert not port.closed
+    port.release.set()
+    end = time.time() + 2.
+    while not port.closed and time.time() < end:
+        time.sleep(0.001)
+    serial.stop()
+    assert port.closed and port.closed_during_write is False
+    assert serial.sent == 1
+
+def test_group_replaces_waiting_messages():
+    serial = SerialQueue(lambda msg: None)
+    serial.running = True # no writer thread, messages stay waiting
+    serial.send("TRK 1", ("TRK", 1))
+    serial.send_group(["POS a", "POS b"], "POS")
+    serial.send_group(["POS c"], "POS")
+    assert list(serial.pending.values()) == ["TRK 1", "POS c"]
+    assert serial.coalesced == 2
+    serial.send_group([], "POS")
+    assert list(serial.pending.values()) == ["TRK 1"]
+
+def test_group_direct():
+    sent = []
+    serial = SerialQueue(sent.append)
+    serial.send_group(["POS a", "POS b"], "POS")
+    assert sent == ["POS a", "POS b"]
@@ -0,0 +1,20 @@
+from TrackLed import LedTracker, LedTrack
+
+def rect(x, y, size=4.):
+    return ((x, y), (size, size), 0.)
+
+def test_associate_per_track_gates():
+    tracker = LedTracker(gate=20.)
+    tracker.tracks = [LedTrack(0, rect(0., 0.)), LedTrack(1, rect(200., 0., 30.))] # gates 20 and 60
+    # the closest pair is outside the gate of the small track, the next one inside the gate of the big track
+    pairs = tracker.associate([rect(25., 0.), rect(240., 0.)])
+    assert pairs == [(1, 1)]
+
+def test_update_keeps_ids():
+    tracker = LedTracker(gate=20.)
+    tracker.tracks = [LedTrack(0, rect(0., 0.)), LedTrack(1, rect(200., 0., 30.))]
+    tracker.next_id = 2
+    tracker.update([rect(25., 0.), rect(240., 0., 30.)])
+    # big track keeps its id, tentative small track is dropped and its detection starts a new one
+    assert sorted(t.id for t in tracker.tracks) == [1, 2]
+    assert [t.x for t in tracker.tracks if t.id == 1][0] > 200.
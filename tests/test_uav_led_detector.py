@@ -0,0 +1,53 @@
+import numpy as np
+import libjevois as jevois
+from UavLedDetector import UavLedDetector
+
+class Frame:
+    def __init__(self, gray):
+        self.gray = gray
+
+    def getCvGRAY(self):
+        return self.gray
+
+def light(x, y, size):
+    gray = np.full((480, 640), 20, np.uint8)
+    gray[y:y + size, x:x + size] = 255
+    return gray
+
+def run(module, gray, nb):
+    module.process(Frame(np.full((480, 640), 20, np.uint8))) # static mask on an empty first frame
+    for _ in range(nb):
+        module.process(Frame(gray))
+    del jevois.serial_out[:]
+    return module.detect(gray)
+
+def test_stationary_target_not_learned():
+    module = UavLedDetector()
+    module.parseSerial("bg on")
+    rects = run(module, light(314, 234, 12), 400)
+    assert len(rects) == 1
+
+def test_stationary_track_not_learned():
+    module = UavLedDetector()
+    module.parseSerial("bg on")
+    module.parseSerial("track on")
+    run(module, light(314, 234, 12), 400)
+    assert len(module.tracker.confirmed()) == 1
+
+def test_static_light_learned_without_protection():
+    module = UavLedDetector()
+    module.parseSerial("bg on")
+    module.parseSerial("bg protect off")
+    rects = run(module, light(101, 201, 4), 400)
+    assert len(rects) == 0
+
+def test_predicted_tracks_marked():
+    module = UavLedDetector()
+    module.parseSerial("track on")
+    run(module, light(314, 234, 12), 10)
+    empty = np.full((480, 640), 20, np.uint8)
+    module.process(Frame(light(314, 234, 12)))
+    for _ in range(2):
+        module.process(Frame(empty))
+    trk = [m.split() for m in jevois.serial_out if m.startswith("TRK")]
+    assert [m[5] for m in trk] == ["0", "1", "2"]